@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+from scipy.stats import pearsonr, spearmanr
+from statsmodels.nonparametric.smoothers_lowess import lowess
+from result_store import load_results
+
+
+def load_frame(database, benchmark=None, columns=('benchmark', 'query', 'ted', 'time_difference')):
+    """
+    Load the results of the result store into a DataFrame, reading only the given columns.
+    Results without a time difference (runs without EXPLAIN ANALYZE) or without a TED (failed comparisons) are dropped.
+
+    Args:
+        database (str): Path to the SQLite result store.
+        benchmark (str or list of str, optional): Only load results of these benchmarks.
+        columns (tuple of str, optional): The columns to load.
+
+    Returns:
+        pandas.DataFrame: The results, one row per compared query.
+    """
+    frame = pd.DataFrame(load_results(database, columns=list(columns), benchmark=benchmark))
+    if 'time_difference' in frame:
+        frame = frame.dropna(subset=['time_difference'])
+    if 'ted' in frame:
+        frame = frame.dropna(subset=['ted'])
+    # Use compact numeric columns, so that millions of rows fit comfortably in memory
+    if 'ted' in frame:
+        frame['ted'] = frame['ted'].astype(np.int32)
+    if 'benchmark' in frame:
+        frame['benchmark'] = frame['benchmark'].astype('category')
+    return frame.reset_index(drop=True)
+
+
+def outlier_mask(frame, column='time_difference', threshold=2.0, by=None):
+    """
+    Find the rows whose value lies within threshold standard deviations of the mean.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        column (str, optional): The column to check for outliers. Defaults to 'time_difference'.
+        threshold (float, optional): Number of standard deviations a value may differ from the mean. Defaults to 2.0.
+        by (str, optional): Compute the mean and standard deviation per group of this column (e.g. 'benchmark')
+            instead of over all rows. Defaults to None.
+
+    Returns:
+        numpy.ndarray: A boolean mask that is True for the rows that are not outliers.
+    """
+    values = frame[column].to_numpy(dtype=np.float64)
+    if by is None:
+        mean = values.mean()
+        std = values.std()
+    else:
+        # Broadcast the statistics of each group back to its rows
+        grouped = frame.groupby(by, observed=True)[column]
+        mean = grouped.transform('mean').to_numpy(dtype=np.float64)
+        std = grouped.transform('std', ddof=0).to_numpy(dtype=np.float64)
+    return np.abs(values - mean) < threshold * std
+
+
+def remove_outliers(frame, column='time_difference', threshold=2.0, by=None):
+    """
+    Split the results into the rows within threshold standard deviations of the mean and the outliers.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        column (str, optional): The column to check for outliers. Defaults to 'time_difference'.
+        threshold (float, optional): Number of standard deviations a value may differ from the mean. Defaults to 2.0.
+        by (str, optional): Compute the statistics per group of this column. Defaults to None.
+
+    Returns:
+        tuple: A tuple containing the DataFrame without the outliers and the DataFrame of the outliers.
+    """
+    mask = outlier_mask(frame, column, threshold, by)
+    return frame[mask], frame[~mask]
+
+
+def cache_effects(frame, threshold=0.1):
+    """
+    Add the share of blocks read from outside the shared buffers to the results (requires the shared_hit_blocks_*
+    and shared_read_blocks_* columns, stored with --explain-options BUFFERS) and flag the pairs where either plan
+    ran with a cold cache. Comparing only the warm pairs separates the cache effects from the plan effects.
+
+    Args:
+        frame (pandas.DataFrame): The results, loaded with the buffer columns.
+        threshold (float, optional): A plan is cold if more than this share of its blocks was read. Defaults to 0.1.
+
+    Returns:
+        pandas.DataFrame: A copy of the results with the columns read_ratio_1, read_ratio_2 and cold.
+            Pairs without buffer counters have a NaN ratio and are not cold.
+    """
+    frame = frame.copy()
+    for side in (1, 2):
+        hit = frame[f'shared_hit_blocks_{side}'].to_numpy(dtype=np.float64)
+        read = frame[f'shared_read_blocks_{side}'].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            frame[f'read_ratio_{side}'] = read / (hit + read)
+    # NaN comparisons are False, so pairs without counters count as warm
+    frame['cold'] = (frame['read_ratio_1'] > threshold) | (frame['read_ratio_2'] > threshold)
+    return frame
+
+
+def correlations(frame, x='ted', y='time_difference'):
+    """
+    Compute the Pearson and Spearman correlation coefficients between two columns.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        x (str, optional): The first column. Defaults to 'ted'.
+        y (str, optional): The second column. Defaults to 'time_difference'.
+
+    Returns:
+        dict: The Pearson and Spearman coefficients and their p-values, or NaN if there are too few rows.
+    """
+    xs = frame[x].to_numpy(dtype=np.float64)
+    ys = frame[y].to_numpy(dtype=np.float64)
+    # Correlations are undefined for fewer than two points or constant columns
+    if len(xs) < 2 or np.all(xs == xs[0]) or np.all(ys == ys[0]):
+        return {"pearson": np.nan, "pearson_p": np.nan, "spearman": np.nan, "spearman_p": np.nan}
+    pearson, pearson_p = pearsonr(xs, ys)
+    spearman, spearman_p = spearmanr(xs, ys)
+    return {"pearson": float(pearson), "pearson_p": float(pearson_p),
+            "spearman": float(spearman), "spearman_p": float(spearman_p)}
+
+
+def linear_fit(frame, x='ted', y='time_difference'):
+    """
+    Fit a line of best fit through the results.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        x (str, optional): The column on the x axis. Defaults to 'ted'.
+        y (str, optional): The column on the y axis. Defaults to 'time_difference'.
+
+    Returns:
+        tuple: The slope and intercept of the line, or (NaN, NaN) if there are too few distinct x values.
+    """
+    xs = frame[x].to_numpy(dtype=np.float64)
+    ys = frame[y].to_numpy(dtype=np.float64)
+    if len(np.unique(xs)) < 2:
+        return np.nan, np.nan
+    m, b = np.polyfit(xs, ys, 1)
+    return float(m), float(b)
+
+
+def lowess_fit(frame, x='ted', y='time_difference', frac=0.3):
+    """
+    Compute a LOWESS curve through the results.
+    For large inputs the curve is only evaluated on points at least 1% of the x range apart
+    and linearly interpolated in between, which keeps it fast for millions of rows.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        x (str, optional): The column on the x axis. Defaults to 'ted'.
+        y (str, optional): The column on the y axis. Defaults to 'time_difference'.
+        frac (float, optional): The fraction of the data used for each local fit. Defaults to 0.3.
+
+    Returns:
+        numpy.ndarray: An array of shape (n, 2) with the sorted x values and the smoothed y values.
+    """
+    xs = frame[x].to_numpy(dtype=np.float64)
+    ys = frame[y].to_numpy(dtype=np.float64)
+    if len(xs) < 2:
+        return np.empty((0, 2))
+    delta = 0.01 * (xs.max() - xs.min())
+    return lowess(ys, xs, frac=frac, delta=delta)
+
+
+def summarize(frame, by='benchmark', threshold=2.0):
+    """
+    Compute the outlier filtering, correlations and linear fit for all results and for each group.
+
+    Args:
+        frame (pandas.DataFrame): The results.
+        by (str, optional): The column to group the results by. Defaults to 'benchmark'.
+        threshold (float, optional): Number of standard deviations for the outlier filter. Defaults to 2.0.
+
+    Returns:
+        dict: A dictionary mapping 'all' and each group to its statistics.
+    """
+    groups = [("all", frame)]
+    if by in frame:
+        groups += [(str(name), group) for name, group in frame.groupby(by, observed=True)]
+
+    summary = {}
+    for name, group in groups:
+        filtered, outliers = remove_outliers(group, threshold=threshold)
+        m, b = linear_fit(filtered)
+        summary[name] = {"count": len(group), "outliers": len(outliers), "slope": m, "intercept": b,
+                         **correlations(filtered)}
+    return summary
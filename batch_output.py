@@ -0,0 +1,68 @@
+import json
+import sys
+
+
+def log(message):
+    """
+    Print a progress or diagnostic message to stderr so that stdout only carries results.
+
+    Args:
+        message (str): The message to print.
+    """
+    print(message, file=sys.stderr, flush=True)
+
+
+def emit_record(record, stream=None):
+    """
+    Write a single result as one JSON object per line (JSON Lines) and flush it immediately,
+    so that downstream tools can consume results while the batch is still running.
+
+    Args:
+        record (dict): The result of one compared query pair.
+        stream (file, optional): The stream to write to. Defaults to sys.stdout.
+    """
+    stream = stream if stream is not None else sys.stdout
+    stream.write(json.dumps(record) + "\n")
+    stream.flush()
+
+
+def parse_tool_output(res):
+    """
+    Parse the output of a tree_edit_distance_tool.py subprocess.
+
+    The tool prints its JSON result on stdout and any diagnostics on stderr,
+    so a run is only considered failed if the process exited with an error
+    or did not produce a JSON result.
+
+    Args:
+        res (subprocess.CompletedProcess): The completed tool process.
+
+    Returns:
+        dict or None: The parsed JSON result, or None if the run failed.
+    """
+    if res.returncode != 0 or not res.stdout.strip():
+        return None
+    try:
+        # The JSON result is always the last line printed by the tool
+        return json.loads(res.stdout.strip().splitlines()[-1])
+    except json.JSONDecodeError:
+        return None
+
+
+def option_value(argv, name, default=None):
+    """
+    Get the value that follows a command-line option, e.g. option_value(sys.argv, '--db') for "--db results.db".
+
+    Args:
+        argv (list of str): The command-line arguments.
+        name (str): The name of the option.
+        default (optional): The value returned if the option is not given. Defaults to None.
+
+    Returns:
+        str: The value of the option, or the default.
+    """
+    if name in argv:
+        index = argv.index(name) + 1
+        if index < len(argv):
+            return argv[index]
+    return default
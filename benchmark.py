@@ -0,0 +1,381 @@
+import os
+import sys
+import json
+import glob
+import time
+import copy
+import gc
+import random
+import tempfile
+import statistics
+import tracemalloc
+from apted import APTED
+from tree_edit_distance import json_to_tree, build_label, normalize_label, TreeConfig
+from tree_visualisation import plot_trees
+from tree_layout import layout_cache
+from batch_output import log, emit_record
+
+# Directory with recorded EXPLAIN JSON, one subdirectory per benchmark (e.g. benchmarks/plans/tpch)
+DEFAULT_PLAN_DIRECTORY = os.path.join("benchmarks", "plans")
+
+# Stages of the pipeline that are measured separately
+STAGES = ["parse", "conversion", "normalization", "ted", "rendering"]
+
+# Node types and attributes used by the synthetic plan generator
+JOIN_TYPES = ["Hash Join", "Nested Loop", "Merge Join"]
+SCAN_TYPES = ["Seq Scan", "Index Scan", "Bitmap Heap Scan"]
+UNARY_TYPES = ["Hash", "Sort", "Aggregate", "Materialize", "Limit"]
+
+
+def synthetic_node(node_type, number, rng, labels):
+    """
+    Create one synthetic plan node with the attributes json_to_tree uses for its node type.
+    The values include casts and quoted constants, so that the label normalization has work to do.
+    """
+    table = f"t{rng.randrange(labels)}"
+    column = f"c{rng.randrange(labels)}"
+    node = {"Node Type": node_type, "Output": [f"{table}.{column}", f"{table}.id"]}
+    if node_type in SCAN_TYPES:
+        node["Relation Name"] = table
+        node["Filter"] = f"(({column})::text = '{rng.randrange(labels)}'::text)"
+        if node_type == "Index Scan":
+            node["Index Name"] = f"{table}_pkey"
+            node["Index Cond"] = f"(id = '{number}'::numeric)"
+        elif node_type == "Bitmap Heap Scan":
+            node["Recheck Cond"] = f"({column} >= '2000-01-01'::date)"
+    elif node_type in JOIN_TYPES:
+        node["Join Type"] = rng.choice(["Inner", "Left", "Semi"])
+        node["Hash Cond"] = f"({table}.id = t{rng.randrange(labels)}.{column})"
+        node["Merge Cond"] = node["Hash Cond"]
+    elif node_type == "Sort":
+        node["Sort Key"] = [f"{table}.{column}"]
+    elif node_type == "Aggregate":
+        node["Group Key"] = [f"{table}.{column}"]
+    return node
+
+
+def synthetic_plan(depth=6, fan_out=2, labels=20, seed=0):
+    """
+    Generate a synthetic EXPLAIN result with a controllable size and label diversity.
+    Inner nodes are joins with fan_out children (one child for unary operators every few levels),
+    leaves are scans, so a plan has up to (fan_out^(depth+1) - 1) / (fan_out - 1) nodes.
+
+    Args:
+        depth (int, optional): The depth of the plan. Defaults to 6.
+        fan_out (int, optional): The number of children of a join. Defaults to 2.
+        labels (int, optional): The number of distinct tables and columns, i.e. the label diversity. Defaults to 20.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Returns:
+        list: The EXPLAIN result in the format returned by PostgreSQL.
+    """
+    rng = random.Random(seed)
+    counter = [0]
+
+    def generate(level):
+        counter[0] += 1
+        if level == depth:
+            return synthetic_node(rng.choice(SCAN_TYPES), counter[0], rng, labels)
+        if level % 3 == 2:
+            node = synthetic_node(rng.choice(UNARY_TYPES), counter[0], rng, labels)
+            node["Plans"] = [generate(level + 1)]
+        else:
+            node = synthetic_node(rng.choice(JOIN_TYPES), counter[0], rng, labels)
+            node["Plans"] = [generate(level + 1) for _ in range(fan_out)]
+        return node
+
+    return [{"Plan": generate(0)}]
+
+
+def mutate_plan(plan, rate=0.05, seed=0):
+    """
+    Copy a plan and change the node type of a fraction of its nodes, so that the pair has a non-zero TED.
+
+    Args:
+        plan (list): The EXPLAIN result.
+        rate (float, optional): The fraction of nodes that are changed. Defaults to 0.05.
+        seed (int, optional): The seed of the random generator. Defaults to 0.
+
+    Returns:
+        list: The changed copy of the plan.
+    """
+    rng = random.Random(seed)
+    plan = copy.deepcopy(plan)
+    stack = [plan[0]["Plan"]]
+    while stack:
+        node = stack.pop()
+        if rng.random() < rate:
+            # Swap the node type within its group, so that the plan stays valid
+            for group in (JOIN_TYPES, SCAN_TYPES):
+                if node["Node Type"] in group:
+                    node["Node Type"] = rng.choice([other for other in group if other != node["Node Type"]])
+        stack.extend(node.get("Plans", []))
+    return plan
+
+
+def synthetic_cases(sizes, fan_out=2, labels=20, rate=0.05):
+    """
+    Build the synthetic benchmark cases, one plan pair per depth.
+
+    Args:
+        sizes (list of int): The depths of the plans.
+        fan_out (int, optional): The number of children of a join. Defaults to 2.
+        labels (int, optional): The label diversity. Defaults to 20.
+        rate (float, optional): The fraction of nodes changed in the second plan. Defaults to 0.05.
+
+    Returns:
+        list of tuple: The cases as (name, JSON text of plan 1, JSON text of plan 2).
+    """
+    cases = []
+    for depth in sizes:
+        plan = synthetic_plan(depth, fan_out, labels, seed=depth)
+        cases.append((f"synthetic/depth{depth}-fan{fan_out}-labels{labels}", json.dumps(plan),
+                      json.dumps(mutate_plan(plan, rate, seed=depth))))
+    return cases
+
+
+def recorded_cases(directory=DEFAULT_PLAN_DIRECTORY):
+    """
+    Load the recorded EXPLAIN results stored with tree_edit_distance_tool.py --store.
+    A file <query>_explain.json is paired with <query>_explain_2.json if it exists, otherwise with itself.
+
+    Args:
+        directory (str, optional): The directory with one subdirectory of recorded plans per benchmark.
+
+    Returns:
+        list of tuple: The cases as (name, JSON text of plan 1, JSON text of plan 2).
+    """
+    cases = []
+    for path in sorted(glob.glob(os.path.join(directory, "*", "*_explain.json"))):
+        partner = path.replace("_explain.json", "_explain_2.json")
+        with open(path, 'r') as file:
+            text1 = file.read()
+        text2 = text1
+        if os.path.exists(partner):
+            with open(partner, 'r') as file:
+                text2 = file.read()
+        benchmark = os.path.basename(os.path.dirname(path))
+        cases.append((f"{benchmark}/{os.path.basename(path).replace('_explain.json', '')}", text1, text2))
+    return cases
+
+
+def count_nodes(plan):
+    """
+    Count the nodes of an EXPLAIN result.
+    """
+    while isinstance(plan, list):
+        plan = plan[0]
+    stack = [plan.get("Plan", plan)]
+    count = 0
+    while stack:
+        count += 1
+        stack.extend(stack.pop().get("Plans", []))
+    return count
+
+
+def raw_labels(plan):
+    """
+    Build the labels of all nodes of an EXPLAIN result before normalization.
+    """
+    while isinstance(plan, list):
+        plan = plan[0]
+    stack = [plan.get("Plan", plan)]
+    labels = []
+    while stack:
+        node = stack.pop()
+        labels.append(build_label(node))
+        stack.extend(node.get("Plans", []))
+    return labels
+
+
+def stage_functions(text1, text2, render_file):
+    """
+    Create the function measured for each stage of one case. Every stage gets fresh inputs prepared
+    outside of the measurement, because json_to_tree fills in missing attributes of the JSON objects.
+
+    Returns:
+        dict: A dictionary mapping each stage to a (prepare, run) pair of functions.
+    """
+    labels = raw_labels(json.loads(text1)) + raw_labels(json.loads(text2))
+    trees = (json_to_tree(json.loads(text1)), json_to_tree(json.loads(text2)))
+
+    def cold(prepare):
+        # Every repetition starts without normalized labels in the cache, like a new process
+        def wrapped():
+            normalize_label.cache_clear()
+            return prepare()
+        return wrapped
+
+    def render(_):
+        # Start with an empty layout cache, so that the layout is part of the measurement
+        layout_cache.memory.clear()
+        plot_trees(trees[0], trees[1], render_file, show=False)
+
+    return {
+        "parse": (lambda: None, lambda _: (json.loads(text1), json.loads(text2))),
+        "conversion": (cold(lambda: (json.loads(text1), json.loads(text2))), lambda plans: (json_to_tree(plans[0]), json_to_tree(plans[1]))),
+        "normalization": (cold(lambda: None), lambda _: [normalize_label(label) for label in labels]),
+        "ted": (lambda: trees, lambda pair: APTED(pair[0], pair[1], TreeConfig()).compute_edit_distance()),
+        "rendering": (lambda: None, render),
+    }
+
+
+def calibration_workload():
+    """
+    A fixed pure-Python workload that does not use the code of the pipeline (building, sorting and serializing
+    small dicts). Stage times relative to its time can be compared across hosts.
+    """
+    rng = random.Random(0)
+    items = [{"key": str(rng.random()), "values": [rng.randrange(1000) for _ in range(8)]} for _ in range(2000)]
+    items.sort(key=lambda item: item["key"])
+    return sum(len(json.dumps(item)) for item in items)
+
+
+def measure(prepare, run, repeat, min_duration=0.01):
+    """
+    Measure the wall time of a stage over several repetitions and its peak memory in one extra repetition.
+    Like timeit, a stage that takes less than min_duration runs several times per repetition (each time on fresh
+    inputs) and the garbage collector is disabled while it is timed. The calibration workload runs before every
+    repetition, so that both are measured under the same load of the host.
+
+    Returns:
+        dict: The median and minimum wall time in seconds, the minimum time relative to the calibration workload
+            and the peak memory in bytes.
+    """
+    def timed(number):
+        total = 0.0
+        for _ in range(number):
+            inputs = prepare()
+            start = time.perf_counter()
+            run(inputs)
+            total += time.perf_counter() - start
+        return total / number
+
+    # The first run only sets the number of runs per repetition, and it warms up the stage
+    number = max(1, int(min_duration / max(timed(1), 1e-9)) + 1)
+    timings = []
+    calibrations = []
+    for _ in range(repeat):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            calibration_workload()
+            calibrations.append(time.perf_counter() - start)
+            timings.append(timed(number))
+        finally:
+            gc.enable()
+
+    # Memory is measured separately, because tracing the allocations slows down the stage
+    inputs = prepare()
+    tracemalloc.start()
+    run(inputs)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"median": statistics.median(timings), "min": min(timings), "relative": min(timings) / min(calibrations),
+            "peak_memory": peak}
+
+
+def run_benchmarks(cases, stages=STAGES, repeat=5):
+    """
+    Run every stage of the pipeline on every case.
+
+    Args:
+        cases (list of tuple): The cases as (name, JSON text of plan 1, JSON text of plan 2).
+        stages (list of str, optional): The stages to measure. Defaults to all stages.
+        repeat (int, optional): The number of timed repetitions of each stage. Defaults to 5.
+
+    Returns:
+        list of dict: One result per case and stage, with the number of nodes, their throughput and the relative time.
+    """
+    # Never read or write the on-disk layout cache while benchmarking
+    layout_cache.directory = None
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for name, text1, text2 in cases:
+            nodes = count_nodes(json.loads(text1)) + count_nodes(json.loads(text2))
+            functions = stage_functions(text1, text2, os.path.join(directory, "plot.png"))
+            for stage in stages:
+                measurement = measure(*functions[stage], repeat)
+                result = {"case": name, "stage": stage, "nodes": nodes, **measurement,
+                          "nodes_per_second": nodes / measurement["median"] if measurement["median"] else None}
+                log(f"{name:45} {stage:14} {measurement['median'] * 1000:10.2f} ms {measurement['peak_memory'] / 1024:10.0f} KiB")
+                results.append(result)
+    return results
+
+
+def compare_baseline(results, baseline_file, tolerance=0.25):
+    """
+    Compare the results with a baseline and find the stages that became slower or use more memory. Times are
+    compared relative to the calibration workload, so that a slower or busier host is not reported as a regression.
+    Baselines without relative times are only compared on memory.
+
+    Args:
+        results (list of dict): The results of run_benchmarks.
+        baseline_file (str): The JSON file with the baseline results.
+        tolerance (float, optional): The relative slowdown or memory growth that is accepted. Defaults to 0.25.
+
+    Returns:
+        list of dict: The regressions, with the ratio of the new value to the baseline value.
+    """
+    with open(baseline_file, 'r') as file:
+        baseline = {(result["case"], result["stage"]): result for result in json.load(file)}
+
+    regressions = []
+    for result in results:
+        previous = baseline.get((result["case"], result["stage"]))
+        if previous is None:
+            continue
+        for metric in ("relative", "peak_memory"):
+            if previous.get(metric) and result[metric] / previous[metric] > 1 + tolerance:
+                regressions.append({"case": result["case"], "stage": result["stage"], "metric": metric,
+                                    "baseline": previous[metric], "value": result[metric],
+                                    "ratio": result[metric] / previous[metric]})
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+    # Argument parsing for command-line execution
+    parser = argparse.ArgumentParser(description="Benchmark the conversion, normalization, TED and rendering of execution plans.")
+    parser.add_argument("--sizes", default="3,5,7", help="Comma-separated depths of the synthetic plans (defaults to 3,5,7)")
+    parser.add_argument("--fan-out", type=int, default=2, help="Number of children of the synthetic joins")
+    parser.add_argument("--labels", type=int, default=20, help="Label diversity of the synthetic plans")
+    parser.add_argument("--mutation", type=float, default=0.05, help="Fraction of nodes changed in the second synthetic plan")
+    parser.add_argument("--plans", default=DEFAULT_PLAN_DIRECTORY, help="Directory of recorded plans, one subdirectory per benchmark")
+    parser.add_argument("--no-synthetic", action="store_true", help="Only run the recorded plans")
+    parser.add_argument("--stages", default=",".join(STAGES), help="Comma-separated stages to measure")
+    parser.add_argument("--repeat", type=int, default=5, help="Number of timed repetitions of each stage")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare the results with this baseline JSON file")
+    parser.add_argument("--save-baseline", help="Write the results as a new baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Accepted relative slowdown before a regression is reported")
+
+    args = parser.parse_args()
+    cases = [] if args.no_synthetic else synthetic_cases([int(size) for size in args.sizes.split(',') if size],
+                                                         args.fan_out, args.labels, args.mutation)
+    recorded = recorded_cases(args.plans)
+    if not recorded:
+        log(f"No recorded plans found in {args.plans}, only the synthetic plans are measured")
+    results = run_benchmarks(cases + recorded, [stage for stage in args.stages.split(',') if stage], args.repeat)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as file:
+                json.dump(results, file, indent=2)
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.tolerance)
+        if regressions:
+            # A short burst of load on the host can slow down a single stage, only regressions that repeat are reported
+            flagged = {(regression["case"], regression["stage"], regression["metric"]) for regression in regressions}
+            log(f"Measuring {len(flagged)} possible regressions again")
+            again = run_benchmarks([case for case in cases + recorded if case[0] in {key[0] for key in flagged}],
+                                   sorted({key[1] for key in flagged}), args.repeat)
+            regressions = [regression for regression in compare_baseline(again, args.baseline, args.tolerance)
+                           if (regression["case"], regression["stage"], regression["metric"]) in flagged]
+        for regression in regressions:
+            emit_record(regression)
+        if regressions:
+            log(f"{len(regressions)} regressions compared to {args.baseline}")
+            sys.exit(1)
@@ -0,0 +1,163 @@
+import os
+import sys
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from batch_output import log, emit_record
+from target_config import load_target_map
+from comparison_api import Comparator, ComparisonError
+
+
+def query_files(paths):
+    """
+    Expand the query files and directories given on the command line.
+
+    Args:
+        paths (list of str): SQL files or directories containing SQL files.
+
+    Returns:
+        list of str: The SQL files, the files of each directory sorted by name.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, file) for file in sorted(os.listdir(path)) if file.endswith('.sql'))
+        else:
+            files.append(path)
+    return files
+
+
+def target_pairs(targets, baseline=None):
+    """
+    Get the pairs of targets that are compared: every target with the baseline, or all pairs without a baseline.
+
+    Args:
+        targets (list of str): The names of the targets.
+        baseline (str, optional): The name of the baseline target.
+
+    Returns:
+        list of tuple: The pairs of target names.
+    """
+    if baseline is not None:
+        return [(baseline, target) for target in targets if target != baseline]
+    return list(itertools.combinations(targets, 2))
+
+
+def capture(comparator, query, targets, executor, analyze=False, explain_options=None):
+    """
+    Start capturing the plans of a query on all targets concurrently.
+
+    Returns:
+        dict: A dictionary mapping each target to the future of its EXPLAIN result.
+    """
+    return {target: executor.submit(comparator.explain, query, target, analyze, explain_options) for target in targets}
+
+
+def compare_captured(comparator, file, futures, pairs, canonical=False):
+    """
+    Compare the plans of a query captured on all targets. Each plan is converted once, and the TED is computed
+    once per distinct pair of plans, so targets with the same plan cost nothing extra.
+
+    Args:
+        comparator (Comparator): The comparator with the caches.
+        file (str): The query file.
+        futures (dict): The futures of capture.
+        pairs (list of tuple): The pairs of targets that are compared.
+        canonical (bool, optional): Whether the trees are canonicalized before hashing. Defaults to False.
+
+    Returns:
+        dict: The query, the plan hash of every target, the number of distinct plans, the TED of every pair,
+            the execution times with analyze, and the errors of the targets that failed.
+    """
+    trees = {}
+    record = {"query": file, "plan_hashes": {}, "errors": {}}
+    for target, future in futures.items():
+        try:
+            result = future.result()
+            tree, plan_hash, _ = comparator.tree(result, canonical)
+        except ComparisonError as error:
+            record["errors"][target] = str(error)
+            continue
+        trees[target] = (tree, plan_hash)
+        record["plan_hashes"][target] = plan_hash
+        if "Execution Time" in result:
+            record.setdefault("execution_times", {})[target] = result["Execution Time"]
+
+    record["distinct_plans"] = len(set(record["plan_hashes"].values()))
+    record["pairs"] = []
+    for target1, target2 in pairs:
+        if target1 in trees and target2 in trees:
+            ted, _ = comparator.distance(*trees[target1], *trees[target2])
+            record["pairs"].append({"target_1": target1, "target_2": target2, "ted": ted})
+    return record
+
+
+def compare_targets(files, config_file="config.json", targets=None, baseline=None, analyze=False, explain_options=None,
+                    canonical=False, parallel=4):
+    """
+    Capture the plans of every query on all targets of the configuration and compare them, pairwise or with a
+    baseline target. Every plan is captured once, the targets of a query are explained concurrently and up to
+    `parallel` queries are in flight, each target using a pool of connections.
+
+    Args:
+        files (list of str): The query files.
+        config_file (str, optional): The configuration file with the named targets. Defaults to "config.json".
+        targets (list of str, optional): The names of the targets. Defaults to all targets of the configuration.
+        baseline (str, optional): If given, every target is only compared with this target.
+        analyze (bool, optional): Whether to use EXPLAIN ANALYZE. Defaults to False.
+        explain_options (list of str, optional): Additional EXPLAIN options, see preprocess_query.
+        canonical (bool, optional): Whether the trees are canonicalized before hashing. Defaults to False.
+        parallel (int, optional): The number of queries captured at the same time. Defaults to 4.
+
+    Yields:
+        dict: The comparison of each query (see compare_captured), in the order of the files.
+    """
+    targets = targets or list(load_target_map(config_file))
+    if baseline is not None and baseline not in targets:
+        targets = [baseline] + targets
+    pairs = target_pairs(targets, baseline)
+    with Comparator(config_file, pool_size=parallel) as comparator, \
+            ThreadPoolExecutor(max_workers=parallel * len(targets)) as executor:
+        in_flight = deque()
+        for file in files:
+            with open(file, 'r') as query_file:
+                query = query_file.read().strip()
+            in_flight.append((file, capture(comparator, query, targets, executor, analyze, explain_options)))
+            # Keep at most `parallel` queries in flight, the results are compared in the order of the files
+            if len(in_flight) >= parallel:
+                yield compare_captured(comparator, *in_flight.popleft(), pairs, canonical)
+        while in_flight:
+            yield compare_captured(comparator, *in_flight.popleft(), pairs, canonical)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the plans of queries across any number of targets of the configuration.")
+    parser.add_argument("queries", nargs="+", help="SQL files or directories containing SQL files")
+    parser.add_argument("--config", default="config.json", help="Database configuration file with the targets (defaults to config.json)")
+    parser.add_argument("--targets", help="Comma-separated names of the targets to compare (defaults to all targets)")
+    parser.add_argument("--baseline", help="Compare every target with this target instead of all pairs")
+    parser.add_argument("--analyze", action="store_true", help="Use EXPLAIN ANALYZE and report the execution time on every target")
+    parser.add_argument("--explain-options", help="Comma-separated additional EXPLAIN options, see tree_edit_distance_tool.py")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes before hashing")
+    parser.add_argument("--parallel", type=int, default=4, help="Number of queries captured at the same time (defaults to 4)")
+    args = parser.parse_args()
+
+    targets = [name.strip() for name in args.targets.split(',') if name.strip()] if args.targets else None
+    unknown = [name for name in (targets or []) + ([args.baseline] if args.baseline else []) if name not in load_target_map(args.config)]
+    if unknown:
+        parser.error(f"Unknown targets: {unknown}")
+    explain_options = [option.strip().upper() for option in args.explain_options.split(',') if option.strip()] if args.explain_options else None
+
+    failed = 0
+    teds = {}
+    for record in compare_targets(query_files(args.queries), args.config, targets, args.baseline, args.analyze,
+                                  explain_options, args.canonical, max(args.parallel, 1)):
+        emit_record(record)
+        failed += bool(record["errors"])
+        for pair in record["pairs"]:
+            teds.setdefault((pair["target_1"], pair["target_2"]), []).append(pair["ted"])
+    for (target1, target2), values in teds.items():
+        log(f"{target1} vs {target2}: {len(values)} queries, mean TED {sum(values) / len(values):.2f}, "
+            f"{sum(1 for value in values if value)} with a different plan")
+    sys.exit(1 if failed else 0)
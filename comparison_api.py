@@ -0,0 +1,540 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from target_config import load_target_map, resolve_target
+from tree_edit_distance import json_to_tree, canonicalize, edit_distance, tree_hash
+from tree_edit_distance_tool import preprocess_query, explain_counters
+
+
+class ComparisonError(Exception):
+    """
+    A comparison failed. The error records the stage that failed ("explain" or "convert"), the side of the pair
+    (1 or 2) and, in a batch, the index of the pair in the input, so the caller never has to parse messages.
+    """
+    def __init__(self, message, stage=None, side=None, index=None, cause=None):
+        """
+        Args:
+            message (str): The description of the error.
+            stage (str, optional): The stage that failed.
+            side (int, optional): The side of the pair that failed.
+            index (int, optional): The index of the pair in the batch.
+            cause (Exception, optional): The original exception.
+        """
+        super().__init__(message)
+        self.stage = stage
+        self.side = side
+        self.index = index
+        self.cause = cause
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The message, stage, side and index of the error.
+        """
+        return {"error": str(self), "stage": self.stage, "side": self.side, "index": self.index}
+
+
+class QueryError(ComparisonError):
+    """
+    The SQL text of a side could not be explained, e.g. because of a syntax error or an unreachable database.
+    """
+
+
+class PlanError(ComparisonError, ValueError):
+    """
+    A side is not a valid EXPLAIN result or SQL text.
+    """
+
+
+class ComparisonResult:
+    """
+    The result of comparing one pair of execution plans.
+    """
+    def __init__(self, ted=None, plan_hash_1=None, plan_hash_2=None, execution_time_1=None, execution_time_2=None,
+                 counters=None, trees_cached=(False, False), ted_cached=False, index=None, error=None):
+        """
+        Args:
+            ted (int): The tree edit distance between the plans.
+            plan_hash_1 (str): The hash of the first plan.
+            plan_hash_2 (str): The hash of the second plan.
+            execution_time_1 (float, optional): The execution time (ms) of the first plan, if it was analyzed.
+            execution_time_2 (float, optional): The execution time (ms) of the second plan, if it was analyzed.
+            counters (dict, optional): The EXPLAIN counters of both sides, see explain_counters.
+            trees_cached (tuple of bool, optional): Whether the trees of both sides came from the cache.
+            ted_cached (bool, optional): Whether the distance came from the cache.
+            index (int, optional): The index of the pair in the batch.
+            error (ComparisonError, optional): The error of a failed pair of a batch that does not raise errors.
+        """
+        self.ted = ted
+        self.plan_hash_1 = plan_hash_1
+        self.plan_hash_2 = plan_hash_2
+        self.execution_time_1 = execution_time_1
+        self.execution_time_2 = execution_time_2
+        self.counters = counters or {}
+        self.trees_cached = tuple(trees_cached)
+        self.ted_cached = ted_cached
+        self.index = index
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def time_difference(self):
+        """
+        The absolute difference of the execution times, or None if the plans were not analyzed.
+        """
+        if self.execution_time_1 is None or self.execution_time_2 is None:
+            return None
+        return abs(self.execution_time_1 - self.execution_time_2)
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: The result with the same keys as the JSON output of tree_edit_distance_tool.py
+                (ted, plan_hash_*, execution_time_*, time_difference and the counters), plus the cache flags.
+        """
+        if self.error is not None:
+            return self.error.to_dict()
+        output = {"ted": self.ted, "plan_hash_1": self.plan_hash_1, "plan_hash_2": self.plan_hash_2}
+        if self.time_difference is not None:
+            output.update({"execution_time_1": self.execution_time_1, "execution_time_2": self.execution_time_2,
+                           "time_difference": self.time_difference})
+        output.update(self.counters)
+        output.update({"trees_cached": list(self.trees_cached), "ted_cached": self.ted_cached})
+        if self.index is not None:
+            output["index"] = self.index
+        return output
+
+    def __repr__(self):
+        return f"ComparisonResult(index={self.index}, ted={self.ted}, error={self.error!r})"
+
+
+class LRUCache:
+    """
+    A thread-safe cache that keeps the most recently used entries, with hit and miss counters.
+    A maximum size of 0 disables the cache.
+    """
+    def __init__(self, maxsize=1024):
+        """
+        Args:
+            maxsize (int, optional): The maximum number of entries. Defaults to 1024.
+        """
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Args:
+            key: The key of the entry.
+
+        Returns:
+            The cached value, or None if the key is not cached.
+        """
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        """
+        Add an entry and evict the least recently used entries above the maximum size.
+
+        Args:
+            key: The key of the entry.
+            value: The value of the entry.
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of entries, hits and misses.
+        """
+        with self.lock:
+            return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
+def target_name(target):
+    """
+    Get the name of a target for messages: DB1 and DB2 for the numbers 1 and 2, otherwise the name itself.
+    """
+    return f"DB{target}" if isinstance(target, int) else target
+
+
+def is_sql_side(side):
+    """
+    Check whether a side of a pair is SQL text, given as a string or as a (sql, target) tuple, rather than an EXPLAIN result.
+    """
+    return isinstance(side, str) or (isinstance(side, tuple) and len(side) == 2 and isinstance(side[0], str))
+
+
+class Comparator:
+    """
+    Compare execution plans from Python. The connections to the databases are pooled and only opened when SQL
+    is compared, the labels of all trees are interned, and the trees and distances are cached by the content
+    of the plans. A comparator can be shared between threads and should be closed when it is no longer needed.
+    """
+    def __init__(self, config_file="config.json", pool_size=4, cache_size=1024):
+        """
+        Args:
+            config_file (str, optional): Path to the configuration file with DB1 and DB2 or named targets. Defaults to "config.json".
+                The file is only read when SQL is compared, so plans can be compared without it.
+            pool_size (int, optional): The maximum number of connections per database. Defaults to 4.
+            cache_size (int, optional): The maximum number of cached trees and distances, 0 disables caching. Defaults to 1024.
+        """
+        self.config_file = config_file
+        self.pool_size = pool_size
+        self.pools = {}
+        # The pools raise an error instead of waiting when all connections are in use, so callers wait for a slot
+        self.slots = {}
+        self.pool_lock = threading.Lock()
+        # Labels are shared between all cached trees, plans of the same workload repeat most of them
+        self.labels = {}
+        self.trees = LRUCache(cache_size)
+        self.distances = LRUCache(cache_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def pool(self, target):
+        """
+        Get the connection pool of a database, creating it on first use.
+
+        Args:
+            target (int or str): The database, 1 for DB1 and 2 for DB2, or the name of a target of the configuration.
+
+        Returns:
+            psycopg2.pool.ThreadedConnectionPool: The connection pool.
+        """
+        with self.pool_lock:
+            if target not in self.pools:
+                from psycopg2.pool import ThreadedConnectionPool
+                settings = resolve_target(load_target_map(self.config_file), target)
+                self.pools[target] = ThreadedConnectionPool(1, self.pool_size, dbname=settings["DATABASE"], user=settings["USER"],
+                                                            password=settings["PASSWORD"], host=settings["HOST"], port=settings["PORT"])
+                self.slots[target] = threading.BoundedSemaphore(self.pool_size)
+            return self.pools[target]
+
+    @contextmanager
+    def session(self, target):
+        """
+        Borrow a pooled connection of a database for several statements, e.g. to explain a query under many settings
+        in one session. The connection is returned to the pool afterwards. When all connections of the pool are
+        in use, e.g. with more concurrent requests or workers than pool_size, the caller waits for a free connection.
+
+        Args:
+            target (int or str): The database, 1 for DB1 and 2 for DB2, or the name of a target of the configuration.
+
+        Yields:
+            psycopg2.connection: The connection.
+
+        Raises:
+            QueryError: If the database cannot be reached.
+        """
+        try:
+            pool = self.pool(target)
+        except Exception as error:
+            raise QueryError(f"{target_name(target)} is not available: {error}".strip(), "explain", cause=error) from error
+        slot = self.slots[target]
+        slot.acquire()
+        try:
+            try:
+                connection = pool.getconn()
+            except Exception as error:
+                raise QueryError(f"{target_name(target)} is not available: {error}".strip(), "explain", cause=error) from error
+            try:
+                yield connection
+            finally:
+                pool.putconn(connection)
+        finally:
+            slot.release()
+
+    def explain(self, sql, target, analyze=False, explain_options=None, settings=None, connection=None):
+        """
+        EXPLAIN the SQL text of a query file on a pooled connection. Statements that are not queries are executed
+        before the query as by the tool, but every change is rolled back so the connection can be reused.
+
+        Args:
+            sql (str): The SQL text.
+            target (int or str): The database, 1 for DB1 and 2 for DB2, or the name of a target of the configuration.
+            analyze (bool, optional): Whether to use EXPLAIN ANALYZE. Defaults to False.
+            explain_options (list of str, optional): Additional EXPLAIN options, see preprocess_query.
+            settings (dict, optional): Planner settings applied with SET LOCAL for this query only, e.g. {"enable_hashjoin": "off"}.
+            connection (psycopg2.connection, optional): A connection borrowed with session(). Defaults to a pooled connection.
+
+        Returns:
+            dict: The EXPLAIN result.
+
+        Raises:
+            QueryError: If the database cannot be reached or a statement fails.
+            PlanError: If the SQL text does not contain a query.
+        """
+        if connection is None:
+            with self.session(target) as connection:
+                return self.explain(sql, target, analyze, explain_options, settings, connection)
+        try:
+            with connection.cursor() as cursor:
+                for name, value in (settings or {}).items():
+                    # set_config(..., true) is SET LOCAL with the value passed as a parameter
+                    cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+                for q in sql.split(";"):
+                    if not q.strip():
+                        continue
+                    q = preprocess_query(q, analyze, explain_options=explain_options)
+                    cursor.execute(q)
+                    if q.strip().lower().startswith('explain'):
+                        return explain_result(cursor.fetchall())
+        except PlanError:
+            raise
+        except Exception as error:
+            raise QueryError(f"The query failed on {target_name(target)}: {error}".strip(), "explain", cause=error) from error
+        finally:
+            # The rollback also ends the SET LOCAL settings
+            connection.rollback()
+        raise PlanError(f"The SQL text for {target_name(target)} does not contain a query", "explain")
+
+    def distance(self, tree1, hash1, tree2, hash2):
+        """
+        Get the tree edit distance between two trees from the cache or compute it.
+
+        Args:
+            tree1 (TreeNode): The first tree.
+            hash1 (str): The hash of the first tree.
+            tree2 (TreeNode): The second tree.
+            hash2 (str): The hash of the second tree.
+
+        Returns:
+            tuple: The tree edit distance and whether it was cached.
+        """
+        ted = self.distances.get((hash1, hash2))
+        if ted is not None:
+            return ted, True
+        ted = edit_distance(tree1, tree2)
+        self.distances.put((hash1, hash2), ted)
+        return ted, False
+
+    def intern(self, tree):
+        """
+        Replace the labels of a tree by the interned labels.
+
+        Args:
+            tree (TreeNode): The tree.
+        """
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            node.label = self.labels.setdefault(node.label, node.label)
+            stack.extend(node.children)
+
+    def tree(self, result, canonical=False):
+        """
+        Get the tree of an EXPLAIN result from the cache or convert it.
+        Cached trees are shared between callers and must not be modified.
+
+        Args:
+            result (dict or list): The EXPLAIN result.
+            canonical (bool, optional): Whether to canonicalize the tree. Defaults to False.
+
+        Returns:
+            tuple: The tree, its hash and whether it was cached.
+
+        Raises:
+            PlanError: If the result is not an EXPLAIN result.
+        """
+        try:
+            key = (hashlib.sha1(json.dumps(result, sort_keys=True).encode()).hexdigest(), canonical)
+            cached = self.trees.get(key)
+            if cached is not None:
+                return cached + (True,)
+            tree = json_to_tree(result)
+        except Exception as error:
+            raise PlanError(f"Not a valid EXPLAIN result: {error!r}", "convert", cause=error) from error
+        if canonical:
+            canonicalize(tree)
+        self.intern(tree)
+        entry = (tree, tree_hash(tree))
+        self.trees.put(key, entry)
+        return entry + (False,)
+
+    def compare(self, side1, side2, analyze=False, explain_options=None, canonical=False):
+        """
+        Compare one pair of execution plans. Each side is either an EXPLAIN result (as returned by the database
+        or stored with --store) or SQL text, given as a string (explained on DB1 for the first side and DB2 for
+        the second) or as a (sql, target) tuple, e.g. ("SELECT ...", 1).
+
+        Args:
+            side1 (dict, list, str or tuple): The first side.
+            side2 (dict, list, str or tuple): The second side.
+            analyze (bool, optional): Whether SQL text is explained with EXPLAIN ANALYZE. Defaults to False.
+            explain_options (list of str, optional): Additional EXPLAIN options for SQL text, see preprocess_query.
+            canonical (bool, optional): Whether the trees are canonicalized (see --canonical). Defaults to False.
+
+        Returns:
+            ComparisonResult: The result of the comparison.
+
+        Raises:
+            ComparisonError: A QueryError or PlanError with the side that failed.
+        """
+        sides = []
+        for number, side in ((1, side1), (2, side2)):
+            try:
+                if is_sql_side(side):
+                    sql, target = (side, number) if isinstance(side, str) else side
+                    result = self.explain(sql, target, analyze, explain_options)
+                else:
+                    # Plans fetched from the database or stored with --store are wrapped in the rows of the result
+                    result = explain_result(side)
+                sides.append((result,) + self.tree(result, canonical))
+            except ComparisonError as error:
+                error.side = number
+                raise
+
+        (result1, tree1, hash1, cached1), (result2, tree2, hash2, cached2) = sides
+        ted, ted_cached = self.distance(tree1, hash1, tree2, hash2)
+
+        counters = {}
+        times = []
+        for number, result in ((1, result1), (2, result2)):
+            counters.update(explain_counters(result, number))
+            times.append(result.get("Execution Time"))
+        return ComparisonResult(ted, hash1, hash2, times[0], times[1], counters, (cached1, cached2), ted_cached)
+
+    def compare_batch(self, pairs, workers=4, analyze=False, explain_options=None, canonical=False, raise_errors=True):
+        """
+        Compare many pairs of execution plans and yield the results as they complete. The pairs are read lazily,
+        with at most twice the number of workers in flight, so the input can be a generator of any length.
+
+        Args:
+            pairs (iterable of tuple): The pairs (side1, side2), see compare.
+            workers (int, optional): The number of pairs compared concurrently. With 1 the pairs are compared
+                one after the other in the calling thread and the results keep the order of the input. Defaults to 4.
+            analyze (bool, optional): Whether SQL text is explained with EXPLAIN ANALYZE. Defaults to False.
+            explain_options (list of str, optional): Additional EXPLAIN options for SQL text, see preprocess_query.
+            canonical (bool, optional): Whether the trees are canonicalized. Defaults to False.
+            raise_errors (bool, optional): Whether the first failed pair raises its ComparisonError (the pairs in
+                flight are finished but not yielded). Otherwise a result with the error is yielded. Defaults to True.
+
+        Yields:
+            ComparisonResult: The result of each pair, with the index of the pair in the input.
+        """
+        def run(index, pair):
+            try:
+                result = self.compare(pair[0], pair[1], analyze, explain_options, canonical)
+            except ComparisonError as error:
+                error.index = index
+                if raise_errors:
+                    raise
+                return ComparisonResult(index=index, error=error)
+            result.index = index
+            return result
+
+        if workers <= 1:
+            for index, pair in enumerate(pairs):
+                yield run(index, pair)
+            return
+
+        pairs = enumerate(pairs)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            exhausted = False
+            while pending or not exhausted:
+                # Keep the workers busy without reading the whole input
+                while not exhausted and len(pending) < 2 * workers:
+                    try:
+                        index, pair = next(pairs)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(executor.submit(run, index, pair))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        yield future.result()
+                    except ComparisonError:
+                        for other in pending:
+                            other.cancel()
+                        raise
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of interned labels, the open pools and the statistics of the caches.
+        """
+        return {"labels": len(self.labels), "pools": [target_name(target) for target in self.pools],
+                "trees": self.trees.stats(), "distances": self.distances.stats()}
+
+    def close(self):
+        """
+        Close all pooled connections.
+        """
+        with self.pool_lock:
+            for pool in self.pools.values():
+                pool.closeall()
+            self.pools.clear()
+            self.slots.clear()
+
+
+def explain_result(result):
+    """
+    Get the EXPLAIN result (the object with "Plan") out of the rows returned by the database.
+
+    Args:
+        result (dict or list): The rows or the EXPLAIN result.
+
+    Returns:
+        dict: The EXPLAIN result.
+
+    Raises:
+        PlanError: If the rows are empty or do not contain an EXPLAIN result.
+    """
+    while isinstance(result, (list, tuple)):
+        if not result:
+            raise PlanError("Not a valid EXPLAIN result: no rows", "convert")
+        result = result[0]
+    if not isinstance(result, dict) or "Plan" not in result:
+        raise PlanError(f"Not a valid EXPLAIN result: {type(result).__name__} without a Plan", "convert")
+    return result
+
+
+def compare(side1, side2, config_file="config.json", analyze=False, explain_options=None, canonical=False):
+    """
+    Compare one pair of execution plans without keeping connections or caches, see Comparator.compare.
+
+    Returns:
+        ComparisonResult: The result of the comparison.
+    """
+    with Comparator(config_file, pool_size=1, cache_size=0) as comparator:
+        return comparator.compare(side1, side2, analyze, explain_options, canonical)
+
+
+def compare_batch(pairs, config_file="config.json", workers=4, cache_size=1024, analyze=False, explain_options=None,
+                  canonical=False, raise_errors=True):
+    """
+    Compare many pairs of execution plans with a new comparator, see Comparator.compare_batch.
+    The connections are closed when the generator is exhausted or closed.
+
+    Yields:
+        ComparisonResult: The result of each pair, as it completes.
+    """
+    with Comparator(config_file, pool_size=max(workers, 1), cache_size=cache_size) as comparator:
+        yield from comparator.compare_batch(pairs, workers, analyze, explain_options, canonical, raise_errors)
@@ -0,0 +1,198 @@
+import os
+import json
+import socket
+import threading
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from batch_output import log
+from comparison_api import Comparator, ComparisonError, PlanError
+
+
+class ComparisonService(Comparator):
+    """
+    A comparator that answers the JSON requests of the service. It is shared by all request threads, so the
+    connection pools, the interned labels and the caches stay warm for the lifetime of the process.
+    """
+    def __init__(self, config_file="config.json", pool_size=4, cache_size=1024):
+        super().__init__(config_file, pool_size, cache_size)
+        self.requests = 0
+        self.requests_lock = threading.Lock()
+
+    def compare_request(self, request):
+        """
+        Compare the two execution plans of a request.
+
+        Args:
+            request (dict): Either "plan1" and "plan2" with two EXPLAIN results or "sql1" and "sql2" with two SQL texts,
+                which are explained on DB1 and DB2 (or the targets in "targets", e.g. [1, 1] or ["pg15", "pg16"]). Optional keys are
+                "analyze", "explain_options" and "canonical", as the options of tree_edit_distance_tool.py.
+
+        Returns:
+            dict: The result of the comparison, see ComparisonResult.to_dict.
+
+        Raises:
+            ComparisonError: If the request is invalid (PlanError) or a query fails (QueryError).
+        """
+        with self.requests_lock:
+            self.requests += 1
+        if "plan1" in request and "plan2" in request:
+            sides = (request["plan1"], request["plan2"])
+        elif "sql1" in request and "sql2" in request:
+            targets = request.get("targets", [1, 2])
+            sides = ((request["sql1"], targets[0]), (request["sql2"], targets[1]))
+        else:
+            raise PlanError("A request needs either plan1 and plan2 or sql1 and sql2")
+        result = self.compare(sides[0], sides[1], bool(request.get("analyze", False)), request.get("explain_options"),
+                              bool(request.get("canonical", False)))
+        return result.to_dict()
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of requests, interned labels and open pools, and the statistics of the caches.
+        """
+        return {"requests": self.requests, **super().stats()}
+
+
+class ComparisonHandler(BaseHTTPRequestHandler):
+    """
+    Handle the HTTP requests of the service: POST /compare with a JSON request and GET /health with the statistics.
+    """
+    protocol_version = "HTTP/1.1"
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        self.send_json(200, {"status": "ok", **self.server.service.stats()})
+
+    def do_POST(self):
+        if self.path != "/compare":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            if not isinstance(request, dict):
+                raise ValueError("The request must be a JSON object")
+        except ValueError as error:
+            self.send_json(400, {"error": str(error)})
+            return
+        try:
+            self.send_json(200, self.server.service.compare_request(request))
+        except PlanError as error:
+            self.send_json(400, error.to_dict())
+        except ComparisonError as error:
+            # Database errors are reported to the client, the service keeps running
+            self.send_json(500, error.to_dict())
+        except Exception as error:
+            # Any other error still gets a reply instead of a closed connection
+            log(f"Request failed: {error!r}")
+            self.send_json(500, {"error": f"Internal error: {error!r}"})
+
+    def log_message(self, format, *args):
+        # The client address of a Unix socket is empty, so only the request is logged
+        if self.server.verbose:
+            log(format % args)
+
+
+class ThreadingUnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """
+    An HTTP server on a Unix socket that handles every connection in its own thread.
+    """
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) client address
+        return request, ("local", 0)
+
+
+def serve(service, host="127.0.0.1", port=8765, socket_path=None, verbose=False):
+    """
+    Serve the comparison service until it is interrupted.
+
+    Args:
+        service (ComparisonService): The service.
+        host (str, optional): The address of the HTTP server. Defaults to "127.0.0.1".
+        port (int, optional): The port of the HTTP server. Defaults to 8765.
+        socket_path (str, optional): If given, serve on this Unix socket instead of TCP.
+        verbose (bool, optional): Whether every request is logged. Defaults to False.
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ComparisonHandler)
+        address = socket_path
+    else:
+        server = ThreadingHTTPServer((host, port), ComparisonHandler)
+        address = f"http://{host}:{port}"
+    server.service = service
+    server.verbose = verbose
+    log(f"Comparison service listening on {address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+def request_comparison(request, host="127.0.0.1", port=8765, socket_path=None, timeout=60):
+    """
+    Send a comparison request to a running service.
+
+    Args:
+        request (dict): The request, see ComparisonService.compare_request.
+        host (str, optional): The address of the service. Defaults to "127.0.0.1".
+        port (int, optional): The port of the service. Defaults to 8765.
+        socket_path (str, optional): The Unix socket of the service, used instead of host and port.
+        timeout (float, optional): The timeout in seconds. Defaults to 60.
+
+    Returns:
+        dict: The result of the comparison.
+
+    Raises:
+        RuntimeError: If the service reports an error.
+    """
+    import http.client
+    if socket_path:
+        connection = http.client.HTTPConnection("localhost", timeout=timeout)
+        connection.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.sock.settimeout(timeout)
+        connection.sock.connect(socket_path)
+    else:
+        connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("POST", "/compare", json.dumps(request), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        body = json.loads(response.read())
+    finally:
+        connection.close()
+    if response.status != 200:
+        raise RuntimeError(f"Comparison failed ({response.status}): {body.get('error')}")
+    return body
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve plan comparisons from a long-running process with warm caches and pooled connections.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address of the HTTP server (defaults to 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8765, help="Port of the HTTP server (defaults to 8765)")
+    parser.add_argument("--socket", help="Serve on this Unix socket instead of TCP")
+    parser.add_argument("--config", default="config.json", help="Database configuration file (defaults to config.json)")
+    parser.add_argument("--pool-size", type=int, default=4, help="Maximum number of connections per database (defaults to 4)")
+    parser.add_argument("--cache-size", type=int, default=1024, help="Maximum number of cached trees and distances (defaults to 1024)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    serve(ComparisonService(args.config, args.pool_size, args.cache_size), args.host, args.port, args.socket, args.verbose)
@@ -0,0 +1,264 @@
+import os
+import re
+import csv
+import glob
+import gzip
+import json
+import time
+import hashlib
+from batch_output import log, emit_record
+from plan_baselines import BaselineStore
+
+# auto_explain logs "duration: 12.345 ms  plan:" followed by the plan
+PLAN_MARKER = re.compile(r'duration: ([\d.]+) ms\s+plan:')
+
+# Constants and parameters of the query text, replaced by ? in the fingerprint
+LITERALS = re.compile(r"'(?:[^']|'')*'|\$\d+|\b\d+(?:\.\d+)?\b")
+# Lists of constants, e.g. IN (1, 2, 3), have the same fingerprint whatever their length
+LISTS = re.compile(r'\?(?:\s*,\s*\?)+')
+
+# Index of the message in the rows of csvlog
+CSV_MESSAGE = 13
+
+
+def fingerprint(query):
+    """
+    Fingerprint the text of a query, so that executions with different constants belong to the same statement.
+    Constants, parameters and lists of constants are replaced by ?, and case and whitespace are normalized.
+
+    Args:
+        query (str): The query text.
+
+    Returns:
+        str: The fingerprint (16 hexadecimal digits).
+    """
+    normalized = LISTS.sub('?', LITERALS.sub('?', query.lower()))
+    return hashlib.sha1(' '.join(normalized.split()).encode()).hexdigest()[:16]
+
+
+def open_log(path):
+    """
+    Open a log file for reading, decompressing it if its name ends with .gz.
+
+    Args:
+        path (str): The path to the log file.
+
+    Returns:
+        file: The text file.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace', newline='')
+    return open(path, 'r', encoding='utf-8', errors='replace', newline='')
+
+
+def log_files(patterns):
+    """
+    Expand the log files and patterns given on the command line. The files are ordered from the oldest to the newest,
+    so rotated logs (e.g. postgresql.log.2.gz, postgresql.log.1, postgresql.log) are read in the order they were written.
+
+    Args:
+        patterns (list of str): Paths or glob patterns.
+
+    Returns:
+        list of str: The log files.
+    """
+    files = {path for pattern in patterns for path in (glob.glob(pattern) or [pattern])}
+    return sorted(files, key=lambda path: (os.path.getmtime(path), path))
+
+
+def stderr_messages(lines):
+    """
+    Get the plan messages of a log in the stderr format. A message that spans several lines continues
+    on lines that start with a tab, so only the lines of plan messages are joined.
+
+    Args:
+        lines (iterable of str): The lines of the log.
+
+    Yields:
+        str: The messages that contain a plan.
+    """
+    message = None
+    for line in lines:
+        if message is not None:
+            if line.startswith('\t'):
+                message.append(line)
+                continue
+            yield ''.join(message)
+            message = None
+        if 'plan:' in line and PLAN_MARKER.search(line):
+            message = [line]
+    if message is not None:
+        yield ''.join(message)
+
+
+def jsonlog_messages(lines):
+    """
+    Get the plan messages of a log in the jsonlog format (one JSON object per line, PostgreSQL 15 and later).
+
+    Args:
+        lines (iterable of str): The lines of the log.
+
+    Yields:
+        str or None: The messages that contain a plan, or None for a line that is not a JSON object,
+            e.g. a line truncated by a crash of the server.
+    """
+    for line in lines:
+        if 'plan:' in line:
+            try:
+                message = json.loads(line).get('message', '')
+            except (ValueError, AttributeError):
+                yield None
+                continue
+            if PLAN_MARKER.search(message):
+                yield message
+
+
+def csvlog_messages(file):
+    """
+    Get the plan messages of a log in the csvlog format.
+
+    Args:
+        file (file): The log file.
+
+    Yields:
+        str: The messages that contain a plan.
+    """
+    for row in csv.reader(file):
+        if len(row) > CSV_MESSAGE and 'plan:' in row[CSV_MESSAGE] and PLAN_MARKER.search(row[CSV_MESSAGE]):
+            yield row[CSV_MESSAGE]
+
+
+def log_messages(path, file):
+    """
+    Get the plan messages of a log file in the format given by its name: *.json for jsonlog, *.csv for csvlog
+    and stderr otherwise (also when compressed with gzip).
+    """
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.json'):
+        return jsonlog_messages(file)
+    if name.endswith('.csv'):
+        return csvlog_messages(file)
+    return stderr_messages(file)
+
+
+def parse_plan(message):
+    """
+    Extract the duration and the plan of an auto_explain message logged with auto_explain.log_format = json.
+
+    Args:
+        message (str): The log message.
+
+    Returns:
+        tuple: The duration in ms and the EXPLAIN result, or None if the message does not contain a JSON plan
+            (e.g. with log_format = text).
+    """
+    match = PLAN_MARKER.search(message)
+    text = message[match.end():].strip()
+    if not text.startswith('{'):
+        return None
+    try:
+        return float(match.group(1)), json.loads(text)
+    except ValueError:
+        return None
+
+
+def follow_lines(file, interval=1.0):
+    """
+    Yield the lines of a file and keep waiting for new lines at its end until interrupted.
+
+    Args:
+        file (file): The open file.
+        interval (float, optional): Seconds between two checks for new lines. Defaults to 1.
+
+    Yields:
+        str: The lines of the file.
+    """
+    partial = ''
+    try:
+        while True:
+            line = file.readline()
+            if not line:
+                time.sleep(interval)
+                continue
+            # A line that is still being written is completed by the next read
+            partial += line
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+    except KeyboardInterrupt:
+        if partial:
+            yield partial
+
+
+def ingest(paths, state="plan_baselines.db", update=False, canonical=False, min_duration=0.0, follow=False, commit_every=10000):
+    """
+    Read the plans logged by auto_explain and compare every plan with the baseline of its statement, identified
+    by the fingerprint of its query text. The first plan of a statement becomes its baseline. Plan changes are
+    printed as JSON lines on stdout, and the structural hash is compared first so the TED is only computed for
+    plans that differ from the baseline. Plans that cannot be read or converted, e.g. with a node type that
+    json_to_tree does not support, are counted as failed and the other plans are still compared.
+
+    Args:
+        paths (list of str): The log files or glob patterns, including rotated and gzip-compressed logs.
+        state (str, optional): The SQLite file with the baselines. Defaults to "plan_baselines.db".
+        update (bool, optional): Whether a changed plan becomes the new baseline. Defaults to False.
+        canonical (bool, optional): Whether the plans are canonicalized before hashing (see --canonical). Defaults to False.
+        min_duration (float, optional): Plans of executions shorter than this (ms) are skipped. Defaults to 0.
+        follow (bool, optional): Whether to keep reading the newest file as it grows, like tail -f. Defaults to False.
+        commit_every (int, optional): The number of plans between two commits of the store. Defaults to 10000.
+
+    Returns:
+        dict: The number of plans read, skipped, failed and compared, by status.
+    """
+    counts = {"plans": 0, "skipped": 0, "failed": 0, "new": 0, "same": 0, "changed": 0}
+    start = time.perf_counter()
+    files = log_files(paths)
+    # Every distinct error is logged once, a log usually contains many plans of the same kind
+    errors = set()
+    with BaselineStore(state, update=update, canonical=canonical) as store:
+        for number, path in enumerate(files):
+            with open_log(path) as file:
+                lines = follow_lines(file) if follow and number == len(files) - 1 else file
+                for message in log_messages(path, lines):
+                    counts["plans"] += 1
+                    if message is None:
+                        counts["failed"] += 1
+                        continue
+                    parsed = parse_plan(message)
+                    if parsed is None or parsed[0] < min_duration or "Query Text" not in parsed[1]:
+                        counts["skipped"] += 1
+                        continue
+                    duration, result = parsed
+                    query = result["Query Text"]
+                    try:
+                        check = store.check(fingerprint(query), result, query, source=path)
+                    except Exception as error:
+                        counts["failed"] += 1
+                        if str(error) not in errors:
+                            errors.add(str(error))
+                            log(f"{path}: a plan could not be compared: {error!r}")
+                        continue
+                    counts[check["status"]] += 1
+                    if check["status"] == "changed" and not check.get("repeated"):
+                        emit_record({**check, "query": query, "duration": duration, "file": path})
+                    if counts["plans"] % commit_every == 0:
+                        store.commit()
+            log(f"{path}: {counts['plans']} plans read so far")
+    elapsed = time.perf_counter() - start
+    log(f"{counts['plans']} plans in {elapsed:.2f} s ({counts['plans'] / max(elapsed, 1e-9):.0f} plans/s): "
+        f"{counts['new']} new, {counts['same']} same, {counts['changed']} changed, {counts['skipped']} skipped, {counts['failed']} failed")
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the plans logged by auto_explain (log_format = json) with stored baselines.")
+    parser.add_argument("logs", nargs="+", help="Log files or glob patterns, e.g. 'log/postgresql-*' (rotated and .gz files are supported)")
+    parser.add_argument("--state", default="plan_baselines.db", help="SQLite file with the baselines (defaults to plan_baselines.db)")
+    parser.add_argument("--update-baseline", action="store_true", help="Make a changed plan the new baseline of its statement")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes before hashing")
+    parser.add_argument("--min-duration", type=float, default=0.0, help="Skip plans of executions shorter than this (ms)")
+    parser.add_argument("--follow", action="store_true", help="Keep reading the newest log file as it grows")
+    args = parser.parse_args()
+
+    ingest(args.logs, args.state, args.update_baseline, args.canonical, args.min_duration, args.follow)
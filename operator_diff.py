@@ -0,0 +1,116 @@
+# Buffer counters of EXPLAIN (ANALYZE, BUFFERS), like the times they include the counters of the children
+BUFFER_KEYS = ["Shared Hit Blocks", "Shared Read Blocks", "Shared Dirtied Blocks", "Shared Written Blocks",
+               "Local Hit Blocks", "Local Read Blocks", "Temp Read Blocks", "Temp Written Blocks",
+               "I/O Read Time", "I/O Write Time"]
+
+
+def plan_root(json_obj):
+    """
+    Get the root plan node of an EXPLAIN result, in the same way as json_to_tree.
+
+    Args:
+        json_obj (dict or list): The EXPLAIN result.
+
+    Returns:
+        dict: The root plan node.
+    """
+    while isinstance(json_obj, list):
+        json_obj = json_obj[0]
+    return json_obj.get("Plan", json_obj)
+
+
+def pair_plan_nodes(tree, json_obj):
+    """
+    Pair each TreeNode with the plan node it was converted from. json_to_tree keeps the order of the
+    "Plans" of every node, so both trees can be walked in parallel.
+
+    Args:
+        tree (TreeNode): The tree created by json_to_tree.
+        json_obj (dict or list): The EXPLAIN result the tree was created from.
+
+    Returns:
+        dict: A dictionary mapping the id of each TreeNode to its plan node.
+    """
+    pairs = {}
+    stack = [(tree, plan_root(json_obj))]
+    while stack:
+        node, plan = stack.pop()
+        pairs[id(node)] = plan
+        stack.extend(zip(node.children, plan.get("Plans", [])))
+    return pairs
+
+
+def node_metrics(plan):
+    """
+    Compute the metrics of a plan node of EXPLAIN ANALYZE. The total time and the buffer counters of a node
+    include its children, so the exclusive values subtract the values of the children.
+
+    Args:
+        plan (dict): The plan node.
+
+    Returns:
+        dict: The node type, the estimated and actual rows, the loops, the inclusive and exclusive time in ms
+            and the exclusive buffer counters.
+    """
+    def inclusive_time(node):
+        # Actual Total Time is the average per loop
+        return node.get("Actual Total Time", 0.0) * node.get("Actual Loops", 1)
+
+    children = plan.get("Plans", [])
+    total = inclusive_time(plan)
+    buffers = {}
+    for key in BUFFER_KEYS:
+        if key in plan:
+            buffers[key] = plan[key] - sum(child.get(key, 0) for child in children)
+    return {
+        "node_type": plan.get("Node Type"),
+        "relation": plan.get("Relation Name") if plan.get("Relation Name") != "None" else None,
+        "plan_rows": plan.get("Plan Rows"),
+        "actual_rows": plan.get("Actual Rows"),
+        "loops": plan.get("Actual Loops"),
+        "total_time": total,
+        # Parallel workers and InitPlans can make the children take longer than the parent
+        "exclusive_time": max(total - sum(inclusive_time(child) for child in children), 0.0),
+        "buffers": buffers,
+    }
+
+
+def operator_diff(result1, result2, tree1, tree2, mapping, top=10, plan_nodes=None):
+    """
+    Pair the operators of two EXPLAIN ANALYZE results with the tree edit distance mapping and rank them by their
+    contribution to the time difference, i.e. the change of their exclusive time. Deleted operators contribute
+    minus their time and inserted operators their time.
+
+    Args:
+        result1 (dict or list): The first EXPLAIN ANALYZE result.
+        result2 (dict or list): The second EXPLAIN ANALYZE result.
+        tree1 (TreeNode): The tree of the first result.
+        tree2 (TreeNode): The tree of the second result.
+        mapping (list of tuple): The tree edit distance mapping between the trees.
+        top (int, optional): The number of operators returned. Defaults to 10, None returns all operators.
+        plan_nodes (tuple of dict, optional): The pairs of pair_plan_nodes for both trees, which must be computed
+            before the trees are canonicalized. Defaults to pairing the trees with the results now.
+
+    Returns:
+        list of dict: The operators sorted by the absolute change of their exclusive time, with the edit operation,
+            the metrics in both plans and the time delta (ms, plan 2 - plan 1).
+    """
+    plans1, plans2 = plan_nodes or (pair_plan_nodes(tree1, result1), pair_plan_nodes(tree2, result2))
+
+    operators = []
+    for node1, node2 in mapping:
+        metrics1 = node_metrics(plans1[id(node1)]) if node1 is not None else None
+        metrics2 = node_metrics(plans2[id(node2)]) if node2 is not None else None
+        time1 = metrics1["exclusive_time"] if metrics1 else 0.0
+        time2 = metrics2["exclusive_time"] if metrics2 else 0.0
+        if node1 is None:
+            operation = "inserted"
+        elif node2 is None:
+            operation = "deleted"
+        else:
+            operation = "same" if node1.label == node2.label else "changed"
+        operators.append({"operation": operation, "plan_1": metrics1, "plan_2": metrics2, "time_delta": time2 - time1})
+
+    operators.sort(key=lambda operator: abs(operator["time_delta"]), reverse=True)
+    return operators[:top] if top is not None else operators
+
@@ -0,0 +1,311 @@
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+from tree_edit_distance import json_to_tree, tree_hash
+
+# zstandard is optional: without it the plans are compressed with zlib
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plans (
+    digest TEXT PRIMARY KEY,
+    plan_hash TEXT,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    codec TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    run TEXT NOT NULL,
+    target TEXT NOT NULL,
+    query TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES plans(digest),
+    stored_at REAL NOT NULL,
+    PRIMARY KEY (run, target, query)
+);
+
+CREATE INDEX IF NOT EXISTS idx_entries_query ON entries(query, target);
+CREATE INDEX IF NOT EXISTS idx_plans_plan_hash ON plans(plan_hash);
+"""
+
+# Segments are closed once they reach this size and a new segment is started
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+
+def normalize_plan(result):
+    """
+    Serialize an EXPLAIN result in a normalized form: the result itself (without the rows of the query result
+    it is wrapped in), with sorted keys and without whitespace. The same plan always has the same serialization,
+    however it was formatted when it was stored.
+
+    Args:
+        result (dict or list): The EXPLAIN result, as returned by the database or stored with --store.
+
+    Returns:
+        bytes: The normalized JSON.
+    """
+    while isinstance(result, list):
+        result = result[0]
+    return json.dumps(result, sort_keys=True, separators=(',', ':')).encode()
+
+
+def compress(data):
+    """
+    Returns:
+        tuple: The compressed data and the name of the codec.
+    """
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=10).compress(data), "zstd"
+    return zlib.compress(data, 9), "zlib"
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("The plan is compressed with zstd, install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class PlanArchive:
+    """
+    A content-addressed archive of EXPLAIN results. Every distinct plan is stored once, compressed on its own and
+    appended to a segment file, and a SQLite index maps each (run, target, query) to its plan and each plan to
+    its position in a segment. A plan is read by decompressing only its own bytes, never a whole segment.
+    Several processes can add plans to the same archive, the index lock serializes the appends.
+    """
+    def __init__(self, directory, timeout=60.0):
+        """
+        Args:
+            directory (str): The directory of the archive, created if necessary.
+            timeout (float, optional): Seconds to wait for the lock of another process. Defaults to 60.
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        # isolation_level=None lets add() hold the lock while it appends to the segment
+        self.connection = sqlite3.connect(os.path.join(directory, "index.sqlite"), timeout=timeout, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def segment_path(self, segment):
+        return os.path.join(self.directory, f"segment-{segment:05d}.bin")
+
+    def add(self, run, target, query, result):
+        """
+        Add the EXPLAIN result of a query. A plan that is already in the archive is only referenced again.
+
+        Args:
+            run (str): The run the plan belongs to, e.g. the date of a batch.
+            target (str): The database the plan comes from, e.g. DB1 or the name of a target.
+            query (str): The name of the query, e.g. query1.
+            result (dict or list): The EXPLAIN result.
+
+        Returns:
+            str: The digest of the plan (its address in the archive).
+        """
+        data = normalize_plan(result)
+        digest = hashlib.sha1(data).hexdigest()
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self.connection.execute("SELECT 1 FROM plans WHERE digest = ?", (digest,)).fetchone() is None:
+                self.append(digest, data)
+            self.connection.execute("INSERT OR REPLACE INTO entries (run, target, query, digest, stored_at) VALUES (?, ?, ?, ?, ?)",
+                                    (run, target, query, digest, time.time()))
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        return digest
+
+    def append(self, digest, data):
+        """
+        Compress a new plan and append it to the current segment. Must be called while holding the index lock.
+        """
+        # The structural hash allows finding the runs of a plan shape, e.g. all plans with the hash of the tool output
+        try:
+            plan_hash = tree_hash(json_to_tree(json.loads(data)))
+        except Exception:
+            # e.g. a node type that json_to_tree does not support, the plan is still archived by its digest
+            plan_hash = None
+        blob, codec = compress(data)
+        segment = self.connection.execute("SELECT COALESCE(MAX(segment), 1) FROM plans").fetchone()[0]
+        if os.path.exists(self.segment_path(segment)) and os.path.getsize(self.segment_path(segment)) >= SEGMENT_SIZE:
+            segment += 1
+        with open(self.segment_path(segment), 'ab') as file:
+            offset = file.seek(0, os.SEEK_END)
+            file.write(blob)
+        self.connection.execute("INSERT INTO plans (digest, plan_hash, segment, offset, length, size, codec) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (digest, plan_hash, segment, offset, len(blob), len(data), codec))
+
+    def read(self, digest, files=None):
+        """
+        Read a plan by its digest.
+
+        Args:
+            digest (str): The digest of the plan.
+            files (dict, optional): Open segment files by segment number, reused by bulk reads.
+
+        Returns:
+            dict: The EXPLAIN result.
+
+        Raises:
+            KeyError: If the plan is not in the archive.
+        """
+        row = self.connection.execute("SELECT segment, offset, length, codec FROM plans WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        segment, offset, length, codec = row
+        if files is not None:
+            if segment not in files:
+                files[segment] = open(self.segment_path(segment), 'rb')
+            file = files[segment]
+            file.seek(offset)
+            blob = file.read(length)
+        else:
+            with open(self.segment_path(segment), 'rb') as file:
+                file.seek(offset)
+                blob = file.read(length)
+        return json.loads(decompress(blob, codec))
+
+    def get(self, run, target, query):
+        """
+        Read the plan of a query of a run on a target.
+
+        Returns:
+            dict: The EXPLAIN result.
+
+        Raises:
+            KeyError: If the archive has no such plan.
+        """
+        row = self.connection.execute("SELECT digest FROM entries WHERE run = ? AND target = ? AND query = ?",
+                                      (run, target, query)).fetchone()
+        if row is None:
+            raise KeyError((run, target, query))
+        return self.read(row[0])
+
+    def entries(self, run=None, target=None, query=None):
+        """
+        List the entries of the archive, optionally only those of a run, target or query.
+
+        Returns:
+            list of tuple: The run, target, query and digest of each entry.
+        """
+        conditions = [(column, value) for column, value in (("run", run), ("target", target), ("query", query)) if value is not None]
+        where = " WHERE " + " AND ".join(f"e.{column} = ?" for column, _ in conditions) if conditions else ""
+        # Ordered by position in the segments, so bulk reads go through the files sequentially
+        return self.connection.execute(
+            f"SELECT e.run, e.target, e.query, e.digest FROM entries e JOIN plans p ON p.digest = e.digest{where} "
+            "ORDER BY p.segment, p.offset", [value for _, value in conditions]).fetchall()
+
+    def export(self, directory, run=None, target=None, query=None):
+        """
+        Write plans back to EXPLAIN JSON files in the format of --store, as <directory>/<run>/<target>/<query>_explain.json.
+
+        Returns:
+            int: The number of files written.
+        """
+        files = {}
+        count = 0
+        try:
+            for entry_run, entry_target, entry_query, digest in self.entries(run, target, query):
+                path = os.path.join(directory, safe_name(entry_run), safe_name(entry_target))
+                os.makedirs(path, exist_ok=True)
+                with open(os.path.join(path, f"{safe_name(entry_query)}_explain.json"), 'w') as file:
+                    # The rows of the query result, as the tool stores them
+                    json.dump([[[self.read(digest, files)]]], file, indent=4)
+                count += 1
+        finally:
+            for file in files.values():
+                file.close()
+        return count
+
+    def import_files(self, run, paths):
+        """
+        Import EXPLAIN results stored with --store. <query>_explain.json is the plan of DB1 and <query>_explain_2.json
+        the plan of DB2.
+
+        Args:
+            run (str): The run the plans are added to.
+            paths (list of str): The files.
+
+        Returns:
+            int: The number of imported files.
+        """
+        count = 0
+        for path in paths:
+            match = re.match(r'(.+)_explain(_2)?\.json$', os.path.basename(path))
+            if not match:
+                continue
+            with open(path, 'r') as file:
+                result = json.load(file)
+            self.add(run, "DB2" if match.group(2) else "DB1", match.group(1), result)
+            count += 1
+        return count
+
+    def stats(self):
+        """
+        Returns:
+            dict: The number of entries and distinct plans, and the uncompressed and compressed size of the plans in bytes.
+        """
+        entries = self.connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        plans, size, length = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(length), 0) FROM plans").fetchone()
+        return {"entries": entries, "plans": plans, "plan_bytes": size, "compressed_bytes": length}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def safe_name(name):
+    """
+    Make a run, target or query name usable as a file name.
+    """
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Manage a compressed, deduplicated archive of EXPLAIN results.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import <query>_explain.json files stored with --store")
+    import_parser.add_argument("archive", help="Directory of the archive")
+    import_parser.add_argument("paths", nargs="+", help="EXPLAIN JSON files or directories containing them")
+    import_parser.add_argument("--run", default=time.strftime("%Y-%m-%d"), help="Run of the imported plans (defaults to today)")
+    export_parser = subparsers.add_parser("export", help="Write plans back to EXPLAIN JSON files")
+    export_parser.add_argument("archive", help="Directory of the archive")
+    export_parser.add_argument("directory", help="Output directory")
+    for option in ("--run", "--target", "--query"):
+        export_parser.add_argument(option, help=f"Only export the plans of this {option[2:]}")
+    show_parser = subparsers.add_parser("show", help="Print one plan")
+    show_parser.add_argument("archive", help="Directory of the archive")
+    show_parser.add_argument("run")
+    show_parser.add_argument("target")
+    show_parser.add_argument("query")
+    stats_parser = subparsers.add_parser("stats", help="Print the number of entries and plans and their size")
+    stats_parser.add_argument("archive", help="Directory of the archive")
+
+    args = parser.parse_args()
+    with PlanArchive(args.archive) as archive:
+        if args.command == "import":
+            files = [os.path.join(path, file) for path in args.paths if os.path.isdir(path) for file in sorted(os.listdir(path))]
+            files += [path for path in args.paths if not os.path.isdir(path)]
+            print(f"Imported {archive.import_files(args.run, files)} plans into {args.archive}")
+        elif args.command == "export":
+            print(f"Exported {archive.export(args.directory, args.run, args.target, args.query)} plans to {args.directory}")
+        elif args.command == "show":
+            print(json.dumps(archive.get(args.run, args.target, args.query), indent=4))
+        else:
+            print(json.dumps(archive.stats()))
@@ -0,0 +1,155 @@
+import sqlite3
+import json
+import time
+from tree_edit_distance import json_to_tree, canonicalize, edit_distance, tree_hash
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS baselines (
+    key TEXT PRIMARY KEY,
+    query TEXT,
+    plan_hash TEXT NOT NULL,
+    plan TEXT NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS plan_changes (
+    change_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    source TEXT,
+    detected_at REAL NOT NULL,
+    baseline_hash TEXT NOT NULL,
+    plan_hash TEXT NOT NULL,
+    ted INTEGER NOT NULL,
+    plan TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_plan_changes_key ON plan_changes(key, detected_at);
+"""
+
+
+class BaselineStore:
+    """
+    Keep the known plan of each statement in a SQLite file and detect when a statement gets a different plan.
+    The structural hash of a new plan is compared with the hash of the baseline first, and the tree edit distance
+    is only computed when the hashes differ. The trees of the baselines are kept in memory after their first use.
+    Writes are batched, so call commit() (or use the store as a context manager) to persist them.
+    """
+    def __init__(self, path, update=True, canonical=False):
+        """
+        Args:
+            path (str): Path to the SQLite file, created if necessary.
+            update (bool, optional): Whether a changed plan replaces the baseline (the last known plan) or the first
+                plan stays the baseline. Defaults to True.
+            canonical (bool, optional): Whether the trees are canonicalized before hashing (see --canonical). Defaults to False.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        self.update = update
+        self.canonical = canonical
+        # key -> (plan hash, tree) of the baselines used so far
+        self.trees = {}
+        # key -> (times seen, last seen) since the last commit, written in one statement per key by commit()
+        self.seen = {}
+        # (key, baseline hash, plan hash) -> TED of the changes found so far, recorded only once
+        self.changes = {}
+
+    def tree(self, result):
+        """
+        Convert an EXPLAIN result to a tree and compute its hash.
+
+        Args:
+            result (dict or list): The EXPLAIN result.
+
+        Returns:
+            tuple: The tree and its hash.
+        """
+        tree = json_to_tree(result)
+        if self.canonical:
+            canonicalize(tree)
+        return tree, tree_hash(tree)
+
+    def baseline(self, key):
+        """
+        Args:
+            key (str): The key of the statement, e.g. its queryid or fingerprint.
+
+        Returns:
+            tuple or None: The hash and the tree of the baseline, or None if the statement has no baseline.
+        """
+        if key not in self.trees:
+            row = self.connection.execute("SELECT plan FROM baselines WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            tree, plan_hash = self.tree(json.loads(row[0]))
+            self.trees[key] = (plan_hash, tree)
+        return self.trees[key]
+
+    def check(self, key, result, query=None, source=None):
+        """
+        Compare a plan with the baseline of its statement. A statement without a baseline gets the plan as its baseline.
+
+        Args:
+            key (str): The key of the statement.
+            result (dict or list): The EXPLAIN result of the plan.
+            query (str, optional): The text of the statement, stored with a new baseline.
+            source (str, optional): Where the plan comes from, stored with a plan change.
+
+        Returns:
+            dict: The key, the status ("new", "same" or "changed"), the hash of the plan and, for changed plans,
+                the hash of the baseline and the tree edit distance. Without update, a change that was already found
+                since the store was opened is marked as repeated and not recorded again.
+        """
+        now = time.time()
+        tree, plan_hash = self.tree(result)
+        baseline = self.baseline(key)
+        if baseline is None:
+            self.connection.execute(
+                "INSERT INTO baselines (key, query, plan_hash, plan, first_seen, last_seen) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, query, plan_hash, json.dumps(result), now, now))
+            self.trees[key] = (plan_hash, tree)
+            return {"key": key, "status": "new", "plan_hash": plan_hash}
+
+        baseline_hash, baseline_tree = baseline
+        count = self.seen.get(key, (0, now))[0]
+        self.seen[key] = (count + 1, now)
+        if plan_hash == baseline_hash:
+            return {"key": key, "status": "same", "plan_hash": plan_hash}
+
+        change = (key, baseline_hash, plan_hash)
+        if change in self.changes and not self.update:
+            # A plan that differs from a fixed baseline is usually seen many times
+            return {"key": key, "status": "changed", "plan_hash": plan_hash, "baseline_hash": baseline_hash,
+                    "ted": self.changes[change], "repeated": True}
+        # With update, a change back to an earlier plan moves the baseline again and is recorded, only the TED is reused
+        ted = self.changes.get(change)
+        if ted is None:
+            ted = self.changes[change] = edit_distance(baseline_tree, tree)
+        plan = json.dumps(result)
+        self.connection.execute(
+            "INSERT INTO plan_changes (key, source, detected_at, baseline_hash, plan_hash, ted, plan) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, source, now, baseline_hash, plan_hash, ted, plan))
+        if self.update:
+            self.connection.execute("UPDATE baselines SET plan_hash = ?, plan = ? WHERE key = ?", (plan_hash, plan, key))
+            self.trees[key] = (plan_hash, tree)
+        return {"key": key, "status": "changed", "plan_hash": plan_hash, "baseline_hash": baseline_hash, "ted": ted}
+
+    def commit(self):
+        """
+        Write the batched updates and commit them.
+        """
+        self.connection.executemany("UPDATE baselines SET seen = seen + ?, last_seen = ? WHERE key = ?",
+                                    [(count, last_seen, key) for key, (count, last_seen) in self.seen.items()])
+        self.seen.clear()
+        self.connection.commit()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,253 @@
+import os
+import html
+import json
+from tree_edit_distance import json_to_tree, edit_mapping
+from tree_visualisation import extract_properties
+
+# Directory of the bundled vis-network, tom-select and bindings assets
+LIB_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lib")
+
+# Colors of the nodes depending on their edit operation
+COLORS = {"same": "#4caf50", "changed": "#ff9800", "deleted": "#f44336", "inserted": "#f44336"}
+
+
+def read_asset(path):
+    """
+    Read a bundled asset from the lib directory.
+
+    Args:
+        path (str): The path of the asset relative to the lib directory.
+
+    Returns:
+        str: The contents of the asset.
+    """
+    with open(os.path.join(LIB_DIRECTORY, path), 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+def diff_nodes(tree1, tree2, mapping):
+    """
+    Flatten two trees into the node records of the viewer, annotated with their edit operation.
+
+    Args:
+        tree1 (TreeNode): The first tree.
+        tree2 (TreeNode): The second tree.
+        mapping (list of tuple): The tree edit distance mapping between the two trees.
+
+    Returns:
+        list of dict: One record per node with its id, parent, children, labels, status, partner and
+            the number of differing nodes in its subtree.
+    """
+    # Look up the partner and the status of every node by its identity
+    partners = {}
+    status = {}
+    for node1, node2 in mapping:
+        if node1 is None:
+            status[id(node2)] = "inserted"
+        elif node2 is None:
+            status[id(node1)] = "deleted"
+        else:
+            status[id(node1)] = status[id(node2)] = "same" if node1.label == node2.label else "changed"
+            partners[id(node1)] = node2
+            partners[id(node2)] = node1
+
+    records = []
+    ids = {}
+    for prefix, tree in (("a", tree1), ("b", tree2)):
+        # Assign ids in pre-order, so that parents always come before their children
+        stack = [(tree, None, 0)]
+        while stack:
+            node, parent, depth = stack.pop()
+            node_id = f"{prefix}{len(records)}"
+            ids[id(node)] = node_id
+            properties = extract_properties(node)
+            records.append({"id": node_id, "parent": parent, "depth": depth, "children": [],
+                            "label": properties.split("\n")[0], "title": properties,
+                            "status": status.get(id(node), "same"), "node": node})
+            if parent is not None:
+                records[int(parent[1:])]["children"].append(node_id)
+            for child in reversed(node.children):
+                stack.append((child, node_id, depth + 1))
+
+    # Count the differing nodes of each subtree, children are visited before their parents
+    for record in reversed(records):
+        own = 0 if record["status"] == "same" else 1
+        record["differences"] = own + sum(records[int(child[1:])]["differences"] for child in record["children"])
+        partner = partners.get(id(record.pop("node")))
+        record["partner"] = ids[id(partner)] if partner is not None else None
+    return records
+
+
+def write_plan_diff_html(tree1, tree2, filename, mapping=None, title="Execution plan comparison", expand_depth=2):
+    """
+    Write a self-contained interactive HTML page comparing two execution plans side by side.
+    Unchanged subtrees are collapsed and their nodes are only added to the network when they are expanded
+    (double-click), so plans with thousands of nodes stay responsive. Nodes can be searched by their properties.
+
+    Args:
+        tree1 (TreeNode or dict): The first tree.
+        tree2 (TreeNode or dict): The second tree.
+        filename (str): The HTML file to write.
+        mapping (list of tuple, optional): The tree edit distance mapping. Computed if not given.
+        title (str, optional): The title of the page.
+        expand_depth (int, optional): Nodes up to this depth are always expanded initially. Defaults to 2.
+    """
+    # Convert JSON objects to TreeNode if necessary
+    if isinstance(tree1, (dict, list)):
+        tree1 = json_to_tree(tree1)
+    if isinstance(tree2, (dict, list)):
+        tree2 = json_to_tree(tree2)
+    if mapping is None:
+        mapping = edit_mapping(tree1, tree2)
+
+    records = diff_nodes(tree1, tree2, mapping)
+    # Escape "</" so that labels cannot close the script element
+    data = json.dumps({"nodes": records, "colors": COLORS, "expandDepth": expand_depth}).replace("</", "<\\/")
+
+    page = TEMPLATE
+    replacements = {
+        "__VIS_CSS__": read_asset("vis-9.1.2/vis-network.css"),
+        "__TOM_CSS__": read_asset("tom-select/tom-select.css"),
+        "__VIS_JS__": read_asset("vis-9.1.2/vis-network.min.js"),
+        "__TOM_JS__": read_asset("tom-select/tom-select.complete.min.js"),
+        "__UTILS_JS__": read_asset("bindings/utils.js"),
+        "__DATA__": data,
+        # The title comes from the query file names, it is escaped and replaced last so it cannot inject markup or placeholders
+        "__TITLE__": html.escape(title),
+    }
+    for key, value in replacements.items():
+        page = page.replace(key, value)
+
+    with open(filename, 'w', encoding='utf-8') as file:
+        file.write(page)
+
+
+TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>__VIS_CSS__</style>
+<style>__TOM_CSS__</style>
+<style>
+  body { font-family: sans-serif; margin: 0; }
+  #header { padding: 8px 12px; display: flex; gap: 16px; align-items: center; }
+  #search { min-width: 420px; }
+  #network { width: 100%; height: calc(100vh - 60px); border-top: 1px solid #ccc; }
+  .legend span { display: inline-block; padding: 2px 8px; margin-right: 4px; border-radius: 3px; color: white; }
+</style>
+</head>
+<body>
+<div id="header">
+  <strong>__TITLE__</strong>
+  <select id="search" placeholder="Search a node..."></select>
+  <div class="legend">
+    <span style="background:#4caf50">same</span><span style="background:#ff9800">changed</span><span style="background:#f44336">inserted / deleted</span>
+    left: plan 1, right: plan 2, double-click a node with (+N) to expand it
+  </div>
+</div>
+<div id="network"></div>
+<script>__VIS_JS__</script>
+<script>__TOM_JS__</script>
+<script>__UTILS_JS__</script>
+<script>
+  var DATA = __DATA__;
+  var records = {};
+  DATA.nodes.forEach(function (record) { records[record.id] = record; });
+
+  // Globals used by the bindings in lib/bindings/utils.js
+  var nodes = new vis.DataSet();
+  var edges = new vis.DataSet();
+  var nodeColors = {};
+  var allNodes;
+  var highlightActive = false;
+  var filterActive = false;
+  var expanded = {};
+
+  function countHidden(record) {
+    // Number of nodes below a collapsed node
+    var count = 0;
+    var stack = record.children.slice();
+    while (stack.length) {
+      var child = records[stack.pop()];
+      count += 1;
+      stack.push.apply(stack, child.children);
+    }
+    return count;
+  }
+
+  function visNode(record) {
+    var collapsed = record.children.length > 0 && !expanded[record.id];
+    nodeColors[record.id] = DATA.colors[record.status];
+    return {
+      id: record.id,
+      label: record.label + (collapsed ? "\\n(+" + countHidden(record) + ")" : ""),
+      title: record.title,
+      color: DATA.colors[record.status],
+      level: record.depth,
+      shape: "box",
+      borderWidth: collapsed ? 3 : 1,
+    };
+  }
+
+  function expand(id) {
+    // Lazily add the children of a node to the network
+    if (expanded[id]) { return; }
+    expanded[id] = true;
+    var record = records[id];
+    nodes.update(visNode(record));
+    nodes.add(record.children.map(function (child) { return visNode(records[child]); }));
+    edges.add(record.children.map(function (child) { return { from: id, to: child, arrows: "to" }; }));
+  }
+
+  function reveal(id) {
+    // Expand all ancestors of a node so that it becomes visible
+    var path = [];
+    for (var record = records[id]; record.parent !== null; record = records[record.parent]) {
+      path.push(record.parent);
+    }
+    path.reverse().forEach(expand);
+  }
+
+  // Initially show the roots, the first levels and every subtree that contains a difference
+  DATA.nodes.forEach(function (record) {
+    if (record.parent === null) { nodes.add(visNode(record)); }
+  });
+  DATA.nodes.forEach(function (record) {
+    if (record.children.length && (record.depth < DATA.expandDepth || record.differences > 0) &&
+        (record.parent === null || expanded[record.parent])) {
+      expand(record.id);
+    }
+  });
+
+  var network = new vis.Network(document.getElementById("network"), { nodes: nodes, edges: edges }, {
+    layout: { hierarchical: { direction: "UD", sortMethod: "directed", levelSeparation: 120, nodeSpacing: 220 } },
+    physics: false,
+    interaction: { hover: true, tooltipDelay: 100 },
+    nodes: { font: { multi: false, size: 14 }, widthConstraint: { maximum: 200 } },
+  });
+
+  network.on("click", neighbourhoodHighlight);
+  network.on("doubleClick", function (params) {
+    if (params.nodes.length) { expand(params.nodes[0]); }
+  });
+
+  // Searchable node selection
+  var search = new TomSelect("#search", {
+    options: DATA.nodes.map(function (record) {
+      return { value: record.id, text: (record.id[0] === "a" ? "[plan 1] " : "[plan 2] ") + record.title.replace(/\\n/g, " | ") };
+    }),
+    maxOptions: 200,
+    onChange: function (id) {
+      if (!id) { return; }
+      reveal(id);
+      var selection = [id];
+      if (records[id].partner && nodes.get(records[id].partner)) { selection.push(records[id].partner); }
+      selectNode(selection);
+      network.focus(id, { scale: 1.0, animation: true });
+    },
+  });
+</script>
+</body>
+</html>
+"""
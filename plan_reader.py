@@ -0,0 +1,116 @@
+import json
+import mmap
+from tree_edit_distance import TreeNode, build_label, normalize_label
+
+# ijson is optional: without it the stored plans are loaded completely with json.load
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Attributes of a plan node that are used by build_label, all other attributes are dropped while parsing
+LABEL_ATTRIBUTES = {'Node Type', 'CTE Name', 'Cache Key', 'Filter', 'Group Key', 'Hash Cond', 'Hash Key', 'Index Cond',
+                    'Index Name', 'Join Filter', 'Join Type', 'Merge Cond', 'Output', 'Recheck Cond', 'Relation Name',
+                    'Sort Key', 'One-Time Filter'}
+
+# Attributes of the EXPLAIN result itself that are kept
+RESULT_ATTRIBUTES = {'Execution Time', 'Planning Time'}
+
+
+def is_plan_node(prefix):
+    """
+    Check whether an ijson prefix is the prefix of a plan node, i.e. the "Plan" of the EXPLAIN result
+    or an item of the "Plans" of another node.
+    """
+    return prefix.endswith('.Plan') or prefix == 'Plan' or prefix.endswith('.Plans.item')
+
+
+def stream_plan_tree(file):
+    """
+    Build the tree of an EXPLAIN result while it is parsed incrementally. Only the attributes used for the labels
+    are kept, and each node is converted to a TreeNode as soon as its JSON object ends, so the memory
+    depends on the size of the tree and not on the size of the JSON document.
+
+    Args:
+        file: A binary file-like object (e.g. an mmap) with the EXPLAIN result, as stored by tree_edit_distance_tool.py --store.
+
+    Returns:
+        tuple: The root TreeNode of the first plan (the same tree as json_to_tree) and a dictionary with the
+            Execution Time and Planning Time of the result if they are present.
+    """
+    root = None
+    result_prefix = None
+    metadata = {}
+    # Stack of the plan nodes that are being parsed: (prefix, attributes, children)
+    stack = []
+
+    for prefix, event, value in ijson.parse(file):
+        if event == 'start_map' and root is None and is_plan_node(prefix):
+            stack.append((prefix, {}, []))
+            continue
+        if not stack:
+            # json_to_tree only uses the first plan, so the rest of the document is not parsed
+            if root is not None and event == 'end_map' and prefix == result_prefix:
+                break
+            # Keep the execution and planning time of the EXPLAIN result
+            key = prefix.rsplit('.', 1)[-1]
+            if key in RESULT_ATTRIBUTES and event == 'number' and key not in metadata:
+                metadata[key] = float(value)
+            continue
+
+        node_prefix, attributes, children = stack[-1]
+        if event == 'end_map' and prefix == node_prefix:
+            stack.pop()
+            node = TreeNode(normalize_label(build_label(attributes)), children)
+            if stack:
+                stack[-1][2].append(node)
+            else:
+                root = node
+                result_prefix = node_prefix[:-len('.Plan')] if node_prefix.endswith('.Plan') else ''
+            continue
+
+        # Only the direct attributes of the current node and the items of its lists are relevant
+        if not prefix.startswith(node_prefix + '.'):
+            continue
+        path = prefix[len(node_prefix) + 1:]
+        key, _, rest = path.partition('.')
+        if key not in LABEL_ATTRIBUTES:
+            continue
+        if not rest:
+            if event == 'start_array':
+                attributes[key] = []
+            elif event not in ('map_key', 'start_map', 'end_map', 'end_array'):
+                attributes[key] = value
+        elif rest == 'item' and isinstance(attributes.get(key), list) and event in ('string', 'number', 'boolean', 'null'):
+            attributes[key].append(value)
+
+    if root is None:
+        raise ValueError("The EXPLAIN result does not contain a plan")
+    return root, metadata
+
+
+def read_plan_tree(path):
+    """
+    Read the tree of an EXPLAIN result stored in a file. With ijson installed the file is memory mapped and parsed
+    incrementally (see stream_plan_tree), otherwise it is loaded with json.load and converted with json_to_tree.
+
+    Args:
+        path (str): The JSON file with the EXPLAIN result.
+
+    Returns:
+        tuple: The root TreeNode of the plan and a dictionary with the Execution Time and Planning Time if present.
+    """
+    if ijson is None:
+        from tree_edit_distance import json_to_tree
+        with open(path, 'r') as file:
+            result = json.load(file)
+        # Find the EXPLAIN result in the rows of the query result
+        while isinstance(result, list):
+            result = result[0]
+        metadata = {key: result[key] for key in RESULT_ATTRIBUTES if key in result}
+        return json_to_tree(result), metadata
+
+    with open(path, 'rb') as file:
+        # mmap lets the operating system page the document in and out while it is parsed
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return stream_plan_tree(mapped)
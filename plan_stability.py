@@ -0,0 +1,231 @@
+import os
+import sys
+import csv
+import json
+from batch_output import log
+from target_config import parse_target
+from plan_watch import parameter_count
+from tree_edit_distance_tool import explain_command
+from comparison_api import Comparator, QueryError, PlanError, target_name
+
+# Name of the prepared statement, deallocated before the connection goes back to the pool
+PREPARED_NAME = "plan_stability_statement"
+
+# plan_cache_mode of each mode (PostgreSQL 12 and later)
+PLAN_CACHE_MODES = {"custom": "force_custom_plan", "generic": "force_generic_plan", "auto": "auto"}
+
+
+def load_parameter_sets(path):
+    """
+    Read the parameter sets of a prepared statement from a JSON file (a list of lists, e.g. [[1, "a"], [2, "b"]])
+    or a CSV file (one parameter set per row, an empty field is NULL).
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        list of list: The parameter sets.
+
+    Raises:
+        ValueError: If the JSON file is not a list of lists.
+    """
+    with open(path, 'r', newline='') as file:
+        if os.path.splitext(path)[1].lower() == '.csv':
+            return [[value if value != '' else None for value in row] for row in csv.reader(file) if row]
+        parameter_sets = json.load(file)
+    if not isinstance(parameter_sets, list) or not all(isinstance(parameters, list) for parameters in parameter_sets):
+        raise ValueError(f"{path} must contain a list of parameter lists")
+    return parameter_sets
+
+
+def explain_prepared(cursor, parameters, analyze=False, explain_options=None):
+    """
+    EXPLAIN the prepared statement with one parameter set. The values are sent as untyped literals,
+    so the server converts them to the types of the parameters.
+
+    Returns:
+        dict: The EXPLAIN result.
+    """
+    placeholders = ", ".join(["%s"] * len(parameters))
+    cursor.execute(f"{explain_command(analyze, explain_options)} EXECUTE {PREPARED_NAME}({placeholders})", parameters)
+    return cursor.fetchone()[0][0]
+
+
+def capture(connection, query, parameter_sets, types=None, modes=("custom", "generic"), analyze=False, explain_options=None):
+    """
+    Prepare a statement once and explain it with every parameter set under each plan_cache_mode. The statement is
+    parsed and analyzed once, and every plan costs a single round trip. Each mode is applied with SET LOCAL for a
+    transaction that is rolled back afterwards (also undoing the changes of ANALYZE). Without analyze, the generic plan
+    does not depend on the parameters, so it is explained once and shared with the other parameter sets, which are
+    marked as not executed. Parameter sets that failed in an earlier mode are always executed, so their failure shows
+    in every mode instead of a shared plan.
+
+    Args:
+        connection (psycopg2.connection): A connection borrowed with Comparator.session().
+        query (str): The statement with parameters $1, $2, ...
+        parameter_sets (list of list): The parameter sets.
+        types (list of str, optional): The types of the parameters, e.g. ["int", "text"]. Defaults to the types inferred by the server.
+        modes (tuple of str, optional): The modes out of PLAN_CACHE_MODES. Defaults to ("custom", "generic").
+        analyze (bool, optional): Whether to use EXPLAIN ANALYZE. Defaults to False.
+        explain_options (list of str, optional): Additional EXPLAIN options, see preprocess_query.
+
+    Returns:
+        tuple: The runs as (mode, index of the parameter set, EXPLAIN result, whether it was executed) and the failures.
+
+    Raises:
+        QueryError: If the statement cannot be prepared.
+    """
+    runs = []
+    failures = []
+    prepared = False
+    try:
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(f"PREPARE {PREPARED_NAME}{'(' + ', '.join(types) + ')' if types else ''} AS {query}")
+            except Exception as error:
+                raise QueryError(f"The statement cannot be prepared: {error}".strip(), "explain", cause=error) from error
+            # A prepared statement is not removed by a rollback, so it is kept for all modes
+            connection.commit()
+            prepared = True
+            for mode in modes:
+                configured = False
+                generic = None
+                failed = {failure["index"] for failure in failures}
+                for index, parameters in enumerate(parameter_sets):
+                    if generic is not None and index not in failed:
+                        runs.append((mode, index, generic, False))
+                        continue
+                    try:
+                        if not configured:
+                            cursor.execute("SELECT set_config('plan_cache_mode', %s, true)", (PLAN_CACHE_MODES[mode],))
+                            configured = True
+                        result = explain_prepared(cursor, parameters, analyze, explain_options)
+                        runs.append((mode, index, result, True))
+                        if mode == "generic" and not analyze:
+                            generic = result
+                        if analyze:
+                            # Every parameter set starts from the same data
+                            connection.rollback()
+                            configured = False
+                    except Exception as error:
+                        # e.g. a value that cannot be converted to the type of its parameter, the other sets are still explained
+                        failures.append({"mode": mode, "index": index, "error": str(error).strip()})
+                        connection.rollback()
+                        configured = False
+                connection.rollback()
+    finally:
+        connection.rollback()
+        if prepared:
+            with connection.cursor() as cursor:
+                cursor.execute(f"DEALLOCATE {PREPARED_NAME}")
+            connection.commit()
+    return runs, failures
+
+
+def stability_profile(comparator, query, parameter_sets, target=1, types=None, modes=("custom", "generic"),
+                      analyze=False, explain_options=None, canonical=False):
+    """
+    Build the plan-stability profile of a parameterized statement: which parameter sets get which plan under each
+    plan_cache_mode, and how far each distinct plan is from the reference plan. The reference is the generic plan
+    if it is captured, otherwise the first plan. The plans are deduplicated by their hash, and the TED to the
+    reference is computed once per distinct plan.
+
+    Args:
+        comparator (Comparator): The comparator with the connection pools and caches.
+        query (str): The statement with parameters $1, $2, ...
+        parameter_sets (list of list): The parameter sets.
+        target (int or str, optional): The database, 1 for DB1, 2 for DB2 or the name of a target. Defaults to 1.
+        types (list of str, optional): The types of the parameters. Defaults to the types inferred by the server.
+        modes (tuple of str, optional): The modes out of PLAN_CACHE_MODES. Defaults to ("custom", "generic").
+        analyze (bool, optional): Whether to use EXPLAIN ANALYZE, which adds the execution time of each run.
+        explain_options (list of str, optional): Additional EXPLAIN options, see preprocess_query.
+        canonical (bool, optional): Whether the trees are canonicalized before hashing (see --canonical). Defaults to False.
+
+    Returns:
+        dict: The number of parameter sets and distinct plans, the hash of the reference plan, the distinct plans
+            sorted by their TED to the reference with the runs that produce them, the plan hash of every parameter set
+            in each mode, the parameter sets whose custom plan differs from the generic plan, and the failed runs.
+
+    Raises:
+        PlanError: If a parameter set does not match the number of parameters of the statement.
+        QueryError: If the database cannot be reached or the statement cannot be prepared.
+    """
+    query = query.strip().rstrip(";")
+    expected = len(types) if types else parameter_count(query)
+    for index, parameters in enumerate(parameter_sets):
+        if len(parameters) != expected:
+            raise PlanError(f"Parameter set {index} has {len(parameters)} values, the statement has {expected} parameters",
+                            "explain", index=index)
+    unknown = [mode for mode in modes if mode not in PLAN_CACHE_MODES]
+    if unknown:
+        raise PlanError(f"Unknown plan cache modes: {unknown}", "explain")
+
+    with comparator.session(target) as connection:
+        runs, failures = capture(connection, query, parameter_sets, types, modes, analyze, explain_options)
+    if not runs:
+        raise QueryError(f"No plan could be captured on {target_name(target)}: {failures[0]['error'] if failures else ''}".strip(), "explain")
+
+    trees = [comparator.tree(result, canonical)[:2] for _, _, result, _ in runs]
+    reference = next((number for number, (mode, _, _, _) in enumerate(runs) if mode == "generic"), 0)
+    reference_tree, reference_hash = trees[reference]
+    plans = {}
+    profile = [{"index": index, "parameters": parameters, "plan_hashes": {}} for index, parameters in enumerate(parameter_sets)]
+    for (mode, index, result, executed), (tree, plan_hash) in zip(runs, trees):
+        if plan_hash not in plans:
+            ted, _ = comparator.distance(reference_tree, reference_hash, tree, plan_hash)
+            plans[plan_hash] = {"plan_hash": plan_hash, "ted": ted, "reference": plan_hash == reference_hash, "runs": []}
+        run = {"mode": mode, "index": index, "total_cost": result.get("Plan", {}).get("Total Cost")}
+        if not executed:
+            # The generic plan explained for another parameter set
+            run["executed"] = False
+        if analyze:
+            run["execution_time"] = result.get("Execution Time")
+        plans[plan_hash]["runs"].append(run)
+        profile[index]["plan_hashes"][mode] = plan_hash
+
+    unstable = [entry["index"] for entry in profile
+                if "custom" in entry["plan_hashes"] and "generic" in entry["plan_hashes"]
+                and entry["plan_hashes"]["custom"] != entry["plan_hashes"]["generic"]]
+    return {"parameter_sets": len(parameter_sets), "modes": list(modes), "distinct_plans": len(plans),
+            "reference_hash": reference_hash,
+            "plans": sorted(plans.values(), key=lambda plan: (plan["ted"], plan["plan_hash"])),
+            "profile": profile, "custom_differs_from_generic": unstable, "failures": failures}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Profile the plan stability of a parameterized statement across parameter sets "
+                                                 "with PREPARE and EXPLAIN EXECUTE.")
+    parser.add_argument("query_file", help="File containing the statement with parameters $1, $2, ...")
+    parser.add_argument("parameters", help="JSON file with a list of parameter lists, or CSV file with one parameter set per row")
+    parser.add_argument("--types", help="Comma-separated types of the parameters, e.g. int,text (defaults to the types inferred by the server)")
+    parser.add_argument("--modes", default="custom,generic", help=f"Comma-separated plan cache modes out of {','.join(PLAN_CACHE_MODES)} (defaults to custom,generic)")
+    parser.add_argument("--target", type=parse_target, default=1, help="Explain on DB1 (1), DB2 (2) or a named target of the configuration (defaults to 1)")
+    parser.add_argument("--analyze", action="store_true", help="Use EXPLAIN ANALYZE and report the execution time of each run")
+    parser.add_argument("--explain-options", help="Comma-separated additional EXPLAIN options, see tree_edit_distance_tool.py")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes before hashing")
+    parser.add_argument("--config", default="config.json", help="Database configuration file (defaults to config.json)")
+    args = parser.parse_args()
+
+    try:
+        parameter_sets = load_parameter_sets(args.parameters)
+    except ValueError as error:
+        parser.error(str(error))
+    types = [name.strip() for name in args.types.split(',') if name.strip()] if args.types else None
+    modes = tuple(mode.strip().lower() for mode in args.modes.split(',') if mode.strip())
+    explain_options = [option.strip().upper() for option in args.explain_options.split(',') if option.strip()] if args.explain_options else None
+
+    with open(args.query_file, "r") as file:
+        query = file.read()
+
+    with Comparator(args.config, pool_size=1) as comparator:
+        try:
+            report = stability_profile(comparator, query, parameter_sets, args.target, types, modes, args.analyze,
+                                       explain_options, args.canonical)
+        except (QueryError, PlanError) as error:
+            log(f"Error: {error}")
+            sys.exit(1)
+    log(f"{report['parameter_sets']} parameter sets, {report['distinct_plans']} distinct plans, "
+        f"{len(report['custom_differs_from_generic'])} with a custom plan that differs from the generic plan, "
+        f"{len(report['failures'])} failed")
+    print(json.dumps({"query": args.query_file, **report}))
@@ -0,0 +1,211 @@
+import re
+import time
+import psycopg2
+from batch_output import log, emit_record
+from target_config import load_target_map, resolve_target, parse_target
+from plan_baselines import BaselineStore
+
+# Only statements that EXPLAIN accepts are watched, like the queries the tool explains
+KEYWORDS = ('select', 'insert', 'update', 'delete', 'with')
+
+# Name of the prepared statement used for generic plans before PostgreSQL 16
+PREPARED_NAME = "plan_watch_statement"
+
+
+def connect(settings, statement_timeout=5000):
+    """
+    Open the connection of the watcher. The session is marked with an application name and every statement
+    is limited by a timeout, so a slow catalog or planner never piles up work on the server.
+
+    Args:
+        settings (dict): The connection settings of the database (DATABASE, USER, PASSWORD, HOST, PORT).
+        statement_timeout (int, optional): The statement timeout in ms. Defaults to 5000.
+
+    Returns:
+        psycopg2.connection: The connection.
+    """
+    connection = psycopg2.connect(dbname=settings["DATABASE"], user=settings["USER"], password=settings["PASSWORD"],
+                                  host=settings["HOST"], port=settings["PORT"], application_name="plan_watch")
+    with connection.cursor() as cursor:
+        cursor.execute("SET statement_timeout = %s", (statement_timeout,))
+    connection.commit()
+    return connection
+
+
+def top_statements(connection, top=50, min_calls=1):
+    """
+    Read the statements of the current database with the highest total execution time from pg_stat_statements.
+    Only the columns that are needed are read, so the poll itself stays cheap.
+
+    Args:
+        connection (psycopg2.connection): The connection of the watcher.
+        top (int, optional): The number of statements. Defaults to 50.
+        min_calls (int, optional): Statements with fewer calls are ignored. Defaults to 1.
+
+    Returns:
+        list of tuple: The queryid, text, calls and total execution time (ms) of each statement.
+    """
+    # total_time was split into planning and execution time in PostgreSQL 13
+    total_time = "total_exec_time" if connection.server_version >= 130000 else "total_time"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT queryid, query, calls, {total_time} FROM pg_stat_statements "
+            "WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database()) AND calls >= %s "
+            "AND queryid IS NOT NULL "
+            f"ORDER BY {total_time} DESC LIMIT %s", (min_calls, top))
+        statements = cursor.fetchall()
+    connection.commit()
+    return [statement for statement in statements
+            if statement[1].strip().lower().startswith(KEYWORDS) and "pg_stat_statements" not in statement[1]]
+
+
+def parameter_count(query):
+    """
+    Count the parameters ($1, $2, ...) of a normalized statement of pg_stat_statements.
+
+    Args:
+        query (str): The text of the statement.
+
+    Returns:
+        int: The highest parameter number, 0 if the statement has no parameters.
+    """
+    return max((int(number) for number in re.findall(r'\$(\d+)', query)), default=0)
+
+
+def explain_generic(connection, query):
+    """
+    EXPLAIN a statement of pg_stat_statements without executing it. Statements with parameters get their generic
+    plan, i.e. the plan the server uses independently of the parameter values: with the GENERIC_PLAN option of
+    PostgreSQL 16, or before with a prepared statement that is explained with plan_cache_mode = force_generic_plan.
+
+    Args:
+        connection (psycopg2.connection): The connection of the watcher.
+        query (str): The text of the statement.
+
+    Returns:
+        dict: The EXPLAIN result.
+    """
+    parameters = parameter_count(query)
+    try:
+        with connection.cursor() as cursor:
+            if parameters == 0:
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {query}")
+            elif connection.server_version >= 160000:
+                cursor.execute(f"EXPLAIN (GENERIC_PLAN, FORMAT JSON) {query}")
+            else:
+                cursor.execute("SET LOCAL plan_cache_mode = force_generic_plan")
+                cursor.execute(f"PREPARE {PREPARED_NAME} AS {query}")
+                # The values do not matter for a generic plan
+                cursor.execute(f"EXPLAIN (FORMAT JSON) EXECUTE {PREPARED_NAME}({', '.join(['NULL'] * parameters)})")
+            return cursor.fetchone()[0][0]
+    finally:
+        connection.rollback()
+        if parameters and connection.server_version < 160000:
+            # Prepared statements are not removed by the rollback
+            with connection.cursor() as cursor:
+                cursor.execute("DEALLOCATE ALL")
+            connection.commit()
+
+
+def poll(connection, store, top=50, min_calls=1):
+    """
+    Explain the top statements once and compare their plans with the last known plans.
+
+    Args:
+        connection (psycopg2.connection): The connection of the watcher.
+        store (BaselineStore): The store of the last known plans.
+        top (int, optional): The number of statements. Defaults to 50.
+        min_calls (int, optional): Statements with fewer calls are ignored. Defaults to 1.
+
+    Returns:
+        tuple: The plan changes (list of dict) and the number of statements that were explained and that failed,
+            either because they could not be explained or because their plan could not be compared.
+    """
+    changes = []
+    explained = failed = 0
+    for queryid, query, calls, total_time in top_statements(connection, top, min_calls):
+        try:
+            result = explain_generic(connection, query)
+        except psycopg2.Error as error:
+            # e.g. parameters whose type cannot be inferred or texts truncated by track_activity_query_size
+            failed += 1
+            log(f"Could not explain statement {queryid}: {str(error).strip()}")
+            continue
+        try:
+            check = store.check(str(queryid), result, query, source="pg_stat_statements")
+        except Exception as error:
+            # e.g. a node type that json_to_tree does not support, such as ModifyTable or Gather
+            failed += 1
+            log(f"Could not compare the plan of statement {queryid}: {error!r}")
+            continue
+        explained += 1
+        if check["status"] == "changed" and not check.get("repeated"):
+            changes.append({**check, "query": query, "calls": calls, "total_time": total_time})
+    store.commit()
+    return changes, explained, failed
+
+
+def watch(config_file="config.json", target=1, state="plan_watch.db", top=50, interval=60.0, iterations=None,
+          min_calls=1, canonical=False, statement_timeout=5000):
+    """
+    Watch the plans of the top statements of a database and report every plan change as a JSON line on stdout.
+
+    Args:
+        config_file (str, optional): Path to the configuration file. Defaults to "config.json".
+        target (int or str, optional): The database to watch, 1 for DB1, 2 for DB2 or the name of a target. Defaults to 1.
+        state (str, optional): The SQLite file with the last known plans. Defaults to "plan_watch.db".
+        top (int, optional): The number of statements watched. Defaults to 50.
+        interval (float, optional): Seconds between the start of two polls. Defaults to 60.
+        iterations (int, optional): The number of polls, None polls until interrupted.
+        min_calls (int, optional): Statements with fewer calls are ignored. Defaults to 1.
+        canonical (bool, optional): Whether the plans are canonicalized before hashing (see --canonical). Defaults to False.
+        statement_timeout (int, optional): The statement timeout of the watcher in ms. Defaults to 5000.
+    """
+    settings = resolve_target(load_target_map(config_file), target)
+    connection = None
+    count = 0
+    with BaselineStore(state, update=True, canonical=canonical) as store:
+        try:
+            while iterations is None or count < iterations:
+                count += 1
+                start = time.perf_counter()
+                try:
+                    if connection is None or connection.closed:
+                        connection = connect(settings, statement_timeout)
+                    changes, explained, failed = poll(connection, store, top, min_calls)
+                except psycopg2.OperationalError as error:
+                    # Reconnect in the next poll, e.g. after a restart of the server
+                    log(f"Poll {count} failed: {str(error).strip()}")
+                    connection = None
+                    changes, explained, failed = [], 0, 0
+                for change in changes:
+                    emit_record(change)
+                elapsed = time.perf_counter() - start
+                log(f"Poll {count}: {explained} statements explained, {failed} failed, "
+                    f"{len(changes)} plan changes in {elapsed * 1000:.0f} ms")
+                if iterations is None or count < iterations:
+                    time.sleep(max(interval - elapsed, 0))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if connection is not None and not connection.closed:
+                connection.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Watch the plans of the top statements of pg_stat_statements and report plan changes.")
+    parser.add_argument("--config", default="config.json", help="Database configuration file (defaults to config.json)")
+    parser.add_argument("--target", type=parse_target, default=1, help="Watch DB1 (1), DB2 (2) or a named target of the configuration (defaults to 1)")
+    parser.add_argument("--state", default="plan_watch.db", help="SQLite file with the last known plans (defaults to plan_watch.db)")
+    parser.add_argument("--top", type=int, default=50, help="Number of statements with the highest total time that are watched (defaults to 50)")
+    parser.add_argument("--min-calls", type=int, default=1, help="Ignore statements with fewer calls (defaults to 1)")
+    parser.add_argument("--interval", type=float, default=60.0, help="Seconds between polls (defaults to 60)")
+    parser.add_argument("--iterations", type=int, help="Stop after this many polls")
+    parser.add_argument("--once", action="store_true", help="Poll once, e.g. from cron or after a release")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes before hashing")
+    parser.add_argument("--statement-timeout", type=int, default=5000, help="Statement timeout of the watcher in ms (defaults to 5000)")
+    args = parser.parse_args()
+
+    watch(args.config, args.target, args.state, args.top, args.interval, 1 if args.once else args.iterations,
+          args.min_calls, args.canonical, args.statement_timeout)
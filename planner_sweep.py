@@ -0,0 +1,128 @@
+import sys
+import json
+import itertools
+from batch_output import log
+from target_config import parse_target
+from comparison_api import Comparator, ComparisonError
+
+
+def parse_grid(assignments):
+    """
+    Parse the settings of the command line into a grid.
+
+    Args:
+        assignments (list of str): Settings with their values, e.g. ["enable_hashjoin=on,off", "work_mem=4MB,64MB"].
+
+    Returns:
+        dict: A dictionary mapping each setting to the list of its values.
+    """
+    grid = {}
+    for assignment in assignments:
+        name, separator, values = assignment.partition("=")
+        if not separator or not name.strip() or not values.strip():
+            raise ValueError(f"Expected <setting>=<value>[,<value>...], got {assignment!r}")
+        grid.setdefault(name.strip(), []).extend(value.strip() for value in values.split(",") if value.strip())
+    return grid
+
+
+def combinations(grid):
+    """
+    Get all combinations of the values of a grid.
+
+    Args:
+        grid (dict): A dictionary mapping each setting to the list of its values.
+
+    Returns:
+        list of dict: The combinations, e.g. [{"enable_hashjoin": "on", "work_mem": "4MB"}, ...].
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+def sweep(comparator, query, grid, target=1, analyze=False, explain_options=None, canonical=False):
+    """
+    Explain a query with the default settings (the baseline) and with every combination of a grid of planner settings.
+    All plans are captured in one session on a pooled connection, and each combination is applied with SET LOCAL
+    in its own transaction, so the settings never leak into the next combination or other users of the pool.
+    The plans are deduplicated by their hash, and the TED to the baseline is computed once per distinct plan.
+
+    Args:
+        comparator (Comparator): The comparator with the connection pools and caches.
+        query (str): The SQL text of the query file.
+        grid (dict): A dictionary mapping each setting to the list of its values.
+        target (int or str, optional): The database, 1 for DB1, 2 for DB2 or the name of a target. Defaults to 1.
+        analyze (bool, optional): Whether to use EXPLAIN ANALYZE, which adds the execution time of each combination.
+        explain_options (list of str, optional): Additional EXPLAIN options, see preprocess_query.
+        canonical (bool, optional): Whether the trees are canonicalized before hashing (see --canonical). Defaults to False.
+
+    Returns:
+        dict: The number of combinations and distinct plans (including the baseline), the hash of the baseline,
+            the distinct plans sorted by their TED to the baseline with the combinations that produce them,
+            and the combinations that failed.
+    """
+    runs = []
+    failures = []
+    grid_combinations = combinations(grid)
+    with comparator.session(target) as connection:
+        baseline = comparator.explain(query, target, analyze, explain_options, None, connection)
+        runs.append(({}, baseline))
+        for settings in grid_combinations:
+            try:
+                runs.append((settings, comparator.explain(query, target, analyze, explain_options, settings, connection)))
+            except ComparisonError as error:
+                # e.g. an unknown setting or an invalid value, the other combinations are still explained
+                failures.append({"settings": settings, "error": str(error)})
+
+    baseline_tree, baseline_hash, _ = comparator.tree(baseline, canonical)
+    plans = {}
+    for settings, result in runs:
+        tree, plan_hash, _ = comparator.tree(result, canonical)
+        if plan_hash not in plans:
+            ted, _ = comparator.distance(baseline_tree, baseline_hash, tree, plan_hash)
+            plans[plan_hash] = {"plan_hash": plan_hash, "ted": ted, "baseline": plan_hash == baseline_hash, "runs": []}
+        run = {"settings": settings, "total_cost": result.get("Plan", {}).get("Total Cost")}
+        if analyze:
+            run["execution_time"] = result.get("Execution Time")
+        plans[plan_hash]["runs"].append(run)
+
+    return {"combinations": len(grid_combinations), "distinct_plans": len(plans), "baseline_hash": baseline_hash,
+            "plans": sorted(plans.values(), key=lambda plan: (plan["ted"], plan["plan_hash"])), "failures": failures}
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare the plans of a query across combinations of planner settings.")
+    parser.add_argument("query_file", help="File containing the SQL query")
+    parser.add_argument("--set", action="append", default=[], dest="settings",
+                        help="A setting and its values, e.g. --set enable_hashjoin=on,off (can be repeated)")
+    parser.add_argument("--grid", help="JSON file mapping settings to lists of values, combined with --set")
+    parser.add_argument("--target", type=parse_target, default=1, help="Explain on DB1 (1), DB2 (2) or a named target of the configuration (defaults to 1)")
+    parser.add_argument("--analyze", action="store_true", help="Use EXPLAIN ANALYZE and report the execution time of each combination")
+    parser.add_argument("--explain-options", help="Comma-separated additional EXPLAIN options, see tree_edit_distance_tool.py")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes before hashing")
+    parser.add_argument("--config", default="config.json", help="Database configuration file (defaults to config.json)")
+    args = parser.parse_args()
+
+    try:
+        grid = parse_grid(args.settings)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.grid:
+        with open(args.grid, "r") as file:
+            for name, values in json.load(file).items():
+                grid.setdefault(name, []).extend(str(value) for value in values)
+    if not grid:
+        parser.error("No settings given, use --set or --grid")
+    explain_options = [option.strip().upper() for option in args.explain_options.split(',') if option.strip()] if args.explain_options else None
+
+    with open(args.query_file, "r") as file:
+        query = file.read().strip()
+
+    with Comparator(args.config, pool_size=1) as comparator:
+        try:
+            report = sweep(comparator, query, grid, args.target, args.analyze, explain_options, args.canonical)
+        except ComparisonError as error:
+            log(f"Error: {error}")
+            sys.exit(1)
+    log(f"{report['combinations']} combinations, {report['distinct_plans']} distinct plans, {len(report['failures'])} failed")
+    print(json.dumps({"query": args.query_file, **report}))
@@ -0,0 +1,119 @@
+import time
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+class StageProfiler:
+    """
+    Record the wall and CPU time of the stages of a comparison (connecting, executing, fetching, conversion, TED, plotting).
+    A disabled profiler records nothing, so the stages can always be wrapped without slowing down normal runs.
+    """
+    def __init__(self, enabled=True):
+        """
+        Args:
+            enabled (bool, optional): Whether the stages are recorded. Defaults to True.
+        """
+        self.enabled = enabled
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure a stage. Stages with the same name are added up.
+
+        Args:
+            name (str): The name of the stage.
+        """
+        if not self.enabled:
+            yield
+            return
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"wall_ms": 0.0, "cpu_ms": 0.0, "calls": 0})
+            stage["wall_ms"] += (time.perf_counter() - wall) * 1000
+            stage["cpu_ms"] += (time.process_time() - cpu) * 1000
+            stage["calls"] += 1
+
+    def count(self, name, value):
+        """
+        Record a counter, e.g. the number of nodes of a plan.
+
+        Args:
+            name (str): The name of the counter.
+            value: The value of the counter.
+        """
+        if self.enabled:
+            self.counters[name] = value
+
+    def report(self):
+        """
+        Returns:
+            dict: The stages with their wall and CPU time in milliseconds, and the counters.
+        """
+        stages = {name: {key: round(value, 3) if isinstance(value, float) else value for key, value in stage.items()}
+                  for name, stage in self.stages.items()}
+        return {"stages": stages, **self.counters}
+
+
+def label_stats(*trees):
+    """
+    Compute the node counts and label interning statistics of trees: how many labels are distinct
+    and how much memory the labels would take if every distinct label was stored only once.
+
+    Args:
+        *trees (TreeNode): The trees.
+
+    Returns:
+        dict: The number of nodes, the number of distinct labels, the total size of the labels in bytes,
+            the size of the distinct labels in bytes, and the number of labels that are already shared objects.
+    """
+    nodes = 0
+    total_bytes = 0
+    distinct = {}
+    objects = set()
+    for tree in trees:
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            nodes += 1
+            total_bytes += len(node.label)
+            distinct.setdefault(node.label, len(node.label))
+            objects.add(id(node.label))
+            stack.extend(node.children)
+    return {"nodes": nodes, "distinct_labels": len(distinct), "label_bytes": total_bytes,
+            "distinct_label_bytes": sum(distinct.values()), "shared_labels": nodes - len(objects)}
+
+
+def profile_call(function, *args, cprofile_file=None, tracemalloc_file=None):
+    """
+    Call a function under cProfile and tracemalloc and dump their results.
+
+    Args:
+        function (callable): The function to call.
+        *args: The arguments of the function.
+        cprofile_file (str, optional): The file the cProfile statistics are dumped to (readable with pstats).
+        tracemalloc_file (str, optional): The file the tracemalloc snapshot is dumped to (readable with tracemalloc.Snapshot.load).
+
+    Returns:
+        The result of the function.
+    """
+    if tracemalloc_file:
+        tracemalloc.start()
+    profiler = cProfile.Profile() if cprofile_file else None
+    try:
+        if profiler:
+            profiler.enable()
+        result = function(*args)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(cprofile_file)
+        if tracemalloc_file:
+            tracemalloc.take_snapshot().dump(tracemalloc_file)
+            tracemalloc.stop()
+    return result
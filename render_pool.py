@@ -0,0 +1,102 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from batch_output import log
+
+
+def create_figure(figsize, show=False):
+    """
+    Create a figure for a plot. Headless figures are plain Figure objects with an Agg canvas that are not
+    registered with pyplot, so they do not touch the global pyplot state and are freed once they are saved.
+
+    Args:
+        figsize (tuple): The size of the figure in inches.
+        show (bool, optional): Whether the figure will be shown in a window. Defaults to False.
+
+    Returns:
+        matplotlib.figure.Figure: The new figure.
+    """
+    if show:
+        return plt.figure(figsize=figsize)
+    figure = Figure(figsize=figsize)
+    FigureCanvasAgg(figure)
+    return figure
+
+
+def finish_figure(figure, filename=None, show=False):
+    """
+    Save a figure and either show it (blocking until the window is closed) or release it.
+
+    Args:
+        figure (matplotlib.figure.Figure): The figure created with create_figure.
+        filename (str, optional): The file the figure is saved to. Defaults to None (not saved).
+        show (bool, optional): Whether to show the figure in a window. Defaults to False.
+    """
+    figure.tight_layout()
+    if filename:
+        figure.savefig(filename)
+    if show:
+        plt.show()
+        plt.close(figure)
+    else:
+        figure.clear()
+
+
+def _render(function, args, kwargs):
+    """
+    Run a render job in a worker process with the non-interactive Agg backend.
+    """
+    plt.switch_backend("Agg")
+    function(*args, **kwargs)
+
+
+class RenderPool:
+    """
+    Render plots in background processes, so that a batch keeps comparing queries while the images are written.
+    """
+    def __init__(self, max_workers=None):
+        """
+        Start the pool of render processes.
+
+        Args:
+            max_workers (int, optional): Number of render processes. Defaults to half of the CPUs.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=max_workers or max(1, (os.cpu_count() or 2) // 2))
+        self.futures = []
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queue a render job. The function and its arguments must be picklable, e.g. a module-level
+        plotting function called with TreeNode trees or file names, and must not show the figure.
+
+        Args:
+            function (callable): The plotting function.
+            *args: The positional arguments of the function.
+            **kwargs: The keyword arguments of the function.
+        """
+        self.futures.append(self.executor.submit(_render, function, args, kwargs))
+
+    def close(self):
+        """
+        Wait for all render jobs to finish and report the ones that failed.
+
+        Returns:
+            int: The number of failed render jobs.
+        """
+        failed = 0
+        for future in self.futures:
+            error = future.exception()
+            if error is not None:
+                failed += 1
+                log(f"Error while rendering a plot: {error}")
+        self.executor.shutdown()
+        self.futures = []
+        return failed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
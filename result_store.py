@@ -0,0 +1,313 @@
+import sqlite3
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+# Counters of the additional EXPLAIN options (BUFFERS, WAL, SETTINGS, SUMMARY), stored for both plans
+EXPLAIN_COUNTERS = ['planning_time', 'shared_hit_blocks', 'shared_read_blocks', 'shared_dirtied_blocks',
+                    'shared_written_blocks', 'temp_read_blocks', 'temp_written_blocks', 'io_read_time',
+                    'io_write_time', 'wal_records', 'wal_bytes', 'settings']
+COUNTER_COLUMNS = [f"{counter}_{side}" for counter in EXPLAIN_COUNTERS for side in (1, 2)]
+
+# Columns of the results table that can be requested by the analysis
+RESULT_COLUMNS = ['run_id', 'benchmark', 'query', 'ted', 'execution_time_1', 'execution_time_2',
+                  'time_difference', 'plan_hash_1', 'plan_hash_2', 'repetitions'] + COUNTER_COLUMNS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at TEXT NOT NULL,
+    benchmark TEXT NOT NULL,
+    directory1 TEXT,
+    directory2 TEXT,
+    analyze INTEGER NOT NULL DEFAULT 0,
+    repetitions INTEGER NOT NULL DEFAULT 1,
+    explain_options TEXT
+);
+
+CREATE TABLE IF NOT EXISTS results (
+    result_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id INTEGER NOT NULL REFERENCES runs(run_id),
+    benchmark TEXT NOT NULL,
+    query TEXT NOT NULL,
+    ted INTEGER,
+    execution_time_1 REAL,
+    execution_time_2 REAL,
+    time_difference REAL,
+    plan_hash_1 TEXT,
+    plan_hash_2 TEXT,
+    repetitions INTEGER NOT NULL DEFAULT 1
+);
+-- The counter columns are added by open_store, so that stores created by older versions are upgraded too
+
+CREATE INDEX IF NOT EXISTS idx_results_benchmark ON results(benchmark);
+CREATE INDEX IF NOT EXISTS idx_results_query ON results(query);
+CREATE INDEX IF NOT EXISTS idx_results_run ON results(run_id);
+"""
+
+
+def open_store(path):
+    """
+    Open (and create if necessary) the SQLite result store.
+
+    Args:
+        path (str): Path to the SQLite database file.
+
+    Returns:
+        sqlite3.Connection: The connection to the result store.
+    """
+    connection = sqlite3.connect(path)
+    connection.executescript(SCHEMA)
+
+    # Add the columns that are missing in stores created by older versions
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(results)")}
+    with connection:
+        for column in COUNTER_COLUMNS:
+            if column not in existing:
+                column_type = "TEXT" if column.startswith("settings") else "REAL"
+                connection.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+        if "explain_options" not in {row[1] for row in connection.execute("PRAGMA table_info(runs)")}:
+            connection.execute("ALTER TABLE runs ADD COLUMN explain_options TEXT")
+    return connection
+
+
+def infer_benchmark(query):
+    """
+    Infer the benchmark a query belongs to from its file name.
+    TPC-DS queries are named queryN.sql, JOB queries Na.sql and TPC-H queries N.sql.
+
+    Args:
+        query (str): The file name of the query.
+
+    Returns:
+        str: The name of the benchmark, or "unknown" if it cannot be inferred.
+    """
+    name = os.path.basename(query)
+    if re.fullmatch(r'query[0-9]+\.sql', name):
+        return "tpcds"
+    if re.fullmatch(r'[0-9]+[a-z]\.sql', name):
+        return "job"
+    if re.fullmatch(r'[0-9]+\.sql', name):
+        return "tpch"
+    return "unknown"
+
+
+def start_run(connection, benchmark, directory1=None, directory2=None, analyze=False, repetitions=1, explain_options=None):
+    """
+    Register a new batch run in the result store.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the result store.
+        benchmark (str): The benchmark that is compared in this run.
+        directory1 (str, optional): The first query directory.
+        directory2 (str, optional): The second query directory.
+        analyze (bool, optional): Whether EXPLAIN ANALYZE was used. Defaults to False.
+        repetitions (int, optional): Number of times each query is executed. Defaults to 1.
+        explain_options (list of str, optional): The additional EXPLAIN options of the run, e.g. ["BUFFERS"].
+
+    Returns:
+        int: The id of the new run.
+    """
+    with connection:
+        cursor = connection.execute(
+            "INSERT INTO runs (started_at, benchmark, directory1, directory2, analyze, repetitions, explain_options) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (datetime.now(timezone.utc).isoformat(), benchmark, directory1, directory2, int(analyze), repetitions,
+             ",".join(explain_options) if explain_options else None))
+    return cursor.lastrowid
+
+
+def insert_results(connection, run_id, rows):
+    """
+    Insert the results of a run in a single transaction.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the result store.
+        run_id (int): The id of the run the results belong to.
+        rows (list of dict): The results, keyed by the names in RESULT_COLUMNS. Missing values are stored as NULL.
+    """
+    columns = [column for column in RESULT_COLUMNS if column != 'run_id']
+    placeholders = ", ".join("?" for _ in range(len(columns) + 1))
+    values = [(run_id,) + tuple(row.get(column, 1 if column == 'repetitions' else None) for column in columns) for row in rows]
+    # Settings are stored as JSON text
+    settings = [index + 1 for index, column in enumerate(columns) if column.startswith('settings')]
+    values = [tuple(json.dumps(value) if index in settings and value is not None and not isinstance(value, str) else value
+                    for index, value in enumerate(row)) for row in values]
+    with connection:
+        connection.executemany(f"INSERT INTO results (run_id, {', '.join(columns)}) VALUES ({placeholders})", values)
+
+
+class ResultWriter:
+    """
+    Buffer results of a batch run and write them to the result store in bulk transactions.
+    """
+    def __init__(self, path, benchmark, directory1=None, directory2=None, analyze=False, repetitions=1, batch_size=100,
+                 explain_options=None):
+        """
+        Open the result store and register a new run.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            benchmark (str): The benchmark that is compared in this run.
+            directory1 (str, optional): The first query directory.
+            directory2 (str, optional): The second query directory.
+            analyze (bool, optional): Whether EXPLAIN ANALYZE was used. Defaults to False.
+            repetitions (int, optional): Number of times each query is executed. Defaults to 1.
+            batch_size (int, optional): Number of results that are buffered before they are written. Defaults to 100.
+            explain_options (list of str, optional): The additional EXPLAIN options of the run, e.g. ["BUFFERS"].
+        """
+        self.connection = open_store(path)
+        self.benchmark = benchmark
+        self.batch_size = batch_size
+        self.run_id = start_run(self.connection, benchmark, directory1, directory2, analyze, repetitions, explain_options)
+        self.buffer = []
+
+    def add(self, row):
+        """
+        Add the result of one compared query pair, flushing the buffer when it is full.
+
+        Args:
+            row (dict): The result, keyed by the names in RESULT_COLUMNS.
+        """
+        row.setdefault('benchmark', self.benchmark)
+        self.buffer.append(row)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all buffered results in a single transaction.
+        """
+        if self.buffer:
+            insert_results(self.connection, self.run_id, self.buffer)
+            self.buffer = []
+
+    def close(self):
+        """
+        Flush the remaining results and close the result store.
+        """
+        self.flush()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def average_counters(outputs):
+    """
+    Average the EXPLAIN counters of several runs of the same query pair, e.g. the buffers of the repetitions
+    of run_queries_avg.py. Counters missing in a run are ignored and the settings of the last run are kept.
+
+    Args:
+        outputs (list of dict): The JSON outputs of tree_edit_distance_tool.py.
+
+    Returns:
+        dict: The averaged counters, keyed by the names in COUNTER_COLUMNS.
+    """
+    row = {}
+    for column in COUNTER_COLUMNS:
+        values = [output[column] for output in outputs if output.get(column) is not None]
+        if not values:
+            continue
+        row[column] = values[-1] if column.startswith('settings') else sum(values) / len(values)
+    return row
+
+
+def load_results(path, columns=None, benchmark=None, query=None, run_id=None):
+    """
+    Load results from the result store, reading only the requested columns.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        columns (list of str, optional): The columns to read. Defaults to all columns in RESULT_COLUMNS.
+        benchmark (str or list of str, optional): Only load results of these benchmarks.
+        query (str, optional): Only load results of this query.
+        run_id (int, optional): Only load results of this run.
+
+    Returns:
+        dict: A dictionary mapping each requested column to the list of its values.
+    """
+    columns = list(columns) if columns else list(RESULT_COLUMNS)
+    unknown = [column for column in columns if column not in RESULT_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown result columns: {unknown}")
+
+    # Build the filter on the indexed columns
+    conditions = []
+    parameters = []
+    if benchmark is not None:
+        benchmarks = [benchmark] if isinstance(benchmark, str) else list(benchmark)
+        conditions.append(f"benchmark IN ({', '.join('?' for _ in benchmarks)})")
+        parameters.extend(benchmarks)
+    if query is not None:
+        conditions.append("query = ?")
+        parameters.append(query)
+    if run_id is not None:
+        conditions.append("run_id = ?")
+        parameters.append(run_id)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    connection = open_store(path)
+    try:
+        rows = connection.execute(f"SELECT {', '.join(columns)} FROM results{where} ORDER BY result_id", parameters).fetchall()
+    finally:
+        connection.close()
+
+    # Transpose the rows into columns
+    values = list(zip(*rows)) if rows else [() for _ in columns]
+    return {column: list(value) for column, value in zip(columns, values)}
+
+
+def import_legacy_results(path, json_file, benchmark=None):
+    """
+    Import a comparison_result_*.json file written by run_queries.py or run_queries_avg.py
+    (a list of [query, ted] or [query, ted, time_difference] entries) into the result store.
+
+    Args:
+        path (str): Path to the SQLite database file.
+        json_file (str): Path to the JSON file to import.
+        benchmark (str, optional): The benchmark of the results. If not given it is inferred from each query name.
+
+    Returns:
+        int: The number of imported results.
+    """
+    with open(json_file, 'r') as file:
+        entries = json.load(file)
+
+    # Group the entries by benchmark, so that each benchmark gets its own run
+    grouped = {}
+    for entry in entries:
+        name = benchmark or infer_benchmark(entry[0])
+        row = {'benchmark': name, 'query': entry[0], 'ted': entry[1]}
+        if len(entry) > 2:
+            row['time_difference'] = entry[2]
+        grouped.setdefault(name, []).append(row)
+
+    connection = open_store(path)
+    try:
+        for name, rows in grouped.items():
+            run_id = start_run(connection, name, directory1=json_file, analyze=any('time_difference' in row for row in rows))
+            insert_results(connection, run_id, rows)
+    finally:
+        connection.close()
+    return len(entries)
+
+
+if __name__ == "__main__":
+    import argparse
+    # Argument parsing for command-line execution
+    parser = argparse.ArgumentParser(description="Manage the local result store of the batch comparisons.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import comparison_result_*.json files into the result store")
+    import_parser.add_argument("database", help="Path to the SQLite result store")
+    import_parser.add_argument("json_files", nargs="+", help="JSON files written by run_queries.py or run_queries_avg.py")
+    import_parser.add_argument("--benchmark", help="Benchmark of the results (inferred from the query names if omitted)")
+
+    args = parser.parse_args()
+    if args.command == "import":
+        for json_file in args.json_files:
+            count = import_legacy_results(args.database, json_file, args.benchmark)
+            print(f"Imported {count} results from {json_file}")
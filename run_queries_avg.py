@@ -1,11 +1,86 @@
 import subprocess
 import os
 import json
+import time
 import platform
-import matplotlib.pyplot as plt
 import numpy as np
+from render_pool import create_figure, finish_figure, RenderPool
+from tree_visualisation import plot_stored_plans
+from tree_edit_distance_tool import stored_plan_files
+from batch_output import log, emit_record, parse_tool_output, option_value
+from result_store import ResultWriter, average_counters
+from scheduler import plan_batch
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def compare_queries_in_directories(directory1, directory2, plot=False, analyze=False, store=False):
+# TPC-DS queries that are skipped by default because they take too long
+DEFAULT_SKIP_FILES = {f"query{num}.sql" for num in {1,11,74,4}}
+
+def run_comparison(directory1, directory2, file, analyze=False, num_runs=1, store=False, explain_options=None, track_io_timing=False,
+                   canonical=False, archive=None, archive_run=None):
+    """
+    Run the tree edit distance tool on one query file num_runs times.
+
+    Args:
+        directory1 (str): Path to the first directory containing query files.
+        directory2 (str): Path to the second directory containing query files.
+        file (str): The name of the query file.
+        analyze (bool, optional): Whether to use explain analyze. Defaults to False.
+        num_runs (int, optional): Number of times the query is executed. Defaults to 1.
+        store (bool, optional): Whether the tool stores the EXPLAIN results in files. Defaults to False.
+        explain_options (list of str, optional): Additional EXPLAIN options (BUFFERS, WAL, SETTINGS, SUMMARY).
+        track_io_timing (bool, optional): Whether the tool enables track_io_timing. Defaults to False.
+        canonical (bool, optional): Whether the tool sorts the children of order-insensitive nodes. Defaults to False.
+        archive (str, optional): The plan archive directory the tool adds the EXPLAIN results to. Defaults to None.
+        archive_run (str, optional): The run of the batch in the archive, each repetition is archived as <archive_run>/<n>.
+
+    Returns:
+        tuple: A tuple containing the output of the last successful run (or None if all runs failed),
+            the time differences and the execution times of both databases for each run,
+            and the EXPLAIN counters averaged over the runs.
+    """
+    log(f"Executing query {file}")
+    file_path1 = os.path.join(directory1, file)
+    file_path2 = os.path.join(directory2, file)
+    time_differences = []
+    execution_times = []
+    outputs = []
+    tpl = None
+
+    for run in range(num_runs):
+        log(f"Run: {run} ({file})")
+        command = ["python3", "tree_edit_distance_tool.py", file_path1, file_path2]
+        if analyze:
+            command.append("--analyze")
+        if store:
+            command.append("--store")
+        if explain_options:
+            command += ["--explain-options", ",".join(explain_options)]
+        if track_io_timing:
+            command.append("--track-io-timing")
+        if canonical:
+            command.append("--canonical")
+        if archive:
+            command += ["--archive", archive, "--run", f"{archive_run}/{run}"]
+
+        # Execute the command and capture the output
+        res = subprocess.run(command, capture_output=True, text=True)
+        output = parse_tool_output(res)
+
+        if output is None:
+            log(f"Error found in query {file}: {res.stderr}")
+            continue
+        tpl = output
+        outputs.append(output)
+        if analyze and 'time_difference' in tpl:
+            time_differences.append(tpl['time_difference'])
+            execution_times.append((tpl['execution_time_1'], tpl['execution_time_2']))
+
+    return tpl, time_differences, execution_times, average_counters(outputs)
+
+def compare_queries_in_directories(directory1, directory2, plot=False, analyze=False, store=False, stream=False, database=None,
+                                   workers=1, schedule=None, max_cost=None, max_time=None, skip_files=None, headless=False,
+                                   collapse=False, explain_options=None, track_io_timing=False, canonical=False,
+                                   archive=None):
     """
     Compare queries in two directories and generate comparison results. 
     When analyze is true the queries are executed multiple times and the average time difference is calculated.
@@ -16,14 +91,32 @@ def compare_queries_in_directories(directory1, directory2, plot=False, analyze=F
         plot (bool, optional): Whether to plot the comparison results. Defaults to False.
         analyze (bool, optional): Whether to use explain analyze. Defaults to False.
         store (bool, optional): Whether to store the comparison results in a file. Defaults to False.
+        stream (bool, optional): Whether to emit one JSON object per compared query on stdout
+            as soon as it is ready (JSON Lines) instead of printing all results at the end. Defaults to False.
+        database (str, optional): Path to the SQLite result store the results are written to. Defaults to None.
+        workers (int, optional): Number of queries that are compared in parallel. Defaults to 1.
+            Note that parallel EXPLAIN ANALYZE runs compete for the same database resources.
+        schedule (str, optional): Order the queries longest-first by their plain EXPLAIN "cost" or by their
+            runtime in previous runs ("history", requires database). Defaults to None (name order).
+        max_cost (float, optional): Skip queries whose estimated total cost is larger than this value. Defaults to None.
+        max_time (float, optional): Skip queries whose runtime in previous runs (ms) is larger than this value. Defaults to None.
+        skip_files (set of str, optional): Query files that are always skipped. Defaults to DEFAULT_SKIP_FILES.
+        headless (bool, optional): Whether to save the plots without showing them in a window. Defaults to False.
+            With plot and store, the execution plans of each query are always rendered headless in background processes.
+        collapse (bool, optional): Whether to collapse the subtrees that are identical in both plans in the rendered
+            execution plans. Defaults to False.
+        explain_options (list of str, optional): Additional EXPLAIN options (BUFFERS, WAL, SETTINGS, SUMMARY),
+            their counters are stored in the result store.
+        track_io_timing (bool, optional): Whether to enable track_io_timing where permitted. Defaults to False.
+        canonical (bool, optional): Whether to sort the children of order-insensitive nodes before the comparison. Defaults to False.
+        archive (str, optional): Path to the plan archive the EXPLAIN results of the batch are added to
+            (see plan_archive.py). Defaults to None.
 
     Returns:
         None
 
-    Note: Make sure that nothing else is printed in the terminal other than the results.
-        .i.e. Do not print any debug statements or print statements in the tree_edit_distance_tool.py script,
-        the tree_edit_distance.py script, or the tree_visualisation.py script.
-        The only print statement that should be present is print(json.dumps(json_output)) in the tree_edit_distance_tool.py script.
+    Note: Progress and diagnostic messages are printed to stderr, so stdout only contains the results.
+        The only print statement on stdout in the tree_edit_distance_tool.py script is print(json.dumps(json_output)).
 
     """
     # Get the list of files in each directory
@@ -36,119 +129,165 @@ def compare_queries_in_directories(directory1, directory2, plot=False, analyze=F
     sql_files2 = {file for file in files2 if file.endswith('.sql')}
     common_files = sql_files1.intersection(sql_files2)
 
-    # # List of file numbers to skip
-    skip_file_numbers = {1,11,74,4}
-
-
-    # Construct the set of filenames to skip in the TPC-DS queries
-    skip_files = {f"query{num}.sql" for num in skip_file_numbers}
-
     # Remove the skip files from the common files set
-    common_files -= skip_files
+    common_files -= DEFAULT_SKIP_FILES if skip_files is None else skip_files
 
+    # In streaming mode results are only kept in memory when they are needed for the plots
+    keep_results = plot or not stream
     results = []
     num_runs = 3 if analyze else 1  # Number of runs for analysis
-    
+    benchmark = directory1.split('/')[1]
+
+    # When streaming, stored results are appended line by line instead of rewriting the whole file
+    stream_file = None
+    if store and stream:
+        stream_file = open(f"comparison_result_avg_{benchmark}.jsonl", 'w')
+
+    # Register the run in the result store, results are written in bulk transactions
+    writer = ResultWriter(database, benchmark, directory1, directory2, analyze, num_runs,
+                          explain_options=explain_options) if database else None
+
+    # All plans of the batch belong to one run of the archive, named after the run of the result store if there is one
+    archive_run = None
+    if archive:
+        archive_run = f"{benchmark}-{writer.run_id}" if writer else f"{benchmark}-{time.strftime('%Y%m%dT%H%M%S')}"
+        log(f"Archiving the plans in {archive} (run {archive_run})")
+
+    # Order the queries (slowest first) and apply the cost or time thresholds
+    ordered_files, skipped_files = plan_batch(directory1, directory2, common_files, schedule, database, benchmark, max_cost, max_time)
+    if skipped_files:
+        log(f"Skipping queries over the threshold: {sorted(skipped_files)}")
+
     #print the files that are going to be compared
-    print(common_files)
-
-    # Iterate through each common SQL file and compare them
-    for file in common_files:
-        print(f"Executing query {file}")
-        file_path1 = os.path.join(directory1, file)
-        file_path2 = os.path.join(directory2, file)
-        time_differences = []
-
-        for run in range(num_runs):
-            print(f"Run: {run}")
-            command = ["python3", "tree_edit_distance_tool.py", file_path1, file_path2]
-            if analyze:
-                command.append("--analyze")
-
-            # Execute the command and capture the output
-            res = subprocess.run(command, capture_output=True, text=True)
-            
-            if res.stderr:
-                print(f"Error found in query {file}: {res.stderr}")
-            else:
-                tpl = json.loads(res.stdout)
-                if analyze and run >= 0 and 'time_difference' in tpl:
-                    time_differences.append(tpl['time_difference'])
-        
+    log(ordered_files)
+
+    # Render the execution plans of each query in background processes while the batch continues
+    render_pool = RenderPool() if plot and store else None
+
+    # The executor starts the queries in the scheduled order and the results are handled as they complete
+    executor = ThreadPoolExecutor(max_workers=workers)
+    # The tool only stores the EXPLAIN results when the render pool reads them
+    futures = [executor.submit(run_comparison, directory1, directory2, file, analyze, num_runs, render_pool is not None,
+                               explain_options, track_io_timing, canonical, archive, archive_run) for file in ordered_files]
+    for future in as_completed(futures):
+        tpl, time_differences, execution_times, counters = future.result()
+
+        # Skip the query if none of its runs succeeded
+        if tpl is None:
+            continue
+
         # Extract and store the results
         query = tpl.get('query1', 'Unknown Query').split(os.sep)[-1]
-        comparison_result = tpl.get('comparison_result', 'Unknown')
+        comparison_result = tpl.get('TED', 'Unknown')
+
+        if render_pool:
+            name = query.replace('.sql', '')
+            render_pool.submit(plot_stored_plans, *stored_plan_files(tpl['query1'], tpl['query2']), f"execution_plans_{name}_{name}.png", collapse)
         
         # Append the results depending on whether the --analyze flag was used
         if analyze and time_differences:
             average_time_difference = sum(time_differences) / len(time_differences)
-            results.append([query, comparison_result, average_time_difference])
+            result = [query, comparison_result, average_time_difference]
         else:
-            results.append([query, comparison_result])
+            result = [query, comparison_result]
+
+        if stream:
+            # Emit the completed pair immediately
+            record = {"query": query, "TED": comparison_result}
+            if len(result) > 2:
+                record["average_time_difference"] = result[2]
+                record["runs"] = len(time_differences)
+            emit_record(record)
+            if stream_file:
+                emit_record(record, stream_file)
+        if keep_results:
+            results.append(result)
+        if writer:
+            row = {"query": query, "ted": tpl.get('TED'), "plan_hash_1": tpl.get('plan_hash_1'),
+                   "plan_hash_2": tpl.get('plan_hash_2'), "repetitions": max(len(time_differences), 1)}
+            if len(result) > 2:
+                row["time_difference"] = result[2]
+                row["execution_time_1"] = sum(t[0] for t in execution_times) / len(execution_times)
+                row["execution_time_2"] = sum(t[1] for t in execution_times) / len(execution_times)
+            row.update(counters)
+            writer.add(row)
 
         # Store the results if the flag --store was given
-        if store: 
-            output_file = f"comparison_result_avg_{directory1.split('/')[1]}.json"
+        if store and not stream:
+            output_file = f"comparison_result_avg_{benchmark}.json"
             with open(output_file, 'w') as file:
                 json.dump(results, file)
-                print(f"Results stored in {output_file}")
+                log(f"Results stored in {output_file}")
 
-    for result in results:
-        print(result)
+    executor.shutdown()
+    if render_pool:
+        failed = render_pool.close()
+        log(f"Execution plans plotted ({failed} failed)")
+
+    if writer:
+        writer.close()
+        log(f"Results stored in {database} (run {writer.run_id})")
+
+    if stream_file:
+        stream_file.close()
+        log(f"Results stored in {stream_file.name}")
+    else:
+        for result in results:
+            print(result)
 
     # Generate plots if the --plot flag was given
     if plot:
-        plot_explain_results(results, directory1.split('/')[1])
+        plot_explain_results(results, benchmark, not headless)
 
     # if analyze and plot are true, plot the analyze results too
     if plot and analyze:
-        plot_explain_analyze_results(results, directory1.split('/')[1])
+        plot_explain_analyze_results(results, benchmark, not headless)
     
-def plot_explain_results(results, directory):
+def plot_explain_results(results, directory, show=True):
     """
     Generates and saves a histogram of Tree Edit Distance values from the results.
     
     Parameters:
     - results (list): The list of results containing Tree Edit Distance values.
     - directory (str): The directory name used in the plot title and file name.
+    - show (bool): Whether to show the plot in a window. If False the plot is rendered headless. Defaults to True.
     
     Returns:
     - None
     """
-    print("Plotting histogram...")
+    log("Plotting histogram...")
     # Extract queries and ted values
     queries = [result[0] for result in results]
     comparison_values = [result[1] for result in results]
 
     # Create a histogram of the ted values
-    plt.figure(figsize=(10, 6))
-    plt.hist(comparison_values, bins=np.arange(min(comparison_values), max(comparison_values) + 2) - 0.5, color='steelblue', edgecolor='black', align='mid')
+    figure = create_figure((10, 6), show)
+    ax = figure.subplots()
+    ax.hist(comparison_values, bins=np.arange(min(comparison_values), max(comparison_values) + 2) - 0.5, color='steelblue', edgecolor='black', align='mid')
 
-    plt.xlabel('Tree Edit Distance')
-    plt.ylabel('No. of Queries')
-    plt.title(f"Tree Edit Distance Value Frequency of Queries in {directory}")
-    plt.xticks(rotation=90)
-    plt.tight_layout()
+    ax.set_xlabel('Tree Edit Distance')
+    ax.set_ylabel('No. of Queries')
+    ax.set_title(f"Tree Edit Distance Value Frequency of Queries in {directory}")
+    ax.tick_params(axis='x', labelrotation=90)
 
     # Save the plot as an image file
-    plt.savefig(f"comparison_results_histogram_avg_{directory}.png")
-    print(f"Plot saved as comparison_results_histogram_avg_{directory}.png")
+    finish_figure(figure, f"comparison_results_histogram_avg_{directory}.png", show)
+    log(f"Plot saved as comparison_results_histogram_avg_{directory}.png")
 
-    plt.show()
 
-
-def plot_explain_analyze_results(results, directory):
+def plot_explain_analyze_results(results, directory, show=True):
     """
     Generates and saves a scatter plot showing the correlation between Tree Edit Distance and execution time difference.
     
     Parameters:
     - results (list): The list of results containing Tree Edit Distance values and time differences.
     - directory (str): The directory name used in the plot title and file name.
+    - show (bool): Whether to show the plot in a window. If False the plot is rendered headless. Defaults to True.
     
     Returns:
     - None
     """
-    print("Plotting analyze results...")
+    log("Plotting analyze results...")
 
     # Extract queries, ted values and time differences
     queries = [result[0] for result in results]
@@ -156,25 +295,25 @@ def plot_explain_analyze_results(results, directory):
     time_differences = [result[2] for result in results if len(result) > 2]
 
     # Create a scatter plot of ted values vs. time differences
-    plt.figure(figsize=(10, 6))
-    plt.plot(comparison_values, time_differences, 'o', color='blue')
-    plt.xlabel('Tree Edit Distance')
-    plt.ylabel('Average Execution Time Difference (ms)')
-    plt.title(f"Correlation of Tree Edit Distance and Execution Time Difference for Queries in {directory}")
-    plt.xticks(rotation=90)
-    plt.tight_layout()
+    figure = create_figure((10, 6), show)
+    ax = figure.subplots()
+    ax.plot(comparison_values, time_differences, 'o', color='blue')
+    ax.set_xlabel('Tree Edit Distance')
+    ax.set_ylabel('Average Execution Time Difference (ms)')
+    ax.set_title(f"Correlation of Tree Edit Distance and Execution Time Difference for Queries in {directory}")
+    ax.tick_params(axis='x', labelrotation=90)
 
     # Save the plot as an image file
-    plt.savefig(f'comparison_analyze_results_avg_{directory}.png')
-    print(f"Plot saved as comparison_analyze_results_avg_{directory}.png")
-    
-    plt.show()
+    finish_figure(figure, f'comparison_analyze_results_avg_{directory}.png', show)
+    log(f"Plot saved as comparison_analyze_results_avg_{directory}.png")
 
 if __name__ == "__main__":
     import sys
     # Check if the script is being run with the correct number of arguments
     if len(sys.argv) < 3:
-        print("Usage: python compare_queries_in_directories.py <directory1> <directory2>")
+        print("Usage: python run_queries_avg.py <directory1> <directory2> [--plot] [--analyze] [--store] [--jsonl] [--db <results.db>]"
+              " [--workers <n>] [--schedule cost|history] [--max-cost <cost>] [--max-time <ms>] [--skip <file,...>] [--headless] [--collapse]"
+              " [--explain-options BUFFERS,WAL,SETTINGS,SUMMARY] [--track-io-timing] [--canonical] [--archive <dir>]")
         sys.exit(1)
     
     directory1 = sys.argv[1]
@@ -182,6 +321,25 @@ if __name__ == "__main__":
     plot = '--plot' in sys.argv
     analyze = '--analyze' in sys.argv
     store = '--store' in sys.argv
+    stream = '--jsonl' in sys.argv
+    database = option_value(sys.argv, '--db')
+    workers = int(option_value(sys.argv, '--workers', 1))
+    schedule = option_value(sys.argv, '--schedule')
+    max_cost = option_value(sys.argv, '--max-cost')
+    max_cost = float(max_cost) if max_cost is not None else None
+    max_time = option_value(sys.argv, '--max-time')
+    max_time = float(max_time) if max_time is not None else None
+    skip = option_value(sys.argv, '--skip')
+    skip_files = {file for file in skip.split(',') if file} if skip is not None else None
+    headless = '--headless' in sys.argv
+    collapse = '--collapse' in sys.argv
+    explain_options = option_value(sys.argv, '--explain-options')
+    explain_options = [option.strip().upper() for option in explain_options.split(',') if option.strip()] if explain_options else None
+    track_io_timing = '--track-io-timing' in sys.argv
+    canonical = '--canonical' in sys.argv
+    archive = option_value(sys.argv, '--archive')
 
     # Compare queries in the given directories
-    compare_queries_in_directories(directory1, directory2, plot, analyze, store)
+    compare_queries_in_directories(directory1, directory2, plot, analyze, store, stream, database,
+                                   workers, schedule, max_cost, max_time, skip_files, headless,
+                                   collapse, explain_options, track_io_timing, canonical, archive)
@@ -0,0 +1,246 @@
+import subprocess
+import os
+import socket
+import time
+from batch_output import log, emit_record, parse_tool_output
+from result_store import ResultWriter, average_counters
+from scheduler import plan_batch
+from work_queue import open_queue, enqueue, claim, renew, complete, fail, status_counts, completed_results
+
+# TPC-DS queries that are skipped by default because they take too long
+DEFAULT_SKIP_FILES = {f"query{num}.sql" for num in {1,11,74,4}}
+
+# The tool next to this script, so workers find it whatever their working directory is
+TOOL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tree_edit_distance_tool.py")
+
+
+def enqueue_batch(queue_path, directory1, directory2, configs, analyze=False, runs=None, skip_files=None,
+                  schedule=None, max_cost=None, max_time=None, database=None, explain_options=None, track_io_timing=False):
+    """
+    Coordinator: put one task per (query, target pair, run index) into the work queue.
+
+    Args:
+        queue_path (str): Path to the SQLite work queue shared with the workers.
+        directory1 (str): Path to the first directory containing query files.
+        directory2 (str): Path to the second directory containing query files.
+        configs (list of str): The database configuration files, one per target pair (DB1/DB2).
+        analyze (bool, optional): Whether to use explain analyze. Defaults to False.
+        runs (int, optional): Number of runs per query and target pair. Defaults to 3 with analyze, else 1.
+        skip_files (set of str, optional): Query files that are skipped. Defaults to DEFAULT_SKIP_FILES.
+        schedule (str, optional): "cost" or "history" to let the workers claim the slowest queries first.
+        max_cost (float, optional): Skip queries whose estimated total cost is larger than this value.
+        max_time (float, optional): Skip queries whose runtime in previous runs (ms) is larger than this value.
+        database (str, optional): Path to the SQLite result store used for the "history" schedule.
+        explain_options (list of str, optional): Additional EXPLAIN options (BUFFERS, WAL, SETTINGS, SUMMARY) passed to the tool.
+        track_io_timing (bool, optional): Whether the tool enables track_io_timing. Defaults to False.
+
+    Returns:
+        int: The number of tasks that were added to the queue.
+    """
+    runs = runs if runs is not None else (3 if analyze else 1)
+
+    # Find the common .sql files of both directories
+    sql_files1 = {file for file in os.listdir(directory1) if file.endswith('.sql')}
+    sql_files2 = {file for file in os.listdir(directory2) if file.endswith('.sql')}
+    common_files = sql_files1.intersection(sql_files2)
+    common_files -= DEFAULT_SKIP_FILES if skip_files is None else skip_files
+
+    # Order the queries (slowest first) and apply the cost or time thresholds
+    benchmark = directory1.split('/')[1]
+    ordered_files, skipped_files = plan_batch(directory1, directory2, common_files, schedule, database, benchmark,
+                                              max_cost, max_time, configs[0])
+    if skipped_files:
+        log(f"Skipping queries over the threshold: {sorted(skipped_files)}")
+
+    # Earlier queries in the schedule get a higher priority, so the workers claim them first.
+    # The paths are absolute, because workers on other hosts sharing the directory have their own working directory.
+    tasks = [{"query": file, "directory1": os.path.abspath(directory1), "directory2": os.path.abspath(directory2),
+              "config": os.path.abspath(config), "run_index": run, "analyze": int(analyze),
+              "explain_options": ",".join(explain_options or []), "track_io_timing": int(track_io_timing),
+              "benchmark": benchmark, "priority": len(ordered_files) - index}
+             for index, file in enumerate(ordered_files) for config in configs for run in range(runs)]
+
+    connection = open_queue(queue_path)
+    try:
+        return enqueue(connection, tasks)
+    finally:
+        connection.close()
+
+
+def execute_task(connection, task, worker, lease):
+    """
+    Run the tree edit distance tool for one task, renewing the lease while the comparison is running.
+    If the lease is lost (e.g. it expired and the task was claimed by another worker or marked as failed),
+    the tool is stopped.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        task (dict): The claimed task.
+        worker (str): The name of the worker.
+        lease (float): Seconds the task is leased to the worker.
+
+    Returns:
+        tuple: The parsed JSON output (None if the comparison failed) and the stderr output of the tool
+            (None if the lease was lost).
+    """
+    command = ["python3", TOOL, os.path.join(task["directory1"], task["query"]),
+               os.path.join(task["directory2"], task["query"]), "--config", task["config"]]
+    if task["analyze"]:
+        command.append("--analyze")
+    if task["explain_options"]:
+        command += ["--explain-options", task["explain_options"]]
+    if task["track_io_timing"]:
+        command.append("--track-io-timing")
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=lease / 3)
+            break
+        except subprocess.TimeoutExpired:
+            # Keep the lease while the query is still running
+            if not renew(connection, task["task_id"], worker, lease):
+                process.kill()
+                process.communicate()
+                return None, None
+
+    res = subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+    return parse_tool_output(res), stderr
+
+
+def run_worker(queue_path, worker=None, lease=300.0, poll=5.0, exit_when_empty=False, max_attempts=3):
+    """
+    Worker: claim tasks from the work queue, run the comparisons and write the results back.
+    Any number of workers can run at the same time, as separate processes or on hosts sharing the queue's directory.
+
+    Args:
+        queue_path (str): Path to the SQLite work queue.
+        worker (str, optional): The name of the worker. Defaults to <hostname>-<pid>.
+        lease (float, optional): Seconds a claimed task is leased to the worker before another worker may claim it. Defaults to 300.
+        poll (float, optional): Seconds to wait before polling again when the queue is empty. Defaults to 5.
+        exit_when_empty (bool, optional): Stop when no task is pending or running. Defaults to False.
+        max_attempts (int, optional): Number of attempts before a task is marked as failed. Defaults to 3.
+
+    Returns:
+        int: The number of tasks completed by this worker.
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    connection = open_queue(queue_path)
+    completed = 0
+    try:
+        while True:
+            task = claim(connection, worker, lease, max_attempts)
+            if task is None:
+                counts = status_counts(connection)
+                if exit_when_empty and counts["pending"] == 0 and counts["running"] == 0:
+                    break
+                time.sleep(poll)
+                continue
+
+            log(f"[{worker}] Executing query {task['query']} (run {task['run_index']}, {os.path.basename(task['config'])})")
+            output, stderr = execute_task(connection, task, worker, lease)
+            if stderr is None:
+                log(f"[{worker}] Lost the lease of query {task['query']}, the comparison was stopped")
+            elif output is None:
+                log(f"[{worker}] Error found in query {task['query']}: {stderr}")
+                fail(connection, task["task_id"], worker, stderr, max_attempts)
+            elif complete(connection, task["task_id"], worker, output):
+                completed += 1
+            else:
+                log(f"[{worker}] Lost the lease of query {task['query']}, the result was discarded")
+    finally:
+        connection.close()
+    return completed
+
+
+def collect_results(queue_path, database=None):
+    """
+    Average the runs of each finished (query, target pair) and emit them as JSON Lines on stdout.
+
+    Args:
+        queue_path (str): Path to the SQLite work queue.
+        database (str, optional): Path to the SQLite result store the results are also written to. Defaults to None.
+    """
+    # Group the results of the runs by query and target pair
+    grouped = {}
+    connection = open_queue(queue_path)
+    try:
+        for task, result in completed_results(connection):
+            key = (task["directory1"], task["directory2"], task["config"], task["analyze"], task["explain_options"],
+                   task["track_io_timing"], task["benchmark"] or task["directory1"].split('/')[1])
+            grouped.setdefault(key, {}).setdefault(task["query"], []).append(result)
+    finally:
+        connection.close()
+
+    for (directory1, directory2, config, analyze, explain_options, track_io_timing, benchmark), queries in grouped.items():
+        writer = ResultWriter(database, benchmark, directory1, directory2, analyze,
+                              explain_options=explain_options.split(',') if explain_options else None) if database else None
+        for query, outputs in queries.items():
+            row = {"query": query, "ted": outputs[-1]["TED"], "plan_hash_1": outputs[-1].get("plan_hash_1"),
+                   "plan_hash_2": outputs[-1].get("plan_hash_2"), "repetitions": len(outputs)}
+            timed = [output for output in outputs if "time_difference" in output]
+            if timed:
+                row["time_difference"] = sum(output["time_difference"] for output in timed) / len(timed)
+                row["execution_time_1"] = sum(output["execution_time_1"] for output in timed) / len(timed)
+                row["execution_time_2"] = sum(output["execution_time_2"] for output in timed) / len(timed)
+            row.update(average_counters(outputs))
+            emit_record({"config": config, "benchmark": benchmark, **row})
+            if writer:
+                writer.add(row)
+        if writer:
+            writer.close()
+
+
+if __name__ == "__main__":
+    import argparse
+    # Argument parsing for command-line execution
+    parser = argparse.ArgumentParser(description="Compare the queries of two directories with a coordinator and several workers sharing a work queue.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinator = subparsers.add_parser("coordinator", help="Put the comparisons of a batch into the work queue")
+    coordinator.add_argument("queue", help="Path to the SQLite work queue")
+    coordinator.add_argument("directory1", help="First directory containing SQL files")
+    coordinator.add_argument("directory2", help="Second directory containing SQL files")
+    coordinator.add_argument("--config", action="append", help="Database configuration file of a target pair (can be repeated, defaults to config.json)")
+    coordinator.add_argument("--analyze", action="store_true", help="Use EXPLAIN ANALYZE instead of EXPLAIN")
+    coordinator.add_argument("--runs", type=int, help="Number of runs per query (defaults to 3 with --analyze, else 1)")
+    coordinator.add_argument("--skip", help="Comma-separated query files to skip")
+    coordinator.add_argument("--schedule", choices=["cost", "history"], help="Let the workers claim the slowest queries first")
+    coordinator.add_argument("--max-cost", type=float, help="Skip queries with a larger estimated total cost")
+    coordinator.add_argument("--max-time", type=float, help="Skip queries with a larger runtime (ms) in previous runs")
+    coordinator.add_argument("--db", help="Result store used for --schedule history and --max-time")
+    coordinator.add_argument("--explain-options", help="Comma-separated additional EXPLAIN options, see tree_edit_distance_tool.py")
+    coordinator.add_argument("--track-io-timing", action="store_true", help="Enable track_io_timing in the tool (requires the privilege to change it)")
+
+    worker = subparsers.add_parser("worker", help="Claim and execute comparisons from the work queue")
+    worker.add_argument("queue", help="Path to the SQLite work queue")
+    worker.add_argument("--name", help="Name of the worker (defaults to <hostname>-<pid>)")
+    worker.add_argument("--lease", type=float, default=300.0, help="Seconds a claimed task is leased to the worker")
+    worker.add_argument("--poll", type=float, default=5.0, help="Seconds between polls of an empty queue")
+    worker.add_argument("--exit-when-empty", action="store_true", help="Stop when no task is pending or running")
+    worker.add_argument("--max-attempts", type=int, default=3, help="Number of attempts before a task is marked as failed")
+
+    status = subparsers.add_parser("status", help="Print the number of tasks in each status")
+    status.add_argument("queue", help="Path to the SQLite work queue")
+
+    collect = subparsers.add_parser("collect", help="Print the averaged results as JSON Lines")
+    collect.add_argument("queue", help="Path to the SQLite work queue")
+    collect.add_argument("--db", help="Also write the results to this result store")
+
+    args = parser.parse_args()
+    if args.command == "coordinator":
+        skip_files = {file for file in args.skip.split(',') if file} if args.skip is not None else None
+        explain_options = [option.strip().upper() for option in args.explain_options.split(',') if option.strip()] if args.explain_options else None
+        added = enqueue_batch(args.queue, args.directory1, args.directory2, args.config or ["config.json"], args.analyze,
+                              args.runs, skip_files, args.schedule, args.max_cost, args.max_time, args.db,
+                              explain_options, args.track_io_timing)
+        log(f"Added {added} tasks to {args.queue}")
+    elif args.command == "worker":
+        completed = run_worker(args.queue, args.name, args.lease, args.poll, args.exit_when_empty, args.max_attempts)
+        log(f"Completed {completed} tasks")
+    elif args.command == "status":
+        connection = open_queue(args.queue)
+        emit_record(status_counts(connection))
+        connection.close()
+    elif args.command == "collect":
+        collect_results(args.queue, args.db)
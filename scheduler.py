@@ -0,0 +1,174 @@
+import os
+import psycopg2
+from result_store import load_results
+from target_config import load_targets
+
+
+def explain_cost(connection, query):
+    """
+    Get the planner's estimated total cost of a query with a plain EXPLAIN, without executing it.
+    Statements of the file that are not queries (e.g. CREATE VIEW) are executed as they would be by the tool.
+
+    Args:
+        connection (psycopg2.connection): An open connection to the database.
+        query (str): The SQL text of the query file.
+
+    Returns:
+        float or None: The total cost of the (last) query in the file, or None if it could not be planned.
+    """
+    keywords = ('select', 'insert', 'update', 'delete', 'with')
+    cost = None
+    with connection.cursor() as cursor:
+        for q in query.split(";"):
+            if not q.strip():
+                continue
+            if q.strip().lower().startswith(keywords):
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {q}")
+                cost = cursor.fetchone()[0][0]["Plan"]["Total Cost"]
+            else:
+                cursor.execute(q)
+    # Never keep side effects of the cost estimation
+    connection.rollback()
+    return cost
+
+
+def estimate_costs(directory1, directory2, files, config_file="config.json"):
+    """
+    Estimate the cost of comparing each query with plain EXPLAIN on both databases.
+    A single connection per database is used for all the queries.
+
+    Args:
+        directory1 (str): Path to the first directory containing query files.
+        directory2 (str): Path to the second directory containing query files.
+        files (iterable of str): The query files to estimate.
+        config_file (str, optional): Path to the configuration file. Defaults to "config.json".
+
+    Returns:
+        dict: A dictionary mapping each query file to the sum of its total costs on both databases.
+            Queries that could not be planned are left out.
+    """
+    estimates = {}
+    targets = load_targets(config_file)
+    connections = [psycopg2.connect(dbname=target["DATABASE"], user=target["USER"], password=target["PASSWORD"],
+                                    host=target["HOST"], port=target["PORT"]) for target in targets]
+    try:
+        for file in files:
+            total = 0.0
+            for connection, directory in zip(connections, (directory1, directory2)):
+                with open(os.path.join(directory, file), 'r') as query_file:
+                    query = query_file.read().strip()
+                try:
+                    cost = explain_cost(connection, query)
+                except psycopg2.Error:
+                    connection.rollback()
+                    cost = None
+                if cost is None:
+                    total = None
+                    break
+                total += cost
+            if total is not None:
+                estimates[file] = total
+    finally:
+        for connection in connections:
+            connection.close()
+    return estimates
+
+
+def historical_runtimes(database, benchmark=None):
+    """
+    Get the average runtime of each query from previous runs in the result store.
+    The runtime of a comparison is the sum of the execution times on both databases.
+
+    Args:
+        database (str): Path to the SQLite result store.
+        benchmark (str, optional): Only use results of this benchmark.
+
+    Returns:
+        dict: A dictionary mapping each query file to its average runtime in ms.
+    """
+    data = load_results(database, columns=['query', 'execution_time_1', 'execution_time_2'], benchmark=benchmark)
+    totals = {}
+    for query, time1, time2 in zip(data['query'], data['execution_time_1'], data['execution_time_2']):
+        if time1 is None or time2 is None:
+            continue
+        total, count = totals.get(query, (0.0, 0))
+        totals[query] = (total + time1 + time2, count + 1)
+    return {query: total / count for query, (total, count) in totals.items()}
+
+
+def schedule(files, estimates):
+    """
+    Order the queries longest-first, so that parallel workers start with the slowest queries
+    and the short ones fill the gaps at the end (longest processing time first scheduling).
+    Queries without an estimate are scheduled first, since they may be the slowest.
+
+    Args:
+        files (iterable of str): The query files to schedule.
+        estimates (dict): A dictionary mapping query files to their estimated cost or runtime.
+
+    Returns:
+        list of str: The query files in the order they should be executed.
+    """
+    return sorted(files, key=lambda file: (file in estimates, -estimates.get(file, 0.0), file))
+
+
+def apply_thresholds(files, estimates, max_estimate=None):
+    """
+    Split the queries into the ones to run and the ones to skip because their estimate exceeds a threshold.
+
+    Args:
+        files (iterable of str): The query files.
+        estimates (dict): A dictionary mapping query files to their estimated cost or runtime.
+        max_estimate (float, optional): Skip queries whose estimate is larger than this value. Defaults to None (no threshold).
+
+    Returns:
+        tuple: A tuple containing the set of query files to run and the set of skipped query files.
+    """
+    files = set(files)
+    if max_estimate is None:
+        return files, set()
+    skipped = {file for file in files if estimates.get(file, 0.0) > max_estimate}
+    return files - skipped, skipped
+
+
+def plan_batch(directory1, directory2, files, method=None, database=None, benchmark=None, max_cost=None, max_time=None, config_file="config.json"):
+    """
+    Estimate, filter and order the queries of a batch.
+
+    Args:
+        directory1 (str): Path to the first directory containing query files.
+        directory2 (str): Path to the second directory containing query files.
+        files (iterable of str): The query files of the batch.
+        method (str, optional): "cost" to use plain EXPLAIN estimates, "history" to use the runtimes of previous runs
+            in the result store, or None to keep the files in name order. Defaults to None.
+        database (str, optional): Path to the SQLite result store, required for the "history" method.
+        benchmark (str, optional): The benchmark used to look up historical runtimes.
+        max_cost (float, optional): Skip queries whose estimated total cost is larger than this value.
+        max_time (float, optional): Skip queries whose historical runtime (ms) is larger than this value.
+        config_file (str, optional): Path to the configuration file. Defaults to "config.json".
+
+    Returns:
+        tuple: A tuple containing the ordered list of query files to run and the set of skipped query files.
+    """
+    files = set(files)
+
+    # Get the estimates that are needed for the ordering and the thresholds
+    costs = {}
+    runtimes = {}
+    if method == "cost" or max_cost is not None:
+        costs = estimate_costs(directory1, directory2, files, config_file)
+    if method == "history" or max_time is not None:
+        if database is None:
+            raise ValueError("Historical runtimes require a result store (--db)")
+        runtimes = historical_runtimes(database, benchmark)
+
+    # Skip the queries that exceed the thresholds
+    files, skipped_cost = apply_thresholds(files, costs, max_cost)
+    files, skipped_time = apply_thresholds(files, runtimes, max_time)
+    skipped = skipped_cost | skipped_time
+
+    if method == "cost":
+        return schedule(files, costs), skipped
+    if method == "history":
+        return schedule(files, runtimes), skipped
+    return sorted(files), skipped
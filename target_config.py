@@ -0,0 +1,66 @@
+import json
+
+
+def load_target_map(config_file="config.json"):
+    """
+    Load the connection settings of all databases from the configuration file. The targets are either the entries
+    of a "targets" object, e.g. {"targets": {"pg15": {...}, "pg16": {...}}}, or the top-level entries with
+    connection settings, such as DB1 and DB2 of the original format.
+
+    Args:
+        config_file (str, optional): Path to the configuration file. Defaults to "config.json".
+
+    Returns:
+        dict: A dictionary mapping the name of each target to its connection settings, in the order of the file.
+    """
+    with open(config_file, "r") as file:
+        config = json.load(file)
+    targets = config.get("targets", config)
+    return {name: settings for name, settings in targets.items() if isinstance(settings, dict) and "DATABASE" in settings}
+
+
+def resolve_target(targets, target):
+    """
+    Get the connection settings of a target by its name or number. Number n is DBn if the configuration has it,
+    otherwise the n-th target, so 1 and 2 keep meaning DB1 and DB2.
+
+    Args:
+        targets (dict): The targets of load_target_map.
+        target (str or int): The name or number of the target.
+
+    Returns:
+        dict: The connection settings.
+
+    Raises:
+        KeyError: If the configuration has no such target.
+    """
+    if isinstance(target, int):
+        if f"DB{target}" in targets:
+            return targets[f"DB{target}"]
+        if not 1 <= target <= len(targets):
+            raise KeyError(f"The configuration has no target {target}")
+        return list(targets.values())[target - 1]
+    if target not in targets:
+        raise KeyError(f"The configuration has no target {target!r}, only {list(targets)}")
+    return targets[target]
+
+
+def parse_target(value):
+    """
+    Parse a target given on the command line: a number (1 for DB1, 2 for DB2) or the name of a target.
+    """
+    return int(value) if value.isdigit() else value
+
+
+def load_targets(config_file="config.json"):
+    """
+    Load the connection settings of the two databases that are compared from the configuration file.
+
+    Args:
+        config_file (str, optional): Path to the configuration file. Defaults to "config.json".
+
+    Returns:
+        tuple: The connection settings (dict) of DB1 and DB2, or of the first two targets.
+    """
+    targets = load_target_map(config_file)
+    return resolve_target(targets, 1), resolve_target(targets, 2)
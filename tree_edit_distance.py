@@ -1,8 +1,13 @@
 import json
 import sys
+import hashlib
+import functools
 from apted import APTED, Config
 import re
 
+# Double quotes of attribute values that are not escaped, replaced by backticks in the labels
+UNESCAPED_QUOTE = re.compile(r'(?<!\\)"')
+
 # Define a class to represent a tree node
 class TreeNode:
     def __init__(self, label, children=None):
@@ -39,13 +44,29 @@ def json_to_tree(json_obj):
 
     # Handle the case where json_obj is a list; take the first element
     while isinstance(json_obj, list):
-        print("list")
         json_obj = json_obj[0]
 
     # Extract the execution plan from the EXPLAIN result
     if "Plan" in json_obj:
         json_obj = json_obj["Plan"]
 
+    label = normalize_label(build_label(json_obj))
+    
+    # Recursively convert child nodes to TreeNodes
+    children = [json_to_tree(child) for child in json_obj.get("Plans", [])]
+    return TreeNode(label, children)
+
+def build_label(json_obj):
+    """
+    Build the label of a plan node from the attributes that are relevant for its node type.
+    
+    Args:
+        json_obj (dict): The JSON object of a single plan node. Missing attributes are set to "None".
+        
+    Returns:
+        str: The label of the node as a JSON string, before normalization.
+    """
+
     # Get the type of the node and start constructing the label
     label_type = str(json_obj["Node Type"])
 
@@ -63,7 +84,8 @@ def json_to_tree(json_obj):
             json_obj[attr] = "None" # Default value if attribute is missing
         else:
             # Replace double quotes with backticks for JSON formatting
-            json_obj[attr] = re.sub(r'(?<!\\)"', r'`', str(json_obj[attr]))
+            value = str(json_obj[attr])
+            json_obj[attr] = UNESCAPED_QUOTE.sub('`', value) if '"' in value else value
 
     # Add attributes to the label based on the node type
     match label_type:
@@ -150,6 +172,21 @@ def json_to_tree(json_obj):
     
     # Complete the JSON string representation of the node
     label += "}"
+    return label
+
+# Plans of the same workload repeat most of their labels, so the normalized labels are cached. This also
+# interns them: equal labels of different trees are the same string object.
+@functools.lru_cache(maxsize=65536)
+def normalize_label(label):
+    """
+    Normalize the casts and quoted constants of a label.
+    
+    Args:
+        label (str): The label built by build_label.
+        
+    Returns:
+        str: The normalized label.
+    """
 
     # Clean up specific patterns in the string for proper formatting 
     # and standarization, otherwise TED appears to be bigger than the actual value.
@@ -169,10 +206,144 @@ def json_to_tree(json_obj):
 
     label = re.sub(r'\'([0-9]+\.[0-9]+)\'', r'\1', label)
     label = re.sub(r'\'([0-9]+)\'', r'\1', label)
+    return label
+
+def tree_hash(node):
+    """
+    Compute a hash of a tree that depends on the labels and the structure of the tree.
+    Two plans with the same hash are identical, so their tree edit distance is 0.
     
-    # Recursively convert child nodes to TreeNodes
-    children = [json_to_tree(child) for child in json_obj.get("Plans", [])]
-    return TreeNode(label, children)
+    Args:
+        node (TreeNode): The root node of the tree.
+        
+    Returns:
+        str: The hexadecimal SHA-1 digest of the tree.
+    """
+    return subtree_hashes(node)[id(node)]
+
+def subtree_hashes(node):
+    """
+    Compute the hash of every subtree of a tree in a single bottom-up pass.
+    Two subtrees with the same hash are identical, in both their labels and their structure.
+    
+    Args:
+        node (TreeNode): The root node of the tree.
+        
+    Returns:
+        dict: A dictionary mapping the id of each node to the hexadecimal SHA-1 digest of its subtree.
+    """
+    hashes = {}
+    # Visit the nodes in post-order, so that the children are hashed before their parent
+    stack = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if not visited:
+            stack.append((current, True))
+            stack.extend((child, False) for child in current.children)
+            continue
+        hashes[id(current)] = node_hash(current, hashes)
+    return hashes
+
+def node_hash(node, hashes):
+    """
+    Compute the hash of a subtree from the label of its root and the hashes of its children.
+    
+    Args:
+        node (TreeNode): The root node of the subtree.
+        hashes (dict): A dictionary mapping the id of each child of the node to the hash of its subtree.
+        
+    Returns:
+        str: The hexadecimal SHA-1 digest of the subtree.
+    """
+    digest = hashlib.sha1(node.label.encode("utf-8"))
+    # Combine the hashes of the children in order, so that the structure is part of the hash
+    for child in node.children:
+        digest.update(b"(" + hashes[id(child)].encode("ascii") + b")")
+    return digest.hexdigest()
+
+# Node types whose children can be executed in any order, so their order is not part of the plan
+UNORDERED_NODE_TYPES = {"Append", "BitmapAnd", "BitmapOr", "Merge Append"}
+
+def canonicalize(node):
+    """
+    Sort the children of order-insensitive nodes (Append, BitmapAnd, BitmapOr, Merge Append) by their subtree hash,
+    so that equivalent plans that only differ in the planner's output order become identical trees
+    with the same hash. The tree is changed in place.
+    
+    Args:
+        node (TreeNode): The root node of the tree.
+        
+    Returns:
+        TreeNode: The root node of the canonical tree.
+    """
+    hashes = {}
+    # Visit the nodes in post-order, so that the children are canonical before their parent is sorted
+    stack = [(node, False)]
+    while stack:
+        current, visited = stack.pop()
+        if not visited:
+            stack.append((current, True))
+            stack.extend((child, False) for child in current.children)
+            continue
+        if len(current.children) > 1 and node_type(current) in UNORDERED_NODE_TYPES:
+            current.children.sort(key=lambda child: hashes[id(child)])
+        hashes[id(current)] = node_hash(current, hashes)
+    return node
+
+def node_type(node):
+    """
+    Get the node type of a node from its label.
+    
+    Args:
+        node (TreeNode): The node.
+        
+    Returns:
+        str: The node type.
+    """
+    # Labels start with {"Node Type": "<type>", see build_label
+    return node.label[len('{"Node Type": "'):].split('"', 1)[0]
+
+def preorder(node):
+    """
+    List the nodes of a tree in pre-order.
+    
+    Args:
+        node (TreeNode): The root node of the tree.
+        
+    Returns:
+        list of TreeNode: The nodes in pre-order.
+    """
+    nodes = []
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        nodes.append(current)
+        stack.extend(reversed(current.children))
+    return nodes
+
+def shape_hash(node):
+    """
+    Compute a hash of the shape of a tree, ignoring the labels of its nodes.
+    Trees with the same shape have the same layout when they are plotted.
+    
+    Args:
+        node (TreeNode): The root node of the tree.
+        
+    Returns:
+        str: The hexadecimal SHA-1 digest of the shape of the tree.
+    """
+    digest = hashlib.sha1()
+    # Serialize the shape as nested parentheses in pre-order, e.g. "(()())"
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if current is None:
+            digest.update(b")")
+            continue
+        digest.update(b"(")
+        stack.append(None)
+        stack.extend(reversed(current.children))
+    return digest.hexdigest()
 
 class TreeConfig(Config):
     def rename(self, node1, node2):
@@ -200,13 +371,63 @@ class TreeConfig(Config):
         """
         return node.children
 
-def main(res1, res2):
+def edit_mapping(tree1, tree2):
+    """
+    Compute the mapping of the tree edit distance between two trees.
+    
+    Args:
+        tree1 (TreeNode): The first tree.
+        tree2 (TreeNode): The second tree.
+        
+    Returns:
+        list of tuple: Pairs (node1, node2) of mapped nodes. Deleted nodes of the first tree are paired with None,
+            inserted nodes of the second tree are paired with None as the first element.
+    """
+    return APTED(tree1, tree2, TreeConfig()).compute_edit_mapping()
+
+def edit_distance(tree1, tree2):
+    """
+    Compute the tree edit distance between two trees. Identical trees (with the same hash) have
+    a distance of 0, which is returned without running APTED.
+    
+    Args:
+        tree1 (TreeNode): The first tree.
+        tree2 (TreeNode): The second tree.
+        
+    Returns:
+        int: The tree edit distance.
+    """
+    if tree_hash(tree1) == tree_hash(tree2):
+        return 0
+    return APTED(tree1, tree2, TreeConfig()).compute_edit_distance()
+
+def edit_distance_and_mapping(tree1, tree2):
+    """
+    Compute the tree edit distance between two trees and its mapping with a single APTED instance,
+    so that the mapping reuses the distances computed for the tree edit distance.
+    
+    Args:
+        tree1 (TreeNode): The first tree.
+        tree2 (TreeNode): The second tree.
+        
+    Returns:
+        tuple: The tree edit distance and the mapping (see edit_mapping).
+    """
+    # Identical trees map every node to the node at the same position
+    if tree_hash(tree1) == tree_hash(tree2):
+        return 0, list(zip(preorder(tree1), preorder(tree2)))
+    apted = APTED(tree1, tree2, TreeConfig())
+    ted = apted.compute_edit_distance()
+    return ted, apted.compute_edit_mapping()
+
+def main(res1, res2, canonical=False):
     """
     Compute the tree edit distance between two execution plan JSON objects.
     
     Args:
         res1 (dict or list): The first JSON object.
         res2 (dict or list): The second JSON object.
+        canonical (bool, optional): Whether to sort the children of order-insensitive nodes (see canonicalize). Defaults to False.
         
     Returns:
         tuple: A tuple containing the tree edit distance and tree nodes for the first and second JSON objects.
@@ -215,15 +436,15 @@ def main(res1, res2):
     # Convert JSON objects to TreeNode representations
     tree1 = json_to_tree(res1)
     tree2 = json_to_tree(res2)
-    
-    # Initialize APTED with the custom config for tree comparison
-    apted = APTED(tree1, tree2, TreeConfig())
+    if canonical:
+        canonicalize(tree1)
+        canonicalize(tree2)
 
-    # Compute the tree edit distance
-    ted = apted.compute_edit_distance().result
+    # Compute the tree edit distance (0 without APTED if the trees are identical)
+    ted = edit_distance(tree1, tree2)
     
     # Uncomment the following line if you want to print the mapping
-    # mapping = apted.compute_edit_mapping()
+    # mapping = edit_mapping(tree1, tree2)
     # print(f"Mapping: {mapping}")
 
     return ted, tree1, tree2
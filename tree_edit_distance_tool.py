@@ -2,13 +2,39 @@ import psycopg2
 import os
 import sys
 import json
+import time
 import networkx as nx
 import matplotlib.pyplot as plt
-from tree_edit_distance import main as compare
+from tree_edit_distance import json_to_tree, canonicalize, edit_distance, edit_distance_and_mapping, tree_hash
 from tree_visualisation import plot_trees
+from plan_diff_html import write_plan_diff_html
+from profiling import StageProfiler, label_stats, profile_call
+from operator_diff import operator_diff, pair_plan_nodes
+from target_config import load_target_map, resolve_target, parse_target
+from plan_archive import PlanArchive
 
+# Options that can be added to EXPLAIN with --explain-options (WAL requires ANALYZE)
+EXPLAIN_OPTIONS = ["BUFFERS", "WAL", "SETTINGS", "SUMMARY"]
 
-def preprocess_query(query, analyze=False, debug=False):
+
+def explain_command(analyze=False, explain_options=None):
+    """
+    Builds the EXPLAIN command with its options and the JSON format.
+
+    Parameters:
+    - analyze (bool): If True, use EXPLAIN ANALYZE; otherwise use EXPLAIN.
+    - explain_options (list of str): Additional EXPLAIN options out of EXPLAIN_OPTIONS, e.g. ["BUFFERS", "SETTINGS"].
+
+    Returns:
+    - str: The EXPLAIN command, e.g. EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON).
+    """
+    options = ["ANALYZE"] if analyze else []
+    # WAL is only allowed together with ANALYZE
+    options += [option for option in explain_options or [] if analyze or option != "WAL"]
+    return f"EXPLAIN ({', '.join(options + ['FORMAT JSON'])})"
+
+
+def preprocess_query(query, analyze=False, debug=False, explain_options=None):
     """
     Prepares the SQL query for execution by adding the EXPLAIN (ANALYZE) command if needed.
 
@@ -16,6 +42,7 @@ def preprocess_query(query, analyze=False, debug=False):
     - query (str): The SQL query to be preprocessed.
     - analyze (bool): If True, use EXPLAIN ANALYZE; otherwise use EXPLAIN.
     - debug (bool): If True, print debug information.
+    - explain_options (list of str): Additional EXPLAIN options out of EXPLAIN_OPTIONS, e.g. ["BUFFERS", "SETTINGS"].
 
     Returns:
     - str: The preprocessed SQL query.
@@ -23,14 +50,14 @@ def preprocess_query(query, analyze=False, debug=False):
 
     keywords = ['select', 'insert', 'update', 'delete', 'with']
     if any(query.strip().lower().startswith(stmt) for stmt in keywords):
-        explain_type = "EXPLAIN (ANALYZE, FORMAT JSON)" if analyze else "EXPLAIN (FORMAT JSON)" 
-        query = f" {explain_type} {query}"
+        query = f" {explain_command(analyze, explain_options)} {query}"
     if debug:
-        print(f"Preprocessed query: [{query}]")
+        print(f"Preprocessed query: [{query}]", file=sys.stderr)
     return query
 
 
-def run_query(database, user, password, host, port, query, analyze=False, debug=False, store=False, output_file=None):
+def run_query(database, user, password, host, port, query, analyze=False, debug=False, store=False, output_file=None,
+              profiler=None, side=1, explain_options=None, track_io_timing=False):
     """
     Connects to the PostgreSQL database, executes the given query, and handles EXPLAIN output.
 
@@ -45,55 +72,100 @@ def run_query(database, user, password, host, port, query, analyze=False, debug=
     - debug (bool): If True, print debug information.
     - store (bool): If True, store the EXPLAIN output in a file.
     - output_file (str): Path to the output file for storing EXPLAIN results.
+    - profiler (StageProfiler): If given, records the time spent connecting, executing and fetching.
+    - side (int): The number of the database (1 or 2) used in the names of the profiled stages.
+    - explain_options (list of str): Additional EXPLAIN options, see preprocess_query.
+    - track_io_timing (bool): If True, enable track_io_timing for the session so that BUFFERS includes I/O times.
+      Enabling it requires the privilege to change the setting, otherwise a warning is printed and the query runs without it.
 
     Returns:
     - list: The results of the EXPLAIN query.
     """
+    profiler = profiler or StageProfiler(enabled=False)
     try:
         # Connect to the PostgreSQL database
-        connection = psycopg2.connect(
-            dbname=database,
-            user=user,
-            password=password,
-            host=host,
-            port=port
-        )
+        with profiler.stage(f"connect_{side}"):
+            connection = psycopg2.connect(
+                dbname=database,
+                user=user,
+                password=password,
+                host=host,
+                port=port
+            )
 
         cursor = connection.cursor()
 
+        if track_io_timing:
+            try:
+                cursor.execute("SET track_io_timing = on")
+            except psycopg2.Error as error:
+                connection.rollback()
+                print(f"Warning: track_io_timing could not be enabled: {error}".strip(), file=sys.stderr)
+
         # Split the query if it contains multiple statements
         for q in query.split(";"):
             if not q:
                 continue
-            q = preprocess_query(q, analyze, debug)
+            q = preprocess_query(q, analyze, debug, explain_options)
             if debug:
-                print(f"Executing query:<{q}>")
-            cursor.execute(q)
+                print(f"Executing query:<{q}>", file=sys.stderr)
+            with profiler.stage(f"execute_{side}"):
+                cursor.execute(q)
             if q.strip().lower().startswith(('explain')):
-                result = cursor.fetchall()
+                with profiler.stage(f"fetch_{side}"):
+                    result = cursor.fetchall()
                 if debug:
-                    print("EXPLAIN output:")
+                    print("EXPLAIN output:", file=sys.stderr)
                     for row in result:
-                        print(row[0])
+                        print(row[0], file=sys.stderr)
                 if store and output_file:
                     with open(output_file, 'w') as outfile:
                         json.dump(result, outfile, indent=4)
-                        print(f"EXPLAIN output written to {output_file}")
+                        print(f"EXPLAIN output written to {output_file}", file=sys.stderr)
                     if debug:
-                        print(f"EXPLAIN output written to {output_file}")
+                        print(f"EXPLAIN output written to {output_file}", file=sys.stderr)
                 return result
             else:
                 # Commit changes for non-EXPLAIN queries
                 connection.commit()
                 if debug:
-                    print("Query executed successfully")
+                    print("Query executed successfully", file=sys.stderr)
     except Exception as error:
-        print(f"Error: {error}")
+        print(f"Error: {error}", file=sys.stderr)
     finally:
         # Close database cursor and connection
         cursor.close()
         connection.close()
 
+def explain_counters(result, side):
+    """
+    Extracts the planning time, buffer, I/O timing and WAL counters and the settings of an EXPLAIN result,
+    as far as they are included. The counters of the root node include all other nodes of the plan.
+
+    Parameters:
+    - result (dict): The EXPLAIN result of one query.
+    - side (int): The number of the database (1 or 2) appended to the names of the counters.
+
+    Returns:
+    - dict: The counters, e.g. shared_read_blocks_1 or io_read_time_1.
+    """
+    plan = result.get("Plan", {})
+    counters = {}
+    if "Planning Time" in result:
+        counters["planning_time"] = result["Planning Time"]
+    for key in ["Shared Hit Blocks", "Shared Read Blocks", "Shared Dirtied Blocks", "Shared Written Blocks",
+                "Temp Read Blocks", "Temp Written Blocks", "WAL Records", "WAL Bytes"]:
+        if key in plan:
+            counters[key.lower().replace(" ", "_")] = plan[key]
+    # PostgreSQL 17 splits the I/O times into shared/local and temp, older versions only report "I/O Read Time"
+    for direction in ["Read", "Write"]:
+        times = [value for key, value in plan.items() if key.endswith(f"I/O {direction} Time")]
+        if times:
+            counters[f"io_{direction.lower()}_time"] = sum(times)
+    if "Settings" in result:
+        counters["settings"] = result["Settings"]
+    return {f"{name}_{side}": value for name, value in counters.items()}
+
 def extract_filename(file_path):
     """
     Extracts the filename from a given file path.
@@ -106,7 +178,27 @@ def extract_filename(file_path):
     """
     return os.path.basename(file_path)
 
-def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze=False):
+def stored_plan_files(query_file1, query_file2):
+    """
+    Determines the files the EXPLAIN results of two queries are stored in with --store.
+    
+    Parameters:
+    - query_file1 (str): Path to the file containing the first SQL query.
+    - query_file2 (str): Path to the file containing the second SQL query.
+
+    Returns:
+    - tuple: The names of the files for the first and the second EXPLAIN result.
+    """
+    output_file1 = extract_filename(query_file1).replace('.sql', '_explain.json')
+    output_file2 = extract_filename(query_file2).replace('.sql', '_explain.json')
+    if output_file1 == output_file2:
+        output_file2 = output_file1.replace('.json', '_2.json')
+    return output_file1, output_file2
+
+def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze=False, config_file="config.json", headless=False, html=False,
+         collapse=False, collapse_depth=1, collapse_min_size=2, profile=False, profile_dump=None,
+         top_operators=10, explain_options=None, track_io_timing=False, canonical=False, targets=(1, 2),
+         archive=None, run=None):
     """
     Main function to compare execution plans of two SQL queries.
     
@@ -117,30 +209,41 @@ def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze
     - debug (bool): If True, enable debug logging.
     - store (bool): If True, store results and plots in files.
     - analyze (bool): If True, use EXPLAIN ANALYZE instead of EXPLAIN.
+    - config_file (str): Path to the database configuration file. Defaults to config.json.
+    - headless (bool): If True, save the plot without showing it in a window.
+    - html (bool): If True, write an interactive HTML comparison of the execution plans.
+    - collapse (bool): If True, collapse the subtrees that are identical in both plans in the plot.
+    - collapse_depth (int): Nodes above this depth are never collapsed. Defaults to 1.
+    - collapse_min_size (int): Subtrees with fewer nodes are not collapsed. Defaults to 2.
+    - profile (bool): If True, add the wall and CPU time of each stage, the node counts and the label statistics to the output.
+    - profile_dump (str): If given, dump the cProfile statistics and the tracemalloc snapshot of the TED stage
+      to <profile_dump>_ted.prof and <profile_dump>_ted.tracemalloc.
+    - top_operators (int): With analyze, the number of operators reported in the operator-level time difference. Defaults to 10.
+    - explain_options (list of str): Additional EXPLAIN options (BUFFERS, WAL, SETTINGS, SUMMARY). Their counters are added to the output.
+    - track_io_timing (bool): If True, enable track_io_timing where permitted, so that BUFFERS includes I/O times.
+    - canonical (bool): If True, sort the children of Append, BitmapAnd, BitmapOr and Merge Append nodes by their subtree hash,
+      so that plans that only differ in the order of these children have the same hash and a TED of 0.
+    - targets (tuple): The names or numbers of the two targets of the configuration that are compared. Defaults to (1, 2), i.e. DB1 and DB2.
+    - archive (str): If given, add both EXPLAIN results to the plan archive in this directory (see plan_archive.py).
+    - run (str): The run the archived plans belong to. Defaults to the current date.
 
     Returns:
     - str: JSON string with the comparison results.
     """
     if debug:
-        print(f"Running with options: Plot={plot}, Debug={debug}, Store={store}, Analyze={analyze}")
-
-    # Load database configuration from config.json if available
-    if os.path.exists("config.json"):
-        with open("config.json", "r") as file:
-            config = json.load(file)
-            DATABASE = config["DB1"]["DATABASE"]
-            USER = config["DB1"]["USER"]
-            PASSWORD = config["DB1"]["PASSWORD"]
-            HOST = config["DB1"]["HOST"]
-            PORT = config["DB1"]["PORT"]
-            DATABASE2 = config["DB2"]["DATABASE"]
-            USER2 = config["DB2"]["USER"]
-            PASSWORD2 = config["DB2"]["PASSWORD"]
-            HOST2 = config["DB2"]["HOST"]
-            PORT2 = config["DB2"]["PORT"]
-    else:
-        print("config.json file not found. Please provide database configuration.")
-    
+        print(f"Running with options: Plot={plot}, Debug={debug}, Store={store}, Analyze={analyze}", file=sys.stderr)
+
+    # Load the connection settings of the two compared targets from config.json if available
+    if not os.path.exists(config_file):
+        print(f"{config_file} file not found. Please provide database configuration.", file=sys.stderr)
+        return None
+    try:
+        target_map = load_target_map(config_file)
+        settings1, settings2 = (resolve_target(target_map, target) for target in targets)
+    except KeyError as error:
+        print(f"Error: {error.args[0]}", file=sys.stderr)
+        return None
+
     # Read SQL queries from provided files
     with open(query_file1, 'r') as file:
         query1 = file.read().strip()
@@ -149,18 +252,49 @@ def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze
         query2 = file.read().strip()
 
     # Determine output filenames if storing results
-    output_file1 = extract_filename(query_file1).replace('.sql', '_explain.json') if store else None
-    output_file2 = extract_filename(query_file2).replace('.sql', '_explain.json') if store else None
-    if output_file1 == output_file2 and output_file1 is not None:
-        output_file2 = output_file1.replace('.json', '_2.json')
+    output_file1, output_file2 = stored_plan_files(query_file1, query_file2) if store else (None, None)
+
+    profiler = StageProfiler(enabled=profile or profile_dump is not None)
 
     # Execute queries and obtain EXPLAIN results
-    result1 = run_query(DATABASE, USER, PASSWORD, HOST, PORT, query1, analyze, debug, store, output_file1)
-    result2 = run_query(DATABASE2, USER2, PASSWORD2, HOST2, PORT2, query2, analyze, debug, store, output_file2)
+    result1 = run_query(settings1["DATABASE"], settings1["USER"], settings1["PASSWORD"], settings1["HOST"], settings1["PORT"],
+                        query1, analyze, debug, store, output_file1, profiler, 1, explain_options, track_io_timing)
+    result2 = run_query(settings2["DATABASE"], settings2["USER"], settings2["PASSWORD"], settings2["HOST"], settings2["PORT"],
+                        query2, analyze, debug, store, output_file2, profiler, 2, explain_options, track_io_timing)
     
     if result1 and result2:
-        # Calculate the Tree Edit Distance (comparison_results) between the two execution plans
-        comparison_result, tree1_json, tree2_json = compare(result1[0][0][0], result2[0][0][0])
+        #if an archive is given both plans are added to it, each distinct plan is stored only once
+        if archive:
+            run = run or time.strftime("%Y-%m-%d")
+            with PlanArchive(archive) as plan_archive:
+                for target, query_file, result in ((targets[0], query_file1, result1), (targets[1], query_file2, result2)):
+                    name = f"DB{target}" if isinstance(target, int) else target
+                    plan_archive.add(run, name, os.path.splitext(extract_filename(query_file))[0], result[0][0][0])
+
+        # Convert the execution plans to trees
+        with profiler.stage("json_to_tree"):
+            tree1_json = json_to_tree(result1[0][0][0])
+            tree2_json = json_to_tree(result2[0][0][0])
+
+        # Pair the operators with the EXPLAIN nodes before the children are reordered
+        plan_nodes = (pair_plan_nodes(tree1_json, result1[0][0][0]), pair_plan_nodes(tree2_json, result2[0][0][0])) if analyze else None
+        if canonical:
+            with profiler.stage("canonicalize"):
+                canonicalize(tree1_json)
+                canonicalize(tree2_json)
+
+        # Calculate the Tree Edit Distance (comparison_results) between the two execution plans,
+        # with --analyze also its mapping to pair the operators of both plans
+        mapping = None
+        ted_function = edit_distance_and_mapping if analyze else edit_distance
+        with profiler.stage("ted"):
+            if profile_dump:
+                comparison_result = profile_call(ted_function, tree1_json, tree2_json, cprofile_file=f"{profile_dump}_ted.prof",
+                                                 tracemalloc_file=f"{profile_dump}_ted.tracemalloc")
+            else:
+                comparison_result = ted_function(tree1_json, tree2_json)
+        if analyze:
+            comparison_result, mapping = comparison_result
 
         # Extract filenames
         filename1 = extract_filename(query_file1).replace('.sql', '')
@@ -168,15 +302,31 @@ def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze
 
         #plot the execution plans side by side if the --plot flag is given
         if plot:
-            print("Plotting the execution plans")
-            plot_trees(tree1_json, tree2_json,f"execution_plans_{filename1}_{filename2}.png")
+            print("Plotting the execution plans", file=sys.stderr)
+            with profiler.stage("plot"):
+                plot_trees(tree1_json, tree2_json,f"execution_plans_{filename1}_{filename2}.png", show=not headless,
+                           collapse=collapse, keep_depth=collapse_depth, min_size=collapse_min_size)
+
+        #write the interactive HTML comparison if the --html flag is given
+        if html:
+            html_file = f"execution_plans_{filename1}_{filename2}.html"
+            with profiler.stage("html"):
+                write_plan_diff_html(tree1_json, tree2_json, html_file, mapping=mapping, title=f"{filename1} vs {filename2} (TED {comparison_result})")
+            print(f"HTML comparison written to {html_file}", file=sys.stderr)
 
         # Prepare the JSON output with comparison results
-        json_output = {
-            "query1": query_file1,
-            "query2": query_file2,
-            "TED": comparison_result
-        }
+        with profiler.stage("hash"):
+            json_output = {
+                "query1": query_file1,
+                "query2": query_file2,
+                "TED": comparison_result,
+                "plan_hash_1": tree_hash(tree1_json),
+                "plan_hash_2": tree_hash(tree2_json)
+            }
+
+        #include the counters of the additional EXPLAIN options, e.g. the buffers to tell cold from warm caches
+        json_output.update(explain_counters(result1[0][0][0], 1))
+        json_output.update(explain_counters(result2[0][0][0], 2))
 
         #if the --analyze flag is given include the execution times in the results
         if analyze:
@@ -188,20 +338,37 @@ def main(query_file1, query_file2, plot=False, debug=False, store=False, analyze
             json_output["execution_time_2"] = actual_time2
             json_output["time_difference"] = time_difference
 
+            # Rank the operators of both plans, paired by the mapping, by the change of their own execution time
+            with profiler.stage("operator_diff"):
+                json_output["operators"] = operator_diff(result1[0][0][0], result2[0][0][0], tree1_json, tree2_json,
+                                                         mapping, top_operators, plan_nodes)
+
+        #if the --profile flag is given include the stage timings, node counts and label statistics
+        if profiler.enabled:
+            profiler.count("labels", label_stats(tree1_json, tree2_json))
+            profiler.count("nodes_1", label_stats(tree1_json)["nodes"])
+            profiler.count("nodes_2", label_stats(tree2_json)["nodes"])
+            # Planning and execution time measured by the server, if the EXPLAIN output contains them
+            for side, result in ((1, result1), (2, result2)):
+                for key in ("Planning Time", "Execution Time"):
+                    if key in result[0][0][0]:
+                        profiler.count(f"server_{key.lower().replace(' ', '_')}_ms_{side}", result[0][0][0][key])
+            json_output["profile"] = profiler.report()
+
         #if the --store flag is given the comparison result is stored in a file
         if store:
             output_file = f"comparison_result_{filename1}_{filename2}.json"
             with open(output_file, 'w') as file:
                 json.dump(json_output, file)
-                print(f"Results stored in {output_file}")
+                print(f"Results stored in {output_file}", file=sys.stderr)
             if debug:
-                print(f"Results stored in {output_file}")
+                print(f"Results stored in {output_file}", file=sys.stderr)
 
         print(json.dumps(json_output))
         return json.dumps(json_output)
 
     else:
-        print("Error: Query execution failed")
+        print("Error: Query execution failed", file=sys.stderr)
         return None
     
 
@@ -215,6 +382,33 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
     parser.add_argument("--store", action="store_true", help="Store the results in a file")
     parser.add_argument("--analyze", action="store_true", help="Use EXPLAIN ANALYZE instead of EXPLAIN")
+    parser.add_argument("--html", action="store_true", help="Write an interactive HTML comparison of the execution plans")
+    parser.add_argument("--headless", action="store_true", help="Save the plot without showing it in a window")
+    parser.add_argument("--collapse", action="store_true", help="Collapse the subtrees that are identical in both plans in the plot")
+    parser.add_argument("--collapse-depth", type=int, default=1, help="Never collapse nodes above this depth (defaults to 1)")
+    parser.add_argument("--collapse-min-size", type=int, default=2, help="Only collapse subtrees with at least this many nodes (defaults to 2)")
+    parser.add_argument("--profile", action="store_true", help="Add the time of each stage, node counts and label statistics to the output")
+    parser.add_argument("--profile-dump", help="Dump cProfile and tracemalloc results of the TED stage to files with this prefix")
+    parser.add_argument("--top-operators", type=int, default=10, help="Number of operators reported with --analyze (defaults to 10)")
+    parser.add_argument("--explain-options", help=f"Comma-separated additional EXPLAIN options out of {','.join(EXPLAIN_OPTIONS)}")
+    parser.add_argument("--track-io-timing", action="store_true", help="Enable track_io_timing for the session (requires the privilege to change it)")
+    parser.add_argument("--canonical", action="store_true", help="Sort the children of order-insensitive nodes (Append, BitmapAnd, BitmapOr, Merge Append)")
+    parser.add_argument("--config", default="config.json", help="Database configuration file (defaults to config.json)")
+    parser.add_argument("--archive", help="Add the EXPLAIN results to the plan archive in this directory (see plan_archive.py)")
+    parser.add_argument("--run", help="Run the archived plans belong to (defaults to the current date)")
+    parser.add_argument("--targets", help="Comma-separated targets to compare, 1 for DB1, 2 for DB2 or names of targets of the configuration (defaults to 1,2)")
 
     args = parser.parse_args()
-    main(args.query_file1, args.query_file2, args.plot, args.debug, args.store, args.analyze)
\ No newline at end of file
+    explain_options = [option.strip().upper() for option in args.explain_options.split(',') if option.strip()] if args.explain_options else None
+    unknown = [option for option in explain_options or [] if option not in EXPLAIN_OPTIONS]
+    if unknown:
+        parser.error(f"Unknown EXPLAIN options: {unknown}")
+    targets = tuple(parse_target(name.strip()) for name in args.targets.split(',')) if args.targets else (1, 2)
+    if len(targets) != 2:
+        parser.error("--targets needs exactly two targets")
+    # Exit with an error code so that batch runners can detect failed comparisons
+    if main(args.query_file1, args.query_file2, args.plot, args.debug, args.store, args.analyze, args.config, args.headless, args.html,
+            args.collapse, args.collapse_depth, args.collapse_min_size, args.profile, args.profile_dump,
+            args.top_operators, explain_options, args.track_io_timing, args.canonical, targets,
+            args.archive, args.run) is None:
+        sys.exit(1)
\ No newline at end of file
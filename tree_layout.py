@@ -0,0 +1,227 @@
+import os
+import json
+from tree_edit_distance import shape_hash, preorder
+
+# Directory of the on-disk layout cache, can be changed with the PLAN_LAYOUT_CACHE environment variable
+DEFAULT_CACHE_DIRECTORY = os.environ.get("PLAN_LAYOUT_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "plan_layouts"))
+
+
+class LayoutNode:
+    """
+    Wrapper of a TreeNode holding the state of the tidy tree layout algorithm.
+    """
+    def __init__(self, node, parent=None, depth=0, number=1):
+        """
+        Wrap a tree recursively.
+
+        Args:
+            node (TreeNode): The node to wrap.
+            parent (LayoutNode, optional): The wrapper of the parent node.
+            depth (int, optional): The depth of the node. Defaults to 0.
+            number (int, optional): The position of the node among its siblings, starting at 1. Defaults to 1.
+        """
+        self.node = node
+        self.x = -1.0
+        self.y = depth
+        self.parent = parent
+        self.number = number
+        self.children = [LayoutNode(child, self, depth + 1, i + 1) for i, child in enumerate(node.children)]
+        self.thread = None
+        self.mod = 0.0
+        self.ancestor = self
+        self.change = 0.0
+        self.shift = 0.0
+
+    def left(self):
+        return self.thread or (self.children[0] if self.children else None)
+
+    def right(self):
+        return self.thread or (self.children[-1] if self.children else None)
+
+    def left_brother(self):
+        return self.parent.children[self.number - 2] if self.parent and self.number > 1 else None
+
+    def leftmost_sibling(self):
+        return self.parent.children[0] if self.parent and self.number > 1 else None
+
+
+def first_walk(v, distance):
+    """
+    Compute the preliminary x coordinates bottom-up, placing each parent centered above its children
+    and moving subtrees apart until they are at least distance from each other.
+    """
+    if not v.children:
+        brother = v.left_brother()
+        v.x = brother.x + distance if brother else 0.0
+        return
+    default_ancestor = v.children[0]
+    for w in v.children:
+        first_walk(w, distance)
+        default_ancestor = apportion(w, default_ancestor, distance)
+    execute_shifts(v)
+    midpoint = (v.children[0].x + v.children[-1].x) / 2
+    brother = v.left_brother()
+    if brother:
+        v.x = brother.x + distance
+        v.mod = v.x - midpoint
+    else:
+        v.x = midpoint
+
+
+def apportion(v, default_ancestor, distance):
+    """
+    Move the subtree of v to the right of the subtrees of its left siblings, following the contours
+    of the subtrees with threads so that each level is only compared once.
+    """
+    w = v.left_brother()
+    if w is None:
+        return default_ancestor
+    # Inner and outer contours of the left (l) and right (r) subtrees and their accumulated modifiers
+    vir = vor = v
+    vil = w
+    vol = v.leftmost_sibling()
+    sir = sor = v.mod
+    sil = vil.mod
+    sol = vol.mod
+    while vil.right() and vir.left():
+        vil = vil.right()
+        vir = vir.left()
+        vol = vol.left()
+        vor = vor.right()
+        vor.ancestor = v
+        shift = (vil.x + sil) - (vir.x + sir) + distance
+        if shift > 0:
+            move_subtree(greatest_distinct_ancestor(vil, v, default_ancestor), v, shift)
+            sir += shift
+            sor += shift
+        sil += vil.mod
+        sir += vir.mod
+        sol += vol.mod
+        sor += vor.mod
+    if vil.right() and not vor.right():
+        vor.thread = vil.right()
+        vor.mod += sil - sor
+    else:
+        if vir.left() and not vol.left():
+            vol.thread = vir.left()
+            vol.mod += sir - sol
+        default_ancestor = v
+    return default_ancestor
+
+
+def move_subtree(wl, wr, shift):
+    """
+    Shift the subtree wr to the right and spread the shift over the siblings between wl and wr.
+    """
+    subtrees = wr.number - wl.number
+    wr.change -= shift / subtrees
+    wr.shift += shift
+    wl.change += shift / subtrees
+    wr.x += shift
+    wr.mod += shift
+
+
+def execute_shifts(v):
+    """
+    Apply the shifts of the siblings that were collected by move_subtree in a single pass.
+    """
+    shift = change = 0.0
+    for w in reversed(v.children):
+        w.x += shift
+        w.mod += shift
+        change += w.change
+        shift += w.shift + change
+
+
+def greatest_distinct_ancestor(vil, v, default_ancestor):
+    """
+    Find the ancestor of vil that is a sibling of v, or return the default ancestor.
+    """
+    return vil.ancestor if vil.ancestor.parent is v.parent else default_ancestor
+
+
+def tidy_layout(root, x_spacing=1.0, y_spacing=1.0):
+    """
+    Compute a tidy tree layout (Reingold-Tilford, in the linear-time version of Buchheim et al.).
+    Parents are centered above their children, subtrees never overlap and identical subtrees are drawn identically.
+
+    Args:
+        root (TreeNode): The root of the tree.
+        x_spacing (float, optional): The minimum horizontal distance between two nodes. Defaults to 1.0.
+        y_spacing (float, optional): The vertical distance between two levels. Defaults to 1.0.
+
+    Returns:
+        dict: A dictionary mapping each TreeNode to its (x, y) position, with the root at the top.
+    """
+    tree = LayoutNode(root)
+    first_walk(tree, 1.0)
+
+    # Second walk: add the accumulated modifiers of the ancestors to get the final x coordinates
+    positions = {}
+    stack = [(tree, 0.0)]
+    while stack:
+        v, modifier = stack.pop()
+        positions[v.node] = ((v.x + modifier) * x_spacing, -v.y * y_spacing)
+        for w in v.children:
+            stack.append((w, modifier + v.mod))
+
+    # Shift the layout so that the leftmost node is at x = 0
+    min_x = min(x for x, _ in positions.values())
+    return {node: (x - min_x, y) for node, (x, y) in positions.items()}
+
+
+class LayoutCache:
+    """
+    Cache of tree layouts in memory and on disk, keyed by the shape hash of the tree,
+    so that plans with the same shape skip the layout entirely.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIRECTORY):
+        """
+        Args:
+            directory (str, optional): Directory of the on-disk cache, or None to only cache in memory.
+        """
+        self.directory = directory
+        self.memory = {}
+
+    def layout(self, root):
+        """
+        Get the tidy layout of a tree from the cache, computing and storing it if it is missing.
+
+        Args:
+            root (TreeNode): The root of the tree.
+
+        Returns:
+            dict: A dictionary mapping each TreeNode to its (x, y) position.
+        """
+        key = shape_hash(root)
+        nodes = preorder(root)
+        coordinates = self.memory.get(key)
+
+        path = os.path.join(self.directory, f"{key}.json") if self.directory else None
+        if coordinates is None and path and os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    coordinates = json.load(file)
+            except (OSError, json.JSONDecodeError):
+                coordinates = None
+
+        if coordinates is None or len(coordinates) != len(nodes):
+            positions = tidy_layout(root)
+            coordinates = [positions[node] for node in nodes]
+            if path:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    # Write to a temporary file first, so that concurrent readers never see a partial layout
+                    with open(f"{path}.{os.getpid()}.tmp", 'w') as file:
+                        json.dump(coordinates, file)
+                    os.replace(f"{path}.{os.getpid()}.tmp", path)
+                except OSError:
+                    pass
+        self.memory[key] = coordinates
+
+        # The coordinates are stored in pre-order, which is the same for all trees with the same shape
+        return {node: tuple(position) for node, position in zip(nodes, coordinates)}
+
+
+# Layout cache shared by all plots of a process
+layout_cache = LayoutCache()
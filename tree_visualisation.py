@@ -1,7 +1,9 @@
-import matplotlib.pyplot as plt
 import networkx as nx
 from networkx.drawing.nx_agraph import graphviz_layout
-from tree_edit_distance import TreeNode, json_to_tree
+from tree_edit_distance import TreeNode, json_to_tree, subtree_hashes
+from render_pool import create_figure, finish_figure
+from tree_layout import layout_cache
+from plan_reader import read_plan_tree
 import json
 
 def extract_properties(node):
@@ -51,6 +53,64 @@ def add_nodes(graph, node):
         graph.add_edge(node, child)
         add_nodes(graph, child)
 
+class CollapsedNode(TreeNode):
+    """
+    Placeholder for a subtree that is identical in both plans, drawn as a single "N unchanged nodes" node.
+    """
+    def __init__(self, size):
+        """
+        Args:
+            size (int): The number of nodes of the collapsed subtree.
+        """
+        super().__init__(json.dumps({"Node Type": f"{size} unchanged nodes"}))
+        self.size = size
+
+def collapse_unchanged(tree1, tree2, keep_depth=1, min_size=2):
+    """
+    Summarize two trees for plotting by collapsing every maximal subtree that appears identically in both trees
+    into a single placeholder node. The summarized trees only keep the differing nodes, their ancestors and
+    one placeholder per unchanged subtree, so their size is bounded by the size of the difference.
+
+    Args:
+        tree1 (TreeNode): The first tree.
+        tree2 (TreeNode): The second tree.
+        keep_depth (int, optional): Nodes above this depth are never collapsed, so the top of the plans is
+            always shown. Defaults to 1 (only the roots are kept).
+        min_size (int, optional): Subtrees with fewer nodes are not collapsed. Defaults to 2.
+
+    Returns:
+        tuple: The two summarized trees. The original trees are not modified.
+    """
+    hashes1 = subtree_hashes(tree1)
+    hashes2 = subtree_hashes(tree2)
+    common = set(hashes1.values()) & set(hashes2.values())
+
+    def summarize(node, hashes, depth):
+        if depth >= keep_depth and hashes[id(node)] in common:
+            size = count_nodes(node)
+            if size >= min_size:
+                return CollapsedNode(size)
+        return TreeNode(node.label, [summarize(child, hashes, depth + 1) for child in node.children])
+
+    return summarize(tree1, hashes1, 0), summarize(tree2, hashes2, 0)
+
+def count_nodes(node):
+    """
+    Count the nodes of a tree.
+
+    Args:
+        node (TreeNode): The root node of the tree.
+
+    Returns:
+        int: The number of nodes.
+    """
+    count = 0
+    stack = [node]
+    while stack:
+        count += 1
+        stack.extend(stack.pop().children)
+    return count
+
 def get_node_size_and_font(label):
     """
     Adjust node size and font size based on the length of the label.
@@ -74,7 +134,40 @@ def get_node_size_and_font(label):
 
     return node_size, font_size
 
-def plot_trees(tree1, tree2 , filename):
+def draw_tree(graph, pos, other_labels, ax):
+    """
+    Draw a tree, coloring the nodes that also appear in the other tree green, the rest red
+    and the placeholders of collapsed unchanged subtrees gray.
+    All nodes of one color are drawn with a single call, so that each color is one matplotlib collection.
+
+    Args:
+        graph (networkx.DiGraph): The graph of the tree to draw.
+        pos (dict): The positions of the nodes.
+        other_labels (set of str): The labels of the nodes of the other tree.
+        ax (matplotlib.axes.Axes): The axes to draw on.
+    """
+    labels = nx.get_node_attributes(graph, 'label')
+
+    # Group the nodes by color and the labels by font size
+    nodes_by_color = {'green': [], 'red': [], 'lightgray': []}
+    labels_by_font = {}
+    for node, label in labels.items():
+        # Check if the node is present in the other tree with a hash set lookup
+        color = 'green' if label in other_labels else 'red'
+        if isinstance(node, CollapsedNode):
+            color = 'lightgray'
+        node_size, font_size = get_node_size_and_font(node.label)
+        nodes_by_color[color].append((node, node_size))
+        labels_by_font.setdefault(font_size, {})[node] = label
+
+    for color, nodes in nodes_by_color.items():
+        if nodes:
+            nx.draw_networkx_nodes(graph, pos, nodelist=[node for node, _ in nodes], node_size=[size for _, size in nodes], node_shape='o', node_color=color, alpha=0.8, ax=ax)
+    for font_size, font_labels in labels_by_font.items():
+        nx.draw_networkx_labels(graph, pos, labels=font_labels, font_size=font_size, font_color='black', font_weight='bold', verticalalignment='center', horizontalalignment='center', ax=ax)
+    nx.draw_networkx_edges(graph, pos, ax=ax)
+
+def plot_trees(tree1, tree2 , filename, show=True, layout="tidy", collapse=False, keep_depth=1, min_size=2):
     """
     Plot and compare two trees using NetworkX and Matplotlib.
 
@@ -82,16 +175,29 @@ def plot_trees(tree1, tree2 , filename):
         tree1 (TreeNode or dict): The first tree to plot.
         tree2 (TreeNode or dict): The second tree to plot.
         filename (str): The filename to save the plot image.
+        show (bool, optional): Whether to show the plot in a window. If False the plot is rendered headless
+            and the figure is released after saving. Defaults to True.
+        layout (str, optional): "tidy" for the built-in tidy tree layout (cached by tree shape) or "dot" for the
+            Graphviz layout, which requires pygraphviz. Defaults to "tidy".
+        collapse (bool, optional): Whether to collapse the subtrees that are identical in both trees into
+            placeholder nodes (see collapse_unchanged), so that large plans only show their differences. Defaults to False.
+        keep_depth (int, optional): Nodes above this depth are never collapsed. Defaults to 1.
+        min_size (int, optional): Subtrees with fewer nodes are not collapsed. Defaults to 2.
     """
 
     # Convert JSON objects to TreeNode if necessary
     if isinstance(tree1, dict):
-        tree1 = json_to_tree(tree1, "tree1")
+        tree1 = json_to_tree(tree1)
     if isinstance(tree2, dict):
-        tree2 = json_to_tree(tree2, "tree2")
+        tree2 = json_to_tree(tree2)
+
+    # Replace the unchanged subtrees by placeholders
+    if collapse:
+        tree1, tree2 = collapse_unchanged(tree1, tree2, keep_depth, min_size)
     
     # Create subplots for the two trees
-    _, axs = plt.subplots(1, 2, figsize=(18, 12))
+    figure = create_figure((18, 12), show)
+    axs = figure.subplots(1, 2)
 
     # Initialize graphs for the two trees
     G1 = nx.DiGraph()
@@ -101,43 +207,37 @@ def plot_trees(tree1, tree2 , filename):
     add_nodes(G1, tree1)
     add_nodes(G2, tree2)
 
-    # Compute positions for nodes using Graphviz
-    pos1 = graphviz_layout(G1, prog='dot')
-    pos2 = graphviz_layout(G2, prog='dot')
-
-    # Get labels for nodes
-    labels1 = nx.get_node_attributes(G1, 'label')
-    labels2 = nx.get_node_attributes(G2, 'label')
-
-    # Plot first tree with node comparison
-    for node1, label1 in labels1.items():
-        color = 'red'
-        # Check if the node is present in the second tree
-        for _,label2 in labels2.items():
-            if label1 == label2:
-                color = 'green'
-                break
-        node_size, font_size = get_node_size_and_font(node1.label)
-        nx.draw_networkx_nodes(G1, pos1, nodelist=[node1], node_size=node_size, node_shape='o', node_color=color, alpha=0.8, ax=axs[0])
-        nx.draw_networkx_labels(G1, pos1, labels={node1: label1}, font_size=font_size, font_color='black', font_weight='bold', verticalalignment='center', horizontalalignment='center', ax=axs[0])
-    nx.draw_networkx_edges(G1, pos1, ax=axs[0])
-    
-    # Plot second tree with node comparison
-    for node2, label2 in labels2.items():
-        color = 'red'
-        # Check if the node is present in the first tree
-        for _,label1 in labels1.items():
-            if label1 == label2:
-                color = 'green'
-                break
-        node_size, font_size = get_node_size_and_font(node2.label)
-        nx.draw_networkx_nodes(G2, pos2, nodelist=[node2], node_size=node_size, node_shape='o', node_color=color, alpha=0.8, ax=axs[1])
-        nx.draw_networkx_labels(G2, pos2, labels={node2: label2}, font_size=font_size, font_color='black', font_weight='bold', verticalalignment='center', horizontalalignment='center', ax=axs[1])
-    nx.draw_networkx_edges(G2, pos2, ax=axs[1])
-
-    # Adjust layout
-    plt.tight_layout()
-    # Save plot
-    plt.savefig(filename)
-    
-    plt.show()
\ No newline at end of file
+    # Compute positions for nodes using the tidy tree layout or Graphviz
+    if layout == "dot":
+        pos1 = graphviz_layout(G1, prog='dot')
+        pos2 = graphviz_layout(G2, prog='dot')
+    else:
+        pos1 = layout_cache.layout(tree1)
+        pos2 = layout_cache.layout(tree2)
+
+    # Get the set of labels of each tree for the node comparison
+    labels1 = set(nx.get_node_attributes(G1, 'label').values())
+    labels2 = set(nx.get_node_attributes(G2, 'label').values())
+
+    # Plot both trees with node comparison
+    draw_tree(G1, pos1, labels2, axs[0])
+    draw_tree(G2, pos2, labels1, axs[1])
+
+    # Adjust layout, save and show the plot
+    finish_figure(figure, filename, show)
+
+def plot_stored_plans(explain_file1, explain_file2, filename, collapse=False):
+    """
+    Plot and compare two execution plans stored by tree_edit_distance_tool.py --store without showing them.
+    This is the render job used by the batch scripts in the background render pool.
+
+    Args:
+        explain_file1 (str): The file containing the first EXPLAIN result.
+        explain_file2 (str): The file containing the second EXPLAIN result.
+        filename (str): The filename to save the plot image.
+        collapse (bool, optional): Whether to collapse the subtrees that are identical in both plans. Defaults to False.
+    """
+    # Stream the stored plans, so that large EXPLAIN results do not have to be loaded completely
+    tree1, _ = read_plan_tree(explain_file1)
+    tree2, _ = read_plan_tree(explain_file2)
+    plot_trees(tree1, tree2, filename, show=False, collapse=collapse)
\ No newline at end of file
@@ -0,0 +1,214 @@
+import sqlite3
+import json
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    task_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    query TEXT NOT NULL,
+    directory1 TEXT NOT NULL,
+    directory2 TEXT NOT NULL,
+    config TEXT NOT NULL,
+    run_index INTEGER NOT NULL,
+    analyze INTEGER NOT NULL DEFAULT 0,
+    explain_options TEXT NOT NULL DEFAULT '',
+    track_io_timing INTEGER NOT NULL DEFAULT 0,
+    benchmark TEXT NOT NULL DEFAULT '',
+    priority REAL NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    lease_expires REAL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    updated_at REAL,
+    UNIQUE (query, directory1, directory2, config, run_index, analyze, explain_options, track_io_timing)
+);
+
+CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks(status, priority);
+"""
+
+# Status of a task: waiting to be claimed, leased by a worker, finished or failed too many times
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+
+def open_queue(path, timeout=60.0):
+    """
+    Open (and create if necessary) the durable work queue.
+    Several processes may open the same queue file; writes are serialized by SQLite's file lock.
+
+    Args:
+        path (str): Path to the SQLite queue file.
+        timeout (float, optional): Seconds to wait for the lock of another process. Defaults to 60.
+
+    Returns:
+        sqlite3.Connection: The connection to the work queue.
+    """
+    # isolation_level=None lets the functions below control the transactions explicitly
+    connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.executescript(SCHEMA)
+    # Queues created by older versions get the new columns
+    existing = {row[1] for row in connection.execute("PRAGMA table_info(tasks)")}
+    for column, column_type in (("explain_options", "TEXT NOT NULL DEFAULT ''"), ("track_io_timing", "INTEGER NOT NULL DEFAULT 0"),
+                                ("benchmark", "TEXT NOT NULL DEFAULT ''")):
+        if column not in existing:
+            connection.execute(f"ALTER TABLE tasks ADD COLUMN {column} {column_type}")
+    return connection
+
+
+def enqueue(connection, tasks):
+    """
+    Add tasks to the queue in a single transaction. Tasks that are already in the queue are left unchanged,
+    so the coordinator can be restarted without duplicating work.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        tasks (list of dict): The tasks with the keys query, directory1, directory2, config, run_index,
+            analyze, explain_options (comma-separated), track_io_timing, benchmark and priority (tasks with a higher priority are claimed first).
+
+    Returns:
+        int: The number of tasks that were added.
+    """
+    before = connection.total_changes
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.executemany(
+            "INSERT OR IGNORE INTO tasks (query, directory1, directory2, config, run_index, analyze, explain_options, track_io_timing, "
+            "benchmark, priority, updated_at) VALUES (:query, :directory1, :directory2, :config, :run_index, :analyze, :explain_options, "
+            ":track_io_timing, :benchmark, :priority, :updated_at)",
+            [{"analyze": 0, "explain_options": "", "track_io_timing": 0, "benchmark": "", "priority": 0, **task, "updated_at": time.time()}
+             for task in tasks])
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return connection.total_changes - before
+
+
+def claim(connection, worker, lease=300.0, max_attempts=3):
+    """
+    Claim the pending task with the highest priority. Tasks whose lease has expired
+    (e.g. because their worker crashed) are claimed again, unless they were already claimed max_attempts times:
+    a query that crashes every worker running it is marked as failed instead of being retried forever.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        worker (str): The name of the worker claiming the task.
+        lease (float, optional): Seconds the task is leased to the worker. Defaults to 300.
+        max_attempts (int, optional): Number of attempts before a task with an expired lease is marked as failed. Defaults to 3.
+
+    Returns:
+        dict or None: The claimed task, or None if there is no task to claim.
+    """
+    now = time.time()
+    # BEGIN IMMEDIATE takes the write lock, so two workers can never claim the same task
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        connection.execute(
+            "UPDATE tasks SET status = ?, error = 'The lease expired after ' || attempts || ' attempts', lease_expires = NULL, "
+            "updated_at = ? WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+            (FAILED, now, RUNNING, now, max_attempts))
+        row = connection.execute(
+            "SELECT * FROM tasks WHERE status = ? OR (status = ? AND lease_expires < ?) "
+            "ORDER BY priority DESC, task_id LIMIT 1", (PENDING, RUNNING, now)).fetchone()
+        if row is None:
+            connection.execute("COMMIT")
+            return None
+        connection.execute(
+            "UPDATE tasks SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? WHERE task_id = ?",
+            (RUNNING, worker, now + lease, now, row["task_id"]))
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    task = dict(row)
+    task["attempts"] += 1
+    return task
+
+
+def renew(connection, task_id, worker, lease=300.0):
+    """
+    Extend the lease of a task that is still being executed.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        task_id (int): The id of the task.
+        worker (str): The name of the worker holding the lease.
+        lease (float, optional): Seconds the lease is extended by. Defaults to 300.
+
+    Returns:
+        bool: False if the task is no longer leased to this worker.
+    """
+    cursor = connection.execute(
+        "UPDATE tasks SET lease_expires = ?, updated_at = ? WHERE task_id = ? AND worker = ? AND status = ?",
+        (time.time() + lease, time.time(), task_id, worker, RUNNING))
+    return cursor.rowcount == 1
+
+
+def complete(connection, task_id, worker, result):
+    """
+    Write the result of a task back to the queue.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        task_id (int): The id of the task.
+        worker (str): The name of the worker holding the lease.
+        result (dict): The JSON output of the comparison.
+
+    Returns:
+        bool: False if the lease was lost and another worker owns the task now.
+    """
+    cursor = connection.execute(
+        "UPDATE tasks SET status = ?, result = ?, error = NULL, lease_expires = NULL, updated_at = ? "
+        "WHERE task_id = ? AND worker = ? AND status = ?",
+        (DONE, json.dumps(result), time.time(), task_id, worker, RUNNING))
+    return cursor.rowcount == 1
+
+
+def fail(connection, task_id, worker, error, max_attempts=3):
+    """
+    Record a failed attempt of a task. The task is retried until it failed max_attempts times.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+        task_id (int): The id of the task.
+        worker (str): The name of the worker holding the lease.
+        error (str): The error message.
+        max_attempts (int, optional): Number of attempts before the task is marked as failed. Defaults to 3.
+    """
+    connection.execute(
+        "UPDATE tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, lease_expires = NULL, updated_at = ? "
+        "WHERE task_id = ? AND worker = ? AND status = ?",
+        (max_attempts, FAILED, PENDING, error, time.time(), task_id, worker, RUNNING))
+
+
+def status_counts(connection):
+    """
+    Count the tasks in each status.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+
+    Returns:
+        dict: A dictionary mapping each status to its number of tasks.
+    """
+    rows = connection.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall()
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    counts.update({row[0]: row[1] for row in rows})
+    return counts
+
+
+def completed_results(connection):
+    """
+    Iterate over the finished tasks and their results.
+
+    Args:
+        connection (sqlite3.Connection): The connection to the work queue.
+
+    Yields:
+        tuple: The task (dict) and its parsed result (dict).
+    """
+    for row in connection.execute("SELECT * FROM tasks WHERE status = ? ORDER BY task_id", (DONE,)):
+        task = dict(row)
+        yield task, json.loads(task.pop("result"))
@@ -0,0 +1,264 @@
+import os
+import html
+import numpy as np
+from result_store import open_store, load_results
+from render_pool import create_figure, finish_figure
+
+# Columns of the result store read by the report
+REPORT_COLUMNS = ['run_id', 'benchmark', 'query', 'ted', 'execution_time_1', 'execution_time_2', 'time_difference']
+
+
+def load_report_data(database, benchmark=None, by='benchmark'):
+    """
+    Load the results of the result store into NumPy arrays and assign every result to a group.
+
+    Args:
+        database (str): Path to the SQLite result store.
+        benchmark (str or list of str, optional): Only load results of these benchmarks.
+        by (str, optional): 'benchmark' to group the results by benchmark, or 'run' to group them by batch run,
+            so that several configurations or repetitions of the same benchmark are reported separately.
+
+    Returns:
+        dict: The arrays 'group' (group index of each result), 'query', 'ted', 'delta' (execution time of the
+            second plan minus the first, NaN without EXPLAIN ANALYZE) and the list 'groups' of group names.
+    """
+    columns = load_results(database, columns=REPORT_COLUMNS, benchmark=benchmark)
+
+    # None becomes NaN in float arrays, so missing values need no special casing below
+    ted = np.array(columns['ted'], dtype=np.float64)
+    time1 = np.array(columns['execution_time_1'], dtype=np.float64)
+    time2 = np.array(columns['execution_time_2'], dtype=np.float64)
+    difference = np.array(columns['time_difference'], dtype=np.float64)
+    # Prefer the signed difference, older results only stored the absolute time difference
+    delta = np.where(np.isnan(time1) | np.isnan(time2), difference, time2 - time1)
+
+    if by == 'run':
+        connection = open_store(database)
+        try:
+            runs = {row[0]: f"{row[1]} run {row[0]} ({row[2]} vs {row[3]})"
+                    for row in connection.execute("SELECT run_id, benchmark, directory1, directory2 FROM runs")}
+        finally:
+            connection.close()
+        keys = np.array([runs.get(run_id, f"run {run_id}") for run_id in columns['run_id']], dtype=object)
+    else:
+        keys = np.array(columns['benchmark'], dtype=object)
+
+    groups, group = np.unique(keys.astype(str), return_inverse=True) if len(keys) else (np.array([]), np.array([], dtype=np.int64))
+    # Results without a TED (failed comparisons) are not part of the report
+    valid = ~np.isnan(ted)
+    return {"group": group[valid], "query": np.array(columns['query'], dtype=object)[valid], "ted": ted[valid].astype(np.int64),
+            "delta": delta[valid], "groups": [str(name) for name in groups]}
+
+
+def compute_aggregates(data, top_k=10, max_ted=None):
+    """
+    Compute all aggregates of the report with vectorized NumPy operations over all groups at once:
+    the TED histogram, the time difference per TED value (count, mean, median and 10th/90th percentiles)
+    and the top-k regressions of each group.
+
+    Args:
+        data (dict): The report data from load_report_data.
+        top_k (int, optional): Number of regressions reported per group. Defaults to 10.
+        max_ted (int, optional): TED values above this are counted in the last bin. Defaults to the largest TED.
+
+    Returns:
+        dict: The aggregates, with arrays of shape (number of groups, number of TED bins) and one list of
+            regressions per group.
+    """
+    group, ted, delta = data["group"], data["ted"], data["delta"]
+    n_groups = len(data["groups"])
+    max_ted = int(ted.max()) if max_ted is None and len(ted) else (max_ted or 0)
+    n_bins = max_ted + 1
+
+    # Integer TEDs are their own bins, so one bincount over (group, bin) gives the histograms of all groups
+    bins = np.minimum(ted, max_ted)
+    cell = group * n_bins + bins
+    histogram = np.bincount(cell, minlength=n_groups * n_bins).reshape(n_groups, n_bins)
+
+    # Time difference per (group, bin), only over the results that have an execution time
+    timed = ~np.isnan(delta)
+    timed_cell = cell[timed]
+    timed_delta = delta[timed]
+    count = np.bincount(timed_cell, minlength=n_groups * n_bins)
+    total = np.bincount(timed_cell, weights=timed_delta, minlength=n_groups * n_bins)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+
+    # Percentiles: sort by cell and then by value, so every cell is a contiguous sorted run
+    order = np.lexsort((timed_delta, timed_cell))
+    sorted_delta = timed_delta[order]
+    starts = np.concatenate(([0], np.cumsum(count)[:-1]))
+    percentiles = {}
+    for name, q in (("p10", 0.1), ("median", 0.5), ("p90", 0.9)):
+        # Linear interpolation between the two closest ranks of each non-empty cell
+        position = starts + q * np.maximum(count - 1, 0)
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        values = np.full(n_groups * n_bins, np.nan)
+        nonempty = count > 0
+        if len(sorted_delta):
+            low, high = sorted_delta[lower[nonempty]], sorted_delta[upper[nonempty]]
+            values[nonempty] = low + (high - low) * (position[nonempty] - lower[nonempty])
+        percentiles[name] = values.reshape(n_groups, n_bins)
+
+    # Top-k regressions: sort by group and then by decreasing time difference, keep the first k of each group
+    timed_group = group[timed]
+    order = np.lexsort((-timed_delta, timed_group))
+    ranked_group = timed_group[order]
+    group_starts = np.searchsorted(ranked_group, np.arange(n_groups))
+    rank = np.arange(len(order)) - group_starts[ranked_group]
+    keep = order[(rank < top_k) & (timed_delta[order] > 0)]
+    timed_index = np.flatnonzero(timed)[keep]
+    regressions = [[] for _ in range(n_groups)]
+    for index in timed_index:
+        regressions[group[index]].append({"query": data["query"][index], "ted": int(ted[index]), "delta": float(delta[index])})
+
+    return {"histogram": histogram, "count": count.reshape(n_groups, n_bins), "mean": mean.reshape(n_groups, n_bins),
+            **percentiles, "regressions": regressions, "max_ted": max_ted}
+
+
+def plot_ted_histogram(data, aggregates, filename):
+    """
+    Plot the TED distribution of every group as a step histogram.
+
+    Args:
+        data (dict): The report data from load_report_data.
+        aggregates (dict): The aggregates from compute_aggregates.
+        filename (str): The filename to save the plot image.
+    """
+    figure = create_figure((12, 6))
+    ax = figure.subplots()
+    edges = np.arange(aggregates["max_ted"] + 2) - 0.5
+    for name, histogram in zip(data["groups"], aggregates["histogram"]):
+        ax.stairs(histogram, edges, label=f"{name} ({histogram.sum()})")
+    ax.set_xlabel("Tree Edit Distance")
+    ax.set_ylabel("Number of query pairs")
+    ax.set_title("TED distribution")
+    ax.legend()
+    finish_figure(figure, filename)
+
+
+def plot_time_versus_ted(data, aggregates, filename):
+    """
+    Plot the median time difference per TED value of every group, with the 10th to 90th percentile band.
+
+    Args:
+        data (dict): The report data from load_report_data.
+        aggregates (dict): The aggregates from compute_aggregates.
+        filename (str): The filename to save the plot image.
+    """
+    figure = create_figure((12, 6))
+    ax = figure.subplots()
+    teds = np.arange(aggregates["max_ted"] + 1)
+    for index, name in enumerate(data["groups"]):
+        present = aggregates["count"][index] > 0
+        if not present.any():
+            continue
+        line, = ax.plot(teds[present], aggregates["median"][index][present], marker='o', markersize=3, label=name)
+        ax.fill_between(teds[present], aggregates["p10"][index][present], aggregates["p90"][index][present],
+                        color=line.get_color(), alpha=0.2)
+    ax.axhline(0, color='black', linewidth=0.5)
+    ax.set_xlabel("Tree Edit Distance")
+    ax.set_ylabel("Execution time difference (ms, plan 2 - plan 1)")
+    ax.set_title("Time difference versus TED (median, 10th-90th percentile)")
+    ax.legend()
+    finish_figure(figure, filename)
+
+
+def write_report(database, output_directory="report", benchmark=None, by='benchmark', top_k=10, max_ted=None):
+    """
+    Generate a static report of the stored batch results: an index.html with the summary and the top-k regressions
+    of every group and the PNG plots it links to. The results are read once and all aggregates are computed
+    in a single vectorized pass, so the report stays fast for hundreds of thousands of query pairs.
+
+    Args:
+        database (str): Path to the SQLite result store.
+        output_directory (str, optional): The directory the report is written to. Defaults to "report".
+        benchmark (str or list of str, optional): Only report results of these benchmarks.
+        by (str, optional): 'benchmark' or 'run', see load_report_data. Defaults to 'benchmark'.
+        top_k (int, optional): Number of regressions reported per group. Defaults to 10.
+        max_ted (int, optional): TED values above this are counted in the last bin. Defaults to the largest TED.
+
+    Returns:
+        str: The path of the index.html file.
+    """
+    data = load_report_data(database, benchmark, by)
+    aggregates = compute_aggregates(data, top_k, max_ted)
+
+    os.makedirs(output_directory, exist_ok=True)
+    plot_ted_histogram(data, aggregates, os.path.join(output_directory, "ted_histogram.png"))
+    plot_time_versus_ted(data, aggregates, os.path.join(output_directory, "time_vs_ted.png"))
+
+    # Summary table, one row per group
+    ted_values = np.arange(aggregates["max_ted"] + 1)
+    summary_rows = []
+    for index, name in enumerate(data["groups"]):
+        histogram = aggregates["histogram"][index]
+        pairs = int(histogram.sum())
+        identical = int(histogram[0]) if len(histogram) else 0
+        mean_ted = float((histogram * ted_values).sum() / pairs) if pairs else float('nan')
+        timed = int(aggregates["count"][index].sum())
+        summary_rows.append(f"<tr><td>{html.escape(name)}</td><td>{pairs}</td><td>{identical}</td>"
+                            f"<td>{mean_ted:.2f}</td><td>{timed}</td><td>{len(aggregates['regressions'][index])}</td></tr>")
+
+    # Top-k regressions of each group
+    sections = []
+    for name, regressions in zip(data["groups"], aggregates["regressions"]):
+        rows = "".join(f"<tr><td>{html.escape(str(row['query']))}</td><td>{row['ted']}</td><td>{row['delta']:.3f}</td></tr>"
+                       for row in regressions)
+        sections.append(f"<h3>{html.escape(name)}</h3>" + (f"<table><tr><th>Query</th><th>TED</th><th>Time difference (ms)</th></tr>{rows}</table>"
+                                                            if rows else "<p>No regressions.</p>"))
+
+    index_file = os.path.join(output_directory, "index.html")
+    with open(index_file, 'w', encoding='utf-8') as file:
+        file.write(REPORT_TEMPLATE.format(pairs=len(data["ted"]), groups=len(data["groups"]), top_k=top_k,
+                                          summary="".join(summary_rows), regressions="".join(sections)))
+    return index_file
+
+
+REPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Workload report</title>
+<style>
+  body {{ font-family: sans-serif; margin: 24px; }}
+  table {{ border-collapse: collapse; margin-bottom: 16px; }}
+  th, td {{ border: 1px solid #ccc; padding: 4px 10px; text-align: right; }}
+  th:first-child, td:first-child {{ text-align: left; }}
+  img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+<h1>Workload report</h1>
+<p>{pairs} query pairs in {groups} groups.</p>
+<h2>Summary</h2>
+<table>
+<tr><th>Group</th><th>Query pairs</th><th>Identical plans (TED 0)</th><th>Mean TED</th><th>Timed pairs</th><th>Regressions shown</th></tr>
+{summary}
+</table>
+<h2>TED distribution</h2>
+<img src="ted_histogram.png" alt="TED distribution">
+<h2>Time difference versus TED</h2>
+<img src="time_vs_ted.png" alt="Time difference versus TED">
+<h2>Top {top_k} regressions</h2>
+<p>Query pairs whose second plan was slowest compared to the first.</p>
+{regressions}
+</body>
+</html>
+"""
+
+
+if __name__ == "__main__":
+    import argparse
+    # Argument parsing for command-line execution
+    parser = argparse.ArgumentParser(description="Generate an HTML/PNG report of the results stored by the batch scripts.")
+    parser.add_argument("database", help="Path to the SQLite result store (written with --db)")
+    parser.add_argument("--output", default="report", help="Directory the report is written to (defaults to report)")
+    parser.add_argument("--benchmark", action="append", help="Only report this benchmark (can be repeated)")
+    parser.add_argument("--by", choices=["benchmark", "run"], default="benchmark", help="Group the results by benchmark or by batch run")
+    parser.add_argument("--top", type=int, default=10, help="Number of regressions reported per group")
+    parser.add_argument("--max-ted", type=int, help="Count larger TEDs in the last bin of the histogram")
+
+    args = parser.parse_args()
+    print(write_report(args.database, args.output, args.benchmark, args.by, args.top, args.max_ted))